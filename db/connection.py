@@ -2,7 +2,8 @@
 
 from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import AdaptedConnection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from urllib.parse import quote_plus
 from dotenv import load_dotenv
 import os
@@ -58,6 +59,9 @@ engine = create_engine(
 @event.listens_for(Engine, "connect")
 def set_connection_settings(dbapi_connection, connection_record):
     """Configure connection settings"""
+    if isinstance(dbapi_connection, AdaptedConnection):
+        # asyncpg: timezone already set via server_settings
+        return
     try:
         # Set timezone to UTC
         with dbapi_connection.cursor() as cursor:
@@ -79,6 +83,39 @@ SessionLocal = sessionmaker(
     future=True,
 )
 
+# ------------------------------------------------------------------
+# Async engine (asyncpg) for hot read endpoints — does not block the
+# event loop (SSE streams keep flowing while queries run).
+# ------------------------------------------------------------------
+ASYNC_DATABASE_URL = (
+    f"postgresql+asyncpg://{DB_USERNAME}:{pw_quoted}"
+    f"@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    connect_args={
+        "timeout": 10,
+        # same session settings as the sync engine (set_connection_settings)
+        "server_settings": {
+            "application_name": "CRM_Backend_async",
+            "timezone": "UTC",
+        },
+    },
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 # Base class for models
 Base = declarative_base()
 
@@ -94,6 +131,16 @@ def get_db():
     finally:
         db.close()
 
+async def async_query(stmt, params=None, consume=lambda r: r.mappings().all()):
+    """
+    Run ONE statement on its own pooled connection and return consume(result).
+    Lets independent queries run concurrently via asyncio.gather
+    (a single AsyncSession cannot run statements in parallel).
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(stmt, params or {})
+        return consume(result)
+
 # Health check function - FIXED for SQLAlchemy 2.0
 def check_database_connection():
     """
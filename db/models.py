@@ -279,6 +279,73 @@ class NseCmIntraday1Min(Base):
             f"{self.trade_date} {self.interval_start}>"
         )
 
+
+# ============================================================
+# 3b) CANDLE ROLLUPS (5m / 15m / 30m / 1h from intraday,
+#      1w / 1M from bhavcopy) – refreshed incrementally by ingestion
+# ============================================================
+
+class NseCmCandleRollup(Base):
+    __tablename__ = "nse_cm_candle_rollup"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+
+    token_id = Column(
+        Integer,
+        ForeignKey("nse_cm_securities.token_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    # "5m" / "15m" / "30m" / "1h" / "1w" / "1M"
+    resolution = Column(String(4), nullable=False)
+
+    # Session-anchored bucket start (09:15 IST of the first day in bucket)
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+
+    # First trade_date inside the bucket
+    trade_date = Column(Date, nullable=False)
+
+    open_price = Column(Numeric(14, 4), nullable=True)
+    high_price = Column(Numeric(14, 4), nullable=True)
+    low_price = Column(Numeric(14, 4), nullable=True)
+    close_price = Column(Numeric(14, 4), nullable=True)
+    last_price = Column(Numeric(14, 4), nullable=True)
+
+    volume = Column(BigInteger, nullable=True)
+    bars = Column(Integer, nullable=False, default=0)  # source rows folded in
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "token_id", "resolution", "bucket_start",
+            name="uq_candle_rollup_token_res_bucket",
+        ),
+        # ingestion refresh: finer level rows of the current bucket, all tokens
+        Index("ix_candle_rollup_res_bucket", "resolution", "bucket_start"),
+    )
+
+    def __repr__(self):
+        return (
+            f"<NseCmCandleRollup token={self.token_id} "
+            f"{self.resolution} {self.bucket_start}>"
+        )
+
+
+class NseCmRollupWatermark(Base):
+    __tablename__ = "nse_cm_rollup_watermark"
+
+    # One row per trade_date: newest CM30_MKT seq folded into every intraday
+    # rollup level of that day (written in the rollup refresh transaction)
+    trade_date = Column(Date, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<NseCmRollupWatermark {self.trade_date} seq={self.seq}>"
+
+
 class PaymentToken(Base, TimestampMixin):
     __tablename__ = "payment_token"
 
@@ -344,6 +411,13 @@ class NseCmIndex1Min(Base):
             "trade_date",
             "interval_start",
         ),
+        # ✅ routes filter by index_id (market-and-sectors snapshot / sparkline / historical)
+        Index(
+            "ix_index_id_date_time",
+            "index_id",
+            "trade_date",
+            "interval_start",
+        ),
     )
 
     def __repr__(self):
@@ -733,3 +807,50 @@ class GrokRecommendation(Base):
         UniqueConstraint("trade_date", "exchange", "token", name="uq_grok_reco_day_ex_tok"),
     )
 
+
+
+# ============================================================
+# ANGEL ONE CANDLE HISTORY (signals) – fetched incrementally
+# ============================================================
+
+class AngelCandle(Base):
+    __tablename__ = "angel_candle"
+
+    exchange = Column(String(10), primary_key=True)
+    token = Column(String(32), primary_key=True)
+    interval = Column(String(16), primary_key=True)           # THIRTY_MINUTE / ONE_DAY / ...
+    ts = Column(DateTime(timezone=True), primary_key=True)    # bar start (Angel timestamp)
+
+    open_price = Column(Numeric(14, 4), nullable=True)
+    high_price = Column(Numeric(14, 4), nullable=True)
+    low_price = Column(Numeric(14, 4), nullable=True)
+    close_price = Column(Numeric(14, 4), nullable=True)
+    volume = Column(BigInteger, nullable=True)
+
+    def __repr__(self):
+        return f"<AngelCandle {self.exchange}:{self.token} {self.interval} {self.ts}>"
+
+
+class AngelCandleSync(Base):
+    """Per series: newest stored bar + when Angel was last asked (skip calls with nothing new)."""
+    __tablename__ = "angel_candle_sync"
+
+    exchange = Column(String(10), primary_key=True)
+    token = Column(String(32), primary_key=True)
+    interval = Column(String(16), primary_key=True)
+
+    covered_from = Column(DateTime(timezone=True), nullable=True)  # history is complete from here on
+    last_ts = Column(DateTime(timezone=True), nullable=True)       # newest stored bar
+    synced_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class AngelIndicatorState(Base):
+    """Checkpointed incremental indicator state per candle series (see routes/AngelOne/indicators.py)."""
+    __tablename__ = "angel_indicator_state"
+
+    exchange = Column(String(10), primary_key=True)
+    token = Column(String(32), primary_key=True)
+    interval = Column(String(16), primary_key=True)
+
+    state = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
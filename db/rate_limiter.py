@@ -0,0 +1,248 @@
+# db/rate_limiter.py
+
+"""
+Cluster-wide token buckets for outbound broker APIs (Redis + Lua).
+
+Every process (producer leader, /signals/once, scripts) draws from the
+same named bucket, so together they stay under the broker's published
+limits instead of each sleeping a fixed pause:
+
+    await get_bucket("angel:quote").acquire()    # asyncio
+    get_bucket("angel:login").acquire_sync()     # threads / scripts
+
+The refill + take runs atomically in one Lua script on the Redis server
+clock (hash ratelimit:<name> = {tokens, ts}). A caller leases up to
+`lease` tokens per round trip and spends them locally; a lease is only
+valid for lease/rate seconds, so unused tokens cannot pile up into a
+burst above the limit. When the bucket is empty the script returns how
+long until the next token and the caller waits exactly that long.
+
+If Redis is unreachable the bucket degrades to a per-process bucket with
+the same numbers (logged), so broker calls never hang on Redis.
+
+A bucket may be used from several event loops (the producer loop and the
+asyncio.run inside build_signals' worker thread) and from plain threads:
+the lease and fallback state sit behind one threading.Lock, and each loop
+gets its own asyncio.Lock for serializing its Redis round trips.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+from redis.exceptions import NoScriptError
+
+from db.redis_pool import get_async_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ratelimit:"
+
+_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1])
+local ts = tonumber(b[2])
+if tokens == nil or ts == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+local wait = 0
+if granted == 0 then
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+return {granted, wait}
+"""
+_SHA = hashlib.sha1(_LUA.encode()).hexdigest()
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+# Angel SmartAPI published limits. Per-minute caps are folded into the
+# sustained rate (quote: 10/s but 500/min -> 8.3/s), the per-second cap is
+# the burst.
+BUCKETS: Dict[str, Tuple[float, int]] = {
+    "angel:quote": (_env_float("RATE_ANGEL_QUOTE_PER_SEC", 8.0), int(_env_float("RATE_ANGEL_QUOTE_BURST", 10))),
+    "angel:candle": (_env_float("RATE_ANGEL_CANDLE_PER_SEC", 3.0), int(_env_float("RATE_ANGEL_CANDLE_BURST", 3))),
+    "angel:login": (_env_float("RATE_ANGEL_LOGIN_PER_SEC", 1.0), int(_env_float("RATE_ANGEL_LOGIN_BURST", 1))),
+}
+RATE_LEASE_FRACTION = _env_float("RATE_LEASE_FRACTION", 0.25)  # of burst, per Redis round trip
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, burst: int, lease: Optional[int] = None):
+        self.name = name
+        self.key = KEY_PREFIX + name
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.lease = lease or max(1, int(self.burst * RATE_LEASE_FRACTION))
+
+        # local lease
+        self._tokens = 0
+        self._expires = 0.0
+
+        # per-process fallback bucket (Redis down)
+        self._fb_tokens = float(self.burst)
+        self._fb_ts = time.monotonic()
+        self._fb_warned = 0.0
+
+        self._lease_lock = threading.Lock()  # lease + fallback state, every path
+        self._thread_lock = threading.Lock()  # sync callers: one Redis round trip at a time
+        self._async_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+        # metrics
+        self.granted_local = 0
+        self.redis_calls = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.fallbacks = 0
+
+    # ---------------- shared bits ----------------
+    def _take_local(self) -> bool:
+        with self._lease_lock:
+            if self._tokens > 0 and time.monotonic() < self._expires:
+                self._tokens -= 1
+                self.granted_local += 1
+                return True
+            self._tokens = 0
+            return False
+
+    def _store_lease(self, granted: int) -> None:
+        with self._lease_lock:
+            # another loop / thread may still hold a lease: add to it instead of dropping it
+            live = self._tokens if time.monotonic() < self._expires else 0
+            self._tokens = live + granted - 1
+            self._expires = time.monotonic() + (live + granted) / self.rate
+
+    def _fallback(self, err: Exception) -> Tuple[int, int]:
+        """Same bucket math in-process. Returns (granted, wait_ms)."""
+        with self._lease_lock:
+            self.fallbacks += 1
+            now = time.monotonic()
+            if now - self._fb_warned > 60:
+                self._fb_warned = now
+                logger.warning(f"Rate limiter {self.name}: Redis unavailable, using per-process bucket: {err}")
+            self._fb_tokens = min(self.burst, self._fb_tokens + (now - self._fb_ts) * self.rate)
+            self._fb_ts = now
+            granted = min(self.lease, int(self._fb_tokens))
+            self._fb_tokens -= granted
+            wait_ms = 0 if granted else math.ceil((1 - self._fb_tokens) * 1000 / self.rate)
+            return granted, wait_ms
+
+    def _args(self) -> Tuple[Any, ...]:
+        return (_SHA, 1, self.key, self.rate, self.burst, self.lease)
+
+    def _wait_for(self, wait_ms: int) -> float:
+        # small jitter so waiting processes do not retry in lockstep
+        s = max(wait_ms, 1) / 1000.0 * random.uniform(1.0, 1.2)
+        self.waits += 1
+        self.wait_seconds += s
+        return s
+
+    # ---------------- asyncio ----------------
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = self._async_locks.get(loop)
+        if lock is None:
+            with self._lease_lock:
+                for old in [lp for lp in list(self._async_locks.keys()) if lp.is_closed()]:
+                    self._async_locks.pop(old, None)
+                lock = self._async_locks.setdefault(loop, asyncio.Lock())
+        return lock
+
+    async def _redis_take(self) -> Tuple[int, int]:
+        self.redis_calls += 1
+        r = get_async_redis(decode=True)
+        try:
+            res = await r.evalsha(*self._args())
+        except NoScriptError:
+            await r.script_load(_LUA)
+            res = await r.evalsha(*self._args())
+        return int(res[0]), int(res[1])
+
+    async def acquire(self) -> None:
+        """Wait for one permit."""
+        async with self._lock():
+            while not self._take_local():
+                try:
+                    granted, wait_ms = await self._redis_take()
+                except Exception as e:
+                    granted, wait_ms = self._fallback(e)
+                if granted:
+                    self._store_lease(granted)
+                    return
+                await asyncio.sleep(self._wait_for(wait_ms))
+
+    # ---------------- sync ----------------
+    def _redis_take_sync(self) -> Tuple[int, int]:
+        self.redis_calls += 1
+        r = get_sync_redis(decode=True)
+        try:
+            res = r.evalsha(*self._args())
+        except NoScriptError:
+            r.script_load(_LUA)
+            res = r.evalsha(*self._args())
+        return int(res[0]), int(res[1])
+
+    def acquire_sync(self) -> None:
+        with self._thread_lock:
+            while not self._take_local():
+                try:
+                    granted, wait_ms = self._redis_take_sync()
+                except Exception as e:
+                    granted, wait_ms = self._fallback(e)
+                if granted:
+                    self._store_lease(granted)
+                    return
+                time.sleep(self._wait_for(wait_ms))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "rate_per_sec": self.rate,
+            "burst": self.burst,
+            "lease": self.lease,
+            "granted_local": self.granted_local,
+            "redis_calls": self.redis_calls,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "fallbacks": self.fallbacks,
+        }
+
+
+_registry: Dict[str, TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def get_bucket(name: str) -> TokenBucket:
+    b = _registry.get(name)
+    if b is not None:
+        return b
+    with _registry_lock:
+        if name not in _registry:
+            if name not in BUCKETS:
+                raise KeyError(f"unknown rate-limit bucket {name!r}")
+            rate, burst = BUCKETS[name]
+            _registry[name] = TokenBucket(name, rate, burst)
+        return _registry[name]
+
+
+def rate_limiter_metrics() -> Dict[str, Any]:
+    return {name: b.metrics() for name, b in _registry.items()}
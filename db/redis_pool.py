@@ -0,0 +1,203 @@
+# db/redis_pool.py
+
+"""
+Process-wide Redis connection pools (sync + asyncio).
+
+Every Redis user borrows from here instead of calling Redis.from_url()
+per call / per request:
+
+    get_sync_redis()              -> redis.Redis           (str in/out)
+    get_sync_redis(decode=False)  -> redis.Redis           (bytes in/out)
+    get_async_redis(...)          -> redis.asyncio.Redis   (same)
+    get_async_pubsub_redis()      -> redis.asyncio.Redis   for long-lived pubsub
+                                     listeners (own small pool, no read timeout)
+
+Pools are BlockingConnectionPool: when all connections are busy a caller
+waits up to REDIS_POOL_TIMEOUT seconds instead of opening more sockets.
+Clients are thin wrappers around the shared pool (cached per decode mode).
+
+init_redis_pools() / close_redis_pools() are called from the app lifespan;
+pools are also created lazily so scripts and scheduler jobs just work.
+Asyncio pools are bound to an event loop, so they are kept per loop: code
+running its own loop in a worker thread (asyncio.run inside to_thread)
+gets its own pool and never touches the app loop's one. Such callers
+release theirs with close_loop_redis_pools() before the loop ends; pools
+of loops that are already closed are dropped on the next lookup.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+import redis
+import redis.asyncio as aredis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_ASYNC_MAX_CONNECTIONS = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", "100"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "10"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))
+REDIS_PUBSUB_MAX_CONNECTIONS = int(os.getenv("REDIS_PUBSUB_MAX_CONNECTIONS", "8"))
+
+
+def _pool_kwargs(decode: bool, max_connections: int, socket_timeout: Optional[float] = REDIS_SOCKET_TIMEOUT) -> Dict[str, Any]:
+    return {
+        "max_connections": max_connections,
+        "timeout": REDIS_POOL_TIMEOUT,
+        "decode_responses": decode,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "socket_timeout": socket_timeout,
+        "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+    }
+
+
+# ======================================================================
+#  Sync
+# ======================================================================
+_sync_lock = threading.Lock()
+_sync_pools: Dict[bool, redis.BlockingConnectionPool] = {}
+_sync_clients: Dict[bool, redis.Redis] = {}
+
+
+def get_sync_redis(decode: bool = True) -> redis.Redis:
+    client = _sync_clients.get(decode)
+    if client is not None:
+        return client
+    with _sync_lock:
+        if decode not in _sync_clients:
+            pool = redis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_kwargs(decode, REDIS_MAX_CONNECTIONS))
+            _sync_pools[decode] = pool
+            _sync_clients[decode] = redis.Redis(connection_pool=pool)
+        return _sync_clients[decode]
+
+
+# ======================================================================
+#  Asyncio
+# ======================================================================
+# loop -> {(decode, pubsub): (pool, client)}
+_async_lock = threading.Lock()
+_async_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[bool, bool], Tuple[aredis.BlockingConnectionPool, aredis.Redis]]]" = weakref.WeakKeyDictionary()
+
+
+def _async_client(decode: bool, pubsub: bool) -> aredis.Redis:
+    key = (decode, pubsub)
+    loop = asyncio.get_running_loop()
+    entry = (_async_pools.get(loop) or {}).get(key)
+    if entry is not None:
+        return entry[1]
+    with _async_lock:
+        for old in [lp for lp in list(_async_pools.keys()) if lp.is_closed()]:
+            # its loop is gone, nothing can await disconnect(); let GC close the sockets
+            _async_pools.pop(old, None)
+        pools = _async_pools.setdefault(loop, {})
+        if key not in pools:
+            if pubsub:
+                # listeners sit in read() while channels are quiet -> no socket read timeout
+                kwargs = _pool_kwargs(decode, REDIS_PUBSUB_MAX_CONNECTIONS, socket_timeout=None)
+            else:
+                kwargs = _pool_kwargs(decode, REDIS_ASYNC_MAX_CONNECTIONS)
+            pool = aredis.BlockingConnectionPool.from_url(REDIS_URL, **kwargs)
+            pools[key] = (pool, aredis.Redis(connection_pool=pool))
+        return pools[key][1]
+
+
+def get_async_redis(decode: bool = True) -> aredis.Redis:
+    return _async_client(decode, pubsub=False)
+
+
+def get_async_pubsub_redis(decode: bool = True) -> aredis.Redis:
+    return _async_client(decode, pubsub=True)
+
+
+# ======================================================================
+#  Lifespan
+# ======================================================================
+async def init_redis_pools() -> bool:
+    """Create both pools and ping once. Returns False (logged) if Redis is down."""
+    try:
+        get_sync_redis(decode=True)
+        get_sync_redis(decode=False)
+        await get_async_redis(decode=True).ping()
+        get_async_redis(decode=False)
+        return True
+    except Exception as e:
+        logger.warning(f"Redis not reachable at startup: {e}")
+        return False
+
+
+async def close_loop_redis_pools() -> None:
+    """Disconnect the asyncio pools of the running loop (short-lived loops call this last)."""
+    with _async_lock:
+        pools = _async_pools.pop(asyncio.get_running_loop(), None) or {}
+    for pool, _ in pools.values():
+        try:
+            await pool.disconnect()
+        except Exception as e:
+            logger.warning(f"Error closing async Redis pool: {e}")
+
+
+async def close_redis_pools() -> None:
+    await close_loop_redis_pools()
+    with _async_lock:
+        _async_pools.clear()
+
+    with _sync_lock:
+        for pool in _sync_pools.values():
+            try:
+                pool.disconnect()
+            except Exception as e:
+                logger.warning(f"Error closing Redis pool: {e}")
+        _sync_pools.clear()
+        _sync_clients.clear()
+
+
+# ======================================================================
+#  Metrics
+# ======================================================================
+def _sync_pool_stats(pool: redis.BlockingConnectionPool) -> Dict[str, Any]:
+    created = len(getattr(pool, "_connections", []))
+    idle = sum(1 for c in list(getattr(pool, "pool").queue) if c is not None) if hasattr(pool, "pool") else None
+    return {
+        "max_connections": pool.max_connections,
+        "created": created,
+        "idle": idle,
+        "in_use": created - idle if idle is not None else None,
+    }
+
+
+def _async_pool_stats(pool: aredis.BlockingConnectionPool) -> Dict[str, Any]:
+    idle = len(getattr(pool, "_available_connections", []))
+    in_use = len(getattr(pool, "_in_use_connections", []))
+    return {
+        "max_connections": pool.max_connections,
+        "created": idle + in_use,
+        "idle": idle,
+        "in_use": in_use,
+    }
+
+
+def redis_pool_metrics() -> Dict[str, Any]:
+    def _name(decode: bool, pubsub: bool = False) -> str:
+        return ("pubsub_" if pubsub else "") + ("text" if decode else "bytes")
+
+    return {
+        "url_host": REDIS_URL.rsplit("@", 1)[-1],
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "sync": {_name(d): _sync_pool_stats(p) for d, p in _sync_pools.items()},
+        "async": {
+            _name(*k) + (f"@loop{i}" if i else ""): _async_pool_stats(p)
+            for i, pools in enumerate(list(_async_pools.values()))
+            for k, (p, _) in pools.items()
+        },
+    }
@@ -2,8 +2,6 @@
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
 from contextlib import asynccontextmanager
 import uvicorn
 import logging
@@ -15,7 +13,13 @@ from zoneinfo import ZoneInfo
 
 from fastapi.responses import JSONResponse
 
-from db.connection import engine, check_database_connection
+from db.connection import engine, async_engine, check_database_connection
+from db.redis_pool import init_redis_pools, close_redis_pools, redis_pool_metrics
+from db.rate_limiter import rate_limiter_metrics
+from utils.Http.json_response import AppJSONResponse
+from utils.Http.response_middleware import ResponseEncodingMiddleware
+from utils.Market.intraday_store import store as intraday_store
+from utils.Market.quote_hub import hub as quote_hub
 from db import models
 
 from sftp.NSE.sftp_client import SFTPClient
@@ -26,7 +30,7 @@ from config import LIVE_DATA_FETCH
 from utils.NSE_Formater.data_ingestor import process_cm30_for_date, process_cm30_security_for_date
 from utils.NSE_Formater.bhavcopy_ingestor import process_cm_bhavcopy_for_date
 
-from routes.NSE import Top_Marqee, Todays_Stock, Market_And_Sectors, Preopen_Movers, Most_Traded, Historical_data
+from routes.NSE import Top_Marqee, Todays_Stock, Market_And_Sectors, Preopen_Movers, Most_Traded, Historical_data, Live_Quotes
 from routes.Cloude_Data import corporateAction, faoOiParticipant, fiidiiTrade, resultCalendar, ipo, earnometer
 from routes.Cloude_Data.News import news
 from routes.static_proxy import static_proxy
@@ -51,7 +55,7 @@ from routes.SEO import Seo_Keyword
 
 # Angel One Market Movement (LIVE)
 from routes.AngelOne import live_server  # includes router + start_background_producer
-from routes.AngelOne.angel_login import login_and_get_token  
+from routes.AngelOne import angel_session
 
 #crm
 from routes.Web import PaymentToken
@@ -181,9 +185,6 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Starting Backend...")
 
     try:
-        FastAPICache.init(InMemoryBackend(), prefix="fastapi-cache")
-        logger.info("✅ Cache initialized")
-
         if not check_database_connection():
             raise Exception("Database connection failed")
         logger.info("✅ Database connection verified")
@@ -191,6 +192,14 @@ async def lifespan(app: FastAPI):
         models.Base.metadata.create_all(bind=engine, checkfirst=True)
         logger.info("✅ DB tables created/verified")
 
+        if await init_redis_pools():
+            logger.info("✅ Redis connection pools ready")
+        else:
+            logger.warning("⚠️ Redis not reachable; pools will connect lazily")
+
+        # ✅ today's 1m bars in worker memory (DB backfill + per-seq broadcast)
+        intraday_store.start()
+
         if LIVE_DATA_FETCH:
             # ✅ CM30 every minute
             scheduler.add_job(_cm30_job, "interval", minutes=1)
@@ -199,14 +208,16 @@ async def lifespan(app: FastAPI):
             # Because file upload timing can vary day-to-day.
             scheduler.add_job(_bhavcopy_job, "interval", minutes=10)
 
-        # login_and_get_token()  # one-time at startup
-        scheduler.add_job(login_and_get_token, "interval", hours=6)
+        # ✅ Angel session: shared via Redis, one login per cluster per window
+        angel_session.start()
+        scheduler.add_job(angel_session.rotate_job, "interval", hours=6)
 
         scheduler.start()
         logger.info("✅ Scheduler started")
 
         # ✅ ANGEL ONE LIVE PRODUCER (multi-worker safe)
-        # Only ONE worker becomes leader and publishes snapshots to Redis;
+        # Every worker produces a consistent-hash slice of the universe; ONE
+        # worker (leader) merges the slices and publishes snapshots to Redis;
         # All workers can serve SSE and all clients see identical snapshots.
         # try:
         #     live_server.start_background_producer(
@@ -219,7 +230,6 @@ async def lifespan(app: FastAPI):
         #         lookback_days_30m=60,
         #         lookback_days_day=520,
         #         quote_chunk_size=50,
-        #         quote_sleep_s=0.2,
         #         candle_concurrency=15,
         #     )
         #     logger.info("✅ Angel One live producer started (leader-lock enabled)")
@@ -243,6 +253,40 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"Error while stopping scheduler: {e}", exc_info=True)
 
+        try:
+            await async_engine.dispose()
+            logger.info("🛑 Async DB pool closed")
+        except Exception as e:
+            logger.error(f"Error while closing async DB pool: {e}", exc_info=True)
+
+        try:
+            await live_server.broadcaster.stop()
+        except Exception as e:
+            logger.error(f"Error while stopping SSE broadcaster: {e}", exc_info=True)
+
+        try:
+            await quote_hub.stop()
+            logger.info("🛑 Live quote hub stopped")
+        except Exception as e:
+            logger.error(f"Error while stopping live quote hub: {e}", exc_info=True)
+
+        try:
+            await intraday_store.stop()
+            logger.info("🛑 Intraday store stopped")
+        except Exception as e:
+            logger.error(f"Error while stopping intraday store: {e}", exc_info=True)
+
+        try:
+            await angel_session.stop()
+        except Exception as e:
+            logger.error(f"Error while stopping Angel session listener: {e}", exc_info=True)
+
+        try:
+            await close_redis_pools()
+            logger.info("🛑 Redis pools closed")
+        except Exception as e:
+            logger.error(f"Error while closing Redis pools: {e}", exc_info=True)
+
         logger.info("🛑 Backend shutdown complete.")
 
 
@@ -253,6 +297,14 @@ app = FastAPI(
     title="CRM Backend API",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=AppJSONResponse,
+)
+
+# ✅ Cache-Control / ETag (304) / gzip-br; added first => runs inside CORS,
+# so 304s still carry the CORS headers
+app.add_middleware(
+    ResponseEncodingMiddleware,
+    minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024")),
 )
 
 app.add_middleware(
@@ -278,6 +330,18 @@ def health_check():
         raise HTTPException(status_code=503, detail="Service unhealthy")
 
 
+@app.get("/api/v1/health/redis")
+def redis_health():
+    """Per-worker Redis pool usage (created / idle / in-use connections) + rate-limit buckets."""
+    return {**redis_pool_metrics(), "rate_limits": rate_limiter_metrics()}
+
+
+@app.get("/api/v1/health/intraday")
+def intraday_health():
+    """Per-worker in-memory intraday store (session, ids, seq, backfills)."""
+    return intraday_store.metrics()
+
+
 # -------------------------------
 # Register routers
 # -------------------------------
@@ -313,6 +377,7 @@ try:
     app.include_router(Market_And_Sectors.router, prefix="/api/v1")
     app.include_router(Todays_Stock.router, prefix="/api/v1")
     app.include_router(Top_Marqee.router, prefix="/api/v1")
+    app.include_router(Live_Quotes.router, prefix="/api/v1")  # ✅ WebSocket live quotes
 
     #cloude data
     app.include_router(earnometer.router, prefix="/api/v1")
@@ -360,6 +425,9 @@ if __name__ == "__main__":
         port=int(os.getenv("PORT", "8000")),
         reload=True,
         log_level=os.getenv("LOG_LEVEL", "info").lower(),
+        # /live/ws fans one frame out per client: compressing each one per socket
+        # cost about a fifth of the worker CPU in scripts/ws_load_test
+        ws_per_message_deflate=False,
         reload_excludes=[
             "static/*",
             "vbc_token_cache/*",
@@ -7,11 +7,15 @@ score crosses a threshold.
 Notes:
 - We keep the output JSON-only (no markdown) so you can store/stream it directly.
 - This does NOT do any news search by itself. If you want news, pass it in `news_context`.
+- generate_trade_plans_batch() sends several symbols in one prompt (JSON array in,
+  JSON array out); items that fail validate_plan() come back as None so the caller
+  can retry them one by one (see grok_batch.py).
 """
 
 from __future__ import annotations
 
 import json
+import math
 from typing import Any, Dict, List, Optional
 
 import requests
@@ -21,16 +25,23 @@ from config import GROK_API_KEY
 
 GROK_URL = "https://api.x.ai/v1/chat/completions"
 GROK_MODEL = "grok-4-latest"
+GROK_CONNECT_TIMEOUT_SEC = 10  # on top of each call's read timeout
 GROK_HEADERS = {
     "Content-Type": "application/json",
     "Authorization": f"Bearer {GROK_API_KEY}",
 }
 
 
-def _json_only_schema() -> str:
-    """Strict schema to force JSON output."""
+SYSTEM_PROMPT = (
+    "You are a trading assistant. Create a practical intraday trade plan using ONLY the provided data. "
+    "No guarantees. Be conservative and include risk notes."
+)
+
+PLAN_KEYS = ("symbol", "exchange", "direction", "entry", "stop_loss", "targets", "confidence", "rationale", "risk_notes")
+
+
+def _plan_schema() -> str:
     return (
-        "Return ONLY valid JSON (no markdown). Schema:\n"
         "{\n"
         "  'symbol': str,\n"
         "  'exchange': str,\n"
@@ -44,6 +55,11 @@ def _json_only_schema() -> str:
         "  'risk_notes': [str, ...],\n"
         "  'news': [ {'title': str, 'source': str, 'published_at': str, 'url': str, 'accuracy': number}, ... ]\n"
         "}\n"
+    )
+
+
+def _plan_rules() -> str:
+    return (
         "Rules:\n"
         "- Use 0..100 for confidence and news accuracy.\n"
         "- If you have no news, return an empty list for 'news'.\n"
@@ -51,7 +67,22 @@ def _json_only_schema() -> str:
     )
 
 
-def generate_trade_plan_with_grok(
+def _json_only_schema() -> str:
+    """Strict schema to force JSON output."""
+    return "Return ONLY valid JSON (no markdown). Schema:\n" + _plan_schema() + _plan_rules()
+
+
+def _json_array_schema() -> str:
+    """Batch variant: one plan per input item, same order."""
+    return (
+        "Return ONLY a valid JSON array (no markdown), one object per entry of 'items', "
+        "in the same order, each copying that item's 'symbol' and 'exchange'. Object schema:\n"
+        + _plan_schema()
+        + _plan_rules()
+    )
+
+
+def plan_input(
     *,
     symbol: str,
     exchange: str,
@@ -62,69 +93,85 @@ def generate_trade_plan_with_grok(
     indicators_day: Optional[Dict[str, Any]] = None,
     local_plan: Optional[Dict[str, Any]] = None,
     news_context: Optional[List[Dict[str, Any]]] = None,
-    timeout_sec: int = 20,
 ) -> Dict[str, Any]:
-    """
-    Call Grok and return a structured plan.
-
-    `local_plan` is a precomputed plan (entry/SL/targets) which Grok should validate and
-    add rational reasons for.
-    """
-    indicators_30m = indicators_30m or {}
-    indicators_day = indicators_day or {}
-    news_context = news_context or []
-
-    system = (
-        "You are a trading assistant. Create a practical intraday trade plan using ONLY the provided data. "
-        "No guarantees. Be conservative and include risk notes."
-    )
-
-    user = {
+    """The per-symbol part of the prompt (also the cache identity of a plan)."""
+    return {
         "symbol": symbol,
         "exchange": exchange,
         "score": score,
         "signal": signal,
         "quote_full": quote_full,
         "indicators": {
-            "30m": indicators_30m,
-            "day": indicators_day,
+            "30m": indicators_30m or {},
+            "day": indicators_day or {},
         },
         "suggested_plan": local_plan or {},
-        "news_context": news_context,
-        "instruction": _json_only_schema(),
+        "news_context": news_context or [],
     }
 
+
+def estimate_tokens(obj: Any) -> int:
+    """Rough prompt size (~4 chars per token) for batch budgeting."""
+    text = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False, default=str)
+    return math.ceil(len(text) / 4)
+
+
+def _is_num(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def validate_plan(obj: Any, item: Optional[Dict[str, Any]] = None) -> bool:
+    """Schema check for one plan; with `item`, it must also be that item's plan."""
+    if not isinstance(obj, dict) or any(k not in obj for k in PLAN_KEYS):
+        return False
+    if obj["direction"] not in ("BUY", "SELL"):
+        return False
+    if not _is_num(obj["entry"]) or not _is_num(obj["stop_loss"]):
+        return False
+    if not _is_num(obj["confidence"]) or not 0 <= obj["confidence"] <= 100:
+        return False
+    targets = obj["targets"]
+    if not isinstance(targets, dict) or not all(v is None or _is_num(v) for v in targets.values()):
+        return False
+    if not isinstance(obj["rationale"], list) or not isinstance(obj["risk_notes"], list):
+        return False
+    if not isinstance(obj.get("news", []), list):
+        return False
+    if item is not None:
+        if str(obj["symbol"]).upper() != str(item.get("symbol") or "").upper():
+            return False
+        if str(obj["exchange"]).upper() != str(item.get("exchange") or "").upper():
+            return False
+    return True
+
+
+def _chat(user_content: str, timeout_sec: int) -> str:
     payload = {
         "model": GROK_MODEL,
         "temperature": 0.2,
         "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(user, ensure_ascii=False)},
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
         ],
     }
 
-    r = requests.post(GROK_URL, headers=GROK_HEADERS, json=payload, timeout=(10, 300))
+    r = requests.post(GROK_URL, headers=GROK_HEADERS, json=payload, timeout=(GROK_CONNECT_TIMEOUT_SEC, timeout_sec))
     r.raise_for_status()
     data = r.json()
 
-    content = (
+    return (
         (((data.get("choices") or [None])[0] or {}).get("message") or {}).get("content")
         or ""
     ).strip()
 
-    try:
-        obj = json.loads(content)
-        if isinstance(obj, dict):
-            return obj
-    except Exception:
-        pass
 
-    # Fallback: return raw if model didn't comply
+def _fallback_plan(item: Dict[str, Any], content: str) -> Dict[str, Any]:
+    """Returned when the model didn't comply (keeps the raw answer)."""
     return {
-        "symbol": symbol,
-        "exchange": exchange,
-        "direction": "BUY" if signal == "BUY" else "SELL",
-        "entry": float(quote_full.get("ltp") or 0) or None,
+        "symbol": item["symbol"],
+        "exchange": item["exchange"],
+        "direction": "BUY" if item["signal"] == "BUY" else "SELL",
+        "entry": float((item.get("quote_full") or {}).get("ltp") or 0) or None,
         "stop_loss": None,
         "targets": {"t1": None, "t2": None, "t3": None},
         "timeframe": "intraday",
@@ -134,3 +181,84 @@ def generate_trade_plan_with_grok(
         "news": [],
         "raw": content,
     }
+
+
+def trade_plan_for_input(item: Dict[str, Any], timeout_sec: int = 20) -> Dict[str, Any]:
+    """One Grok call for one plan_input() dict."""
+    content = _chat(json.dumps({**item, "instruction": _json_only_schema()}, ensure_ascii=False), timeout_sec)
+    try:
+        obj = json.loads(content)
+        if isinstance(obj, dict):
+            return obj
+    except Exception:
+        pass
+    return _fallback_plan(item, content)
+
+
+def generate_trade_plan_with_grok(
+    *,
+    symbol: str,
+    exchange: str,
+    score: int,
+    signal: str,
+    quote_full: Dict[str, Any],
+    indicators_30m: Optional[Dict[str, Any]] = None,
+    indicators_day: Optional[Dict[str, Any]] = None,
+    local_plan: Optional[Dict[str, Any]] = None,
+    news_context: Optional[List[Dict[str, Any]]] = None,
+    timeout_sec: int = 20,
+) -> Dict[str, Any]:
+    """
+    Call Grok and return a structured plan.
+
+    `local_plan` is a precomputed plan (entry/SL/targets) which Grok should validate and
+    add rational reasons for.
+    """
+    item = plan_input(
+        symbol=symbol,
+        exchange=exchange,
+        score=score,
+        signal=signal,
+        quote_full=quote_full,
+        indicators_30m=indicators_30m,
+        indicators_day=indicators_day,
+        local_plan=local_plan,
+        news_context=news_context,
+    )
+    return trade_plan_for_input(item, timeout_sec=timeout_sec)
+
+
+def generate_trade_plans_batch(items: List[Dict[str, Any]], timeout_sec: int = 60) -> List[Optional[Dict[str, Any]]]:
+    """
+    One Grok call for several plan_input() dicts.
+
+    Returns one entry per item, in order: the plan if it passed validate_plan() for
+    that item, else None (caller falls back to trade_plan_for_input). An answer that
+    is not a JSON array gives all None; HTTP errors raise.
+    """
+    user = {"items": items, "instruction": _json_array_schema()}
+    content = _chat(json.dumps(user, ensure_ascii=False), timeout_sec)
+
+    try:
+        arr = json.loads(content)
+    except Exception:
+        return [None] * len(items)
+    if isinstance(arr, dict):
+        # some answers wrap the array: {"items": [...]} / {"plans": [...]}
+        arr = next((v for v in arr.values() if isinstance(v, list)), None)
+    if not isinstance(arr, list):
+        return [None] * len(items)
+
+    # match by symbol/exchange first; fall back to position when the model kept the order
+    by_key: Dict[tuple, Dict[str, Any]] = {}
+    for obj in arr:
+        if isinstance(obj, dict):
+            by_key.setdefault((str(obj.get("exchange")).upper(), str(obj.get("symbol")).upper()), obj)
+
+    out: List[Optional[Dict[str, Any]]] = []
+    for i, item in enumerate(items):
+        obj = by_key.get((str(item["exchange"]).upper(), str(item["symbol"]).upper()))
+        if obj is None and i < len(arr):
+            obj = arr[i]
+        out.append(obj if validate_plan(obj, item) else None)
+    return out
@@ -0,0 +1,197 @@
+# routes/AngelOne/angel_client.py
+"""
+Async Angel One SmartAPI client (quotes + candles) on one httpx.AsyncClient.
+
+angel_data.quote_full_bulk / get_candles are blocking calls, so the producer
+pushed every chunk through asyncio.to_thread one at a time. Here:
+
+  - one pooled keep-alive connection set per client (HTTP/2 with
+    ANGEL_HTTP2=1 when the `h2` package is installed)
+  - bounded concurrency per endpoint (quote / candle semaphores); the
+    whole quote universe or candle backlog is issued with gather()
+  - every request first awaits a permit from the cluster-wide token
+    bucket of its endpoint class (db/rate_limiter.py: angel:quote,
+    angel:candle), so no fixed pauses between calls
+  - retries with exponential backoff + full jitter on transport errors,
+    HTTP 429/5xx, Angel rate-limit answers and Angel's retryable error
+    codes (angel_data.RETRY_ERROR_CODES)
+  - one token refresh + retry on 401/403 or token error codes, through
+    the shared AngelSession (coalesced with other rejected requests)
+
+Responses / failure shapes are the same as the sync helpers, so callers
+(parse_quote_map, candle_store) do not change. A client belongs to the
+event loop it was first used on; close it with aclose().
+"""
+import asyncio
+import os
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from db.rate_limiter import get_bucket
+from routes.AngelOne.angel_data import (
+    CANDLE_URL,
+    QUOTE_URL,
+    build_headers,
+    is_rate_limited,
+    is_retryable_error,
+    looks_like_token_issue,
+)
+from routes.AngelOne.angel_session import get_session
+
+ANGEL_HTTP2 = os.getenv("ANGEL_HTTP2", "false").lower() in ("1", "true", "yes", "y")
+ANGEL_QUOTE_CONCURRENCY = int(os.getenv("ANGEL_QUOTE_CONCURRENCY", "3"))
+ANGEL_CANDLE_CONCURRENCY = int(os.getenv("ANGEL_CANDLE_CONCURRENCY", "3"))
+ANGEL_TIMEOUT_SEC = float(os.getenv("ANGEL_TIMEOUT_SEC", "25"))
+ANGEL_BACKOFF_BASE_SEC = float(os.getenv("ANGEL_BACKOFF_BASE_SEC", "0.5"))
+ANGEL_BACKOFF_MAX_SEC = float(os.getenv("ANGEL_BACKOFF_MAX_SEC", "8"))
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# (exchange, symboltoken, interval, fromdate, todate)
+CandleRequest = Tuple[str, str, str, str, str]
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _backoff(attempt: int) -> float:
+    """Full jitter: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(ANGEL_BACKOFF_MAX_SEC, ANGEL_BACKOFF_BASE_SEC * (2 ** attempt)))
+
+
+class AngelClient:
+    def __init__(
+        self,
+        tokens_path: str = "tokens.json",
+        quote_concurrency: int = ANGEL_QUOTE_CONCURRENCY,
+        candle_concurrency: int = ANGEL_CANDLE_CONCURRENCY,
+        http2: bool = ANGEL_HTTP2,
+        timeout: float = ANGEL_TIMEOUT_SEC,
+    ):
+        self.session = get_session(tokens_path)
+        if http2 and not _http2_available():
+            print("[AngelClient] ⚠️ ANGEL_HTTP2 set but 'h2' is not installed; using HTTP/1.1")
+            http2 = False
+        pool = max(1, quote_concurrency) + max(1, candle_concurrency)
+        self._http = httpx.AsyncClient(
+            http2=http2,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool, keepalive_expiry=60.0),
+        )
+        self._quote_sem = asyncio.Semaphore(max(1, quote_concurrency))
+        self._candle_sem = asyncio.Semaphore(max(1, candle_concurrency))
+
+        # metrics
+        self.requests = 0
+        self.retries = 0
+        self.token_refreshes = 0
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def __aenter__(self) -> "AngelClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    # ---------------- core ----------------
+    async def _send(self, url: str, payload: Dict[str, Any], bucket: str) -> Tuple[httpx.Response, str]:
+        await get_bucket(bucket).acquire()
+        self.requests += 1
+        jwt = self.session.get_jwt()
+        return await self._http.post(url, headers=build_headers(jwt), json=payload), jwt
+
+    async def _refresh(self, stale_jwt: str) -> None:
+        # coalesced with every other request that was rejected with the same JWT
+        await self.session.arefresh(stale_jwt)
+        self.token_refreshes += 1
+
+    async def _post(self, url: str, payload: Dict[str, Any], bucket: str, max_retries: int) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """(json body, last error). Body is None when every attempt failed."""
+        last_err: Dict[str, Any] = {}
+        refreshed = False
+        for attempt in range(max_retries):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(_backoff(attempt))
+            try:
+                r, jwt = await self._send(url, payload, bucket)
+            except httpx.TransportError as e:
+                last_err = {"error": str(e)}
+                continue
+
+            if r.status_code in RETRY_STATUS or is_rate_limited(r.text):
+                last_err = {"error": r.text[:200], "status_code": r.status_code}
+                continue
+            if r.status_code in (401, 403):
+                if refreshed:
+                    last_err = {"error": r.text[:200], "status_code": r.status_code}
+                    break
+                await self._refresh(jwt)
+                refreshed = True
+                continue
+            try:
+                r.raise_for_status()
+                data = r.json()
+            except Exception as e:
+                last_err = {"error": str(e), "status_code": r.status_code}
+                break
+
+            if not refreshed and looks_like_token_issue(data):
+                await self._refresh(jwt)
+                refreshed = True
+                continue
+            if is_retryable_error(data):
+                last_err = data
+                continue
+            return data, last_err
+        return None, last_err
+
+    # ---------------- public APIs ----------------
+    async def quote_full(self, exchange_tokens: Dict[str, List[str]], max_retries: int = 3) -> Dict[str, Any]:
+        """Same result as angel_data.quote_full_bulk."""
+        async with self._quote_sem:
+            data, err = await self._post(QUOTE_URL, {"mode": "FULL", "exchangeTokens": exchange_tokens}, "angel:quote", max_retries)
+        if data is None:
+            return {"status": False, "message": "FAILED", "error": err, "data": {"fetched": [], "unfetched": []}}
+        return data
+
+    async def quote_full_many(self, chunks: Sequence[Dict[str, List[str]]], max_retries: int = 3) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*(self.quote_full(c, max_retries) for c in chunks)))
+
+    async def candles(
+        self,
+        exchange: str,
+        symboltoken: str,
+        interval: str,
+        fromdate: str,
+        todate: str,
+        max_retries: int = 6,
+    ) -> Dict[str, Any]:
+        """Same result as angel_data.get_candles."""
+        payload = {
+            "exchange": exchange,
+            "symboltoken": str(symboltoken),
+            "interval": interval,
+            "fromdate": fromdate,
+            "todate": todate,
+        }
+        async with self._candle_sem:
+            data, err = await self._post(CANDLE_URL, payload, "angel:candle", max_retries)
+        if data is None:
+            return {"status": False, "message": "FAILED", "error": err, "data": None}
+        return data
+
+    async def candles_many(self, reqs: Sequence[CandleRequest], max_retries: int = 6) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*(self.candles(*q, max_retries=max_retries) for q in reqs)))
+
+    def metrics(self) -> Dict[str, int]:
+        return {"requests": self.requests, "retries": self.retries, "token_refreshes": self.token_refreshes}
@@ -4,52 +4,48 @@ import socket
 import uuid
 import time
 import random
+import threading
 import requests
 from typing import Dict, Any, List, Optional
 import os
 
-from routes.AngelOne.angel_login import login_and_get_token  # must refresh tokens.json
+from db.rate_limiter import get_bucket
+from routes.AngelOne.angel_session import get_session
 from config import ANGEL_API_KEY
 
 QUOTE_URL = "https://apiconnect.angelbroking.com/rest/secure/angelbroking/market/v1/quote/"
 CANDLE_URL = "https://apiconnect.angelbroking.com/rest/secure/angelbroking/historical/v1/getCandleData"
 
+# Angel error codes (200 + status=false)
+TOKEN_ERROR_CODES = {"AG8001", "AG8002", "AG8003", "AB8050", "AB8051", "AB1010", "AB1011"}
+RETRY_ERROR_CODES = {"AB1004", "AB2001", "AB1019"}  # "something went wrong, try after sometime" / internal / rate
+
 
 # ---------------------------
 # Token manager
 # ---------------------------
 class TokenManager:
+    """
+    Per-call handle on the process-wide AngelSession (angel_session.py):
+    no file read per call, and refresh_and_reload() is coalesced with every
+    other caller that saw the same stale JWT.
+    """
+
     def __init__(self, tokens_path: str = "tokens.json"):
         self.tokens_path = tokens_path
-        self._cache: Optional[Dict[str, Any]] = None
-
-    def load(self) -> Dict[str, Any]:
-        if self._cache is not None:
-            return self._cache
-        with open(self.tokens_path, "r", encoding="utf-8") as f:
-            self._cache = json.load(f)
-        return self._cache
+        self.session = get_session(tokens_path)
+        self._jwt: Optional[str] = None
 
     def get_jwt(self) -> str:
-        data = self.load()
-        jwt = data.get("jwtToken")
-        if not jwt:
-            raise RuntimeError(f"{self.tokens_path} missing 'jwtToken'")
-        return jwt
+        self._jwt = self.session.get_jwt()
+        return self._jwt
 
     def refresh_and_reload(self) -> str:
         """
-        ✅ Actually re-login and write fresh tokens.json, then reload cache.
+        ✅ New JWT after the current one was rejected (reload / coalesced re-login).
         """
-        # try:
-        #     login_and_get_token()  # ✅ MUST: writes new tokens.json
-        # except Exception as e:
-        #     # if login fails, keep old cache cleared so next call tries again
-        #     self._cache = None
-        #     raise RuntimeError(f"Angel login refresh failed: {e}")
-
-        self._cache = None
-        return self.get_jwt()
+        self._jwt = self.session.refresh(self._jwt)
+        return self._jwt
 
 # ---------------------------
 # base helpers
@@ -96,7 +92,7 @@ def build_headers(jwt_token: str) -> Dict[str, str]:
     }
 
 
-def _looks_like_token_issue(resp_json: Dict[str, Any]) -> bool:
+def looks_like_token_issue(resp_json: Dict[str, Any]) -> bool:
     """
     Angel sometimes returns 200 with status=false + message about token.
     We'll detect common patterns.
@@ -108,34 +104,66 @@ def _looks_like_token_issue(resp_json: Dict[str, Any]) -> bool:
     status = resp_json.get("status")
     msg = str(resp_json.get("message", "")).lower()
 
+    if status is False and resp_json.get("errorcode") in TOKEN_ERROR_CODES:
+        return True
     if status is False and any(x in msg for x in ["invalid", "token", "jwt", "session", "expired", "unauthorized"]):
         return True
 
     return False
 
 
+def is_retryable_error(resp_json: Any) -> bool:
+    return (
+        isinstance(resp_json, dict)
+        and resp_json.get("status") is False
+        and resp_json.get("errorcode") in RETRY_ERROR_CODES
+    )
+
+
+def is_rate_limited(body: str) -> bool:
+    """Angel answers rate limits as plain text (often with HTTP 403), not JSON."""
+    b = (body or "")[:300].lower()
+    return "exceeding access rate" in b or "too many requests" in b
+
+
+# keep-alive: one requests.Session per thread instead of a new TCP+TLS handshake per call
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = _local.session = requests.Session()
+    return s
+
+
 def _post_json(
     url: str,
     token_mgr: TokenManager,
     payload: Dict[str, Any],
     timeout: int = 20,
     auto_refresh: bool = True,
+    bucket: str = "angel:quote",
 ) -> Dict[str, Any]:
     """
     Makes request with current token.
     If 401/403 OR response indicates token problem, auto-refresh token and retry once.
+    Every attempt waits for a permit from the shared rate-limit bucket.
     """
+    limiter = get_bucket(bucket)
     jwt = token_mgr.get_jwt()
     headers = build_headers(jwt)
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        limiter.acquire_sync()
+        r = _session().post(url, headers=headers, json=payload, timeout=timeout)
         # if token expired, often 401/403
         if auto_refresh and r.status_code in (401, 403):
             token_mgr.refresh_and_reload()
             jwt2 = token_mgr.get_jwt()
             headers2 = build_headers(jwt2)
-            r2 = requests.post(url, headers=headers2, json=payload, timeout=timeout)
+            limiter.acquire_sync()
+            r2 = _session().post(url, headers=headers2, json=payload, timeout=timeout)
             r2.raise_for_status()
             return r2.json()
 
@@ -143,11 +171,12 @@ def _post_json(
         data = r.json()
 
         # sometimes 200 but status false token error
-        if auto_refresh and _looks_like_token_issue(data):
+        if auto_refresh and looks_like_token_issue(data):
             token_mgr.refresh_and_reload()
             jwt2 = token_mgr.get_jwt()
             headers2 = build_headers(jwt2)
-            r2 = requests.post(url, headers=headers2, json=payload, timeout=timeout)
+            limiter.acquire_sync()
+            r2 = _session().post(url, headers=headers2, json=payload, timeout=timeout)
             r2.raise_for_status()
             return r2.json()
 
@@ -160,7 +189,8 @@ def _post_json(
             token_mgr.refresh_and_reload()
             jwt2 = token_mgr.get_jwt()
             headers2 = build_headers(jwt2)
-            r2 = requests.post(url, headers=headers2, json=payload, timeout=timeout)
+            limiter.acquire_sync()
+            r2 = _session().post(url, headers=headers2, json=payload, timeout=timeout)
             r2.raise_for_status()
             return r2.json()
         raise
@@ -224,7 +254,7 @@ def get_candles(
     last_err: Dict[str, Any] = {}
     for attempt in range(1, max_retries + 1):
         try:
-            data = _post_json(CANDLE_URL, token_mgr, payload, timeout=25, auto_refresh=True)
+            data = _post_json(CANDLE_URL, token_mgr, payload, timeout=25, auto_refresh=True, bucket="angel:candle")
 
             # ✅ AB1004 handling (200 but status=false)
             if isinstance(data, dict) and data.get("status") is False:
@@ -1,5 +1,6 @@
 # routes/AngelOne/angel_login.py
 import json
+import os
 import socket
 import uuid
 import requests
@@ -12,6 +13,9 @@ from config import (
     ANGEL_TOTP_KEY,
 )
 
+from db.rate_limiter import get_bucket
+from routes.AngelOne.angel_session import publish_tokens
+
 LOGIN_URL = "https://apiconnect.angelone.in/rest/auth/angelbroking/user/v1/loginByPassword"
 
 def get_local_ip() -> str:
@@ -32,16 +36,20 @@ def get_mac_address() -> str:
 def get_totp(totp_key: str) -> str:
     return pyotp.TOTP(totp_key).now()
 
-def save_tokens(tokens: dict, filename: str = "tokens.json"):
+def save_tokens(tokens: dict, filename: str = "tokens.json") -> dict:
     payload = {
         "saved_at": datetime.now().isoformat(),
         **tokens
     }
-    with open(filename, "w", encoding="utf-8") as f:
+    # write + rename so readers never see a half-written file
+    tmp = f"{filename}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(payload, f, indent=2)
+    os.replace(tmp, filename)
     print(f"\n✅ Tokens saved to {filename}")
+    return payload
 
-def login_and_get_token() -> dict:
+def login_and_get_token(tokens_path: str = "tokens.json") -> dict:
     totp = get_totp(ANGEL_TOTP_KEY)
     print("current_otp :", totp)
 
@@ -67,6 +75,7 @@ def login_and_get_token() -> dict:
         "state": "python-login",
     }
 
+    get_bucket("angel:login").acquire_sync()
     resp = requests.post(LOGIN_URL, headers=headers, json=payload, timeout=20)
     resp.raise_for_status()
 
@@ -87,8 +96,8 @@ def login_and_get_token() -> dict:
     for k, v in tokens.items():
         print(f"{k}: {v}")
 
-    # ✅ SAVE HERE
-    save_tokens(tokens, "tokens.json")
+    # ✅ SAVE HERE (+ share with every worker / host)
+    publish_tokens(save_tokens(tokens, tokens_path))
     return tokens
 
 if __name__ == "__main__":
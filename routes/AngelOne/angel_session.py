@@ -0,0 +1,304 @@
+# routes/AngelOne/angel_session.py
+"""
+Process-wide Angel One session (JWT + refresh/feed tokens).
+
+TokenManager used to re-read tokens.json on every quote / candle call and
+every process kept its own view of it. Now there is one AngelSession per
+tokens file per process:
+
+  - tokens cached in memory; the file is only re-read when its mtime
+    changes (stat at most every ANGEL_SESSION_STAT_SEC)
+  - every login also stores the tokens in Redis (SESSION_KEY) and
+    publishes them on ROTATED_CH; start() listens there so workers on
+    other hosts switch to the new JWT without touching the file
+  - refresh(stale_jwt) after a 401 / token error is coalesced: inside a
+    process one thread does the work and the rest get its result; across
+    processes a Redis lock (LOGIN_LOCK_KEY) lets one re-login while the
+    others wait for the rotated session
+  - the 6-hourly scheduler job goes through rotate() and is skipped when
+    the shared session is younger than ANGEL_SESSION_MIN_AGE_SEC, so a
+    cluster logs in once per window instead of once per worker
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from db.redis_pool import get_async_pubsub_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "angel:session"
+ROTATED_CH = "angel:session:rotated"
+LOGIN_LOCK_KEY = "angel:session:login"
+
+ANGEL_SESSION_STAT_SEC = float(os.getenv("ANGEL_SESSION_STAT_SEC", "1"))
+ANGEL_SESSION_TTL_SEC = int(os.getenv("ANGEL_SESSION_TTL_SEC", str(24 * 3600)))
+ANGEL_SESSION_MIN_AGE_SEC = int(os.getenv("ANGEL_SESSION_MIN_AGE_SEC", str(5 * 3600)))
+ANGEL_RELOGIN_ON_AUTH_ERROR = os.getenv("ANGEL_RELOGIN_ON_AUTH_ERROR", "true").lower() in ("1", "true", "yes", "y")
+ANGEL_RELOGIN_COOLDOWN_SEC = float(os.getenv("ANGEL_RELOGIN_COOLDOWN_SEC", "60"))
+ANGEL_LOGIN_LOCK_SEC = int(os.getenv("ANGEL_LOGIN_LOCK_SEC", "60"))
+ANGEL_LOGIN_WAIT_SEC = float(os.getenv("ANGEL_LOGIN_WAIT_SEC", "30"))
+
+
+def _newer(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]) -> bool:
+    """a is a strictly newer session than b (saved_at is an ISO timestamp)."""
+    if not a or not a.get("jwtToken"):
+        return False
+    if not b or not b.get("jwtToken"):
+        return True
+    return str(a.get("saved_at") or "") > str(b.get("saved_at") or "")
+
+
+def publish_tokens(tokens: Dict[str, Any]) -> None:
+    """Share a fresh login with every process (best effort; the file is still written)."""
+    try:
+        r = get_sync_redis()
+        data = json.dumps(tokens)
+        r.set(SESSION_KEY, data, ex=ANGEL_SESSION_TTL_SEC)
+        r.publish(ROTATED_CH, data)
+    except Exception as e:
+        logger.warning(f"Angel session not shared via Redis: {e}")
+
+
+def _redis_tokens() -> Optional[Dict[str, Any]]:
+    try:
+        raw = get_sync_redis().get(SESSION_KEY)
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+class AngelSession:
+    def __init__(self, tokens_path: str = "tokens.json"):
+        self.tokens_path = tokens_path
+        self._tokens: Optional[Dict[str, Any]] = None
+        self._mtime: Optional[float] = None
+        self._next_stat = 0.0
+        self._redis_checked = False
+        self._lock = threading.Lock()
+        self._last_login = 0.0
+
+        # metrics
+        self.file_loads = 0
+        self.rotations_in = 0
+        self.refreshes = 0
+        self.coalesced = 0
+        self.logins = 0
+
+    # ---------------- loading ----------------
+    def _adopt(self, tokens: Optional[Dict[str, Any]]) -> bool:
+        if _newer(tokens, self._tokens):
+            self._tokens = tokens
+            return True
+        return False
+
+    def _load_file(self, force: bool = False) -> None:
+        try:
+            mtime = os.stat(self.tokens_path).st_mtime
+        except OSError:
+            return
+        if not force and mtime == self._mtime:
+            return
+        try:
+            with open(self.tokens_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return  # half-written file; next stat retries
+        self._mtime = mtime
+        self.file_loads += 1
+        # a rewritten file wins unless we already hold a newer (Redis) session
+        if data.get("jwtToken") and not _newer(self._tokens, data):
+            self._tokens = data
+
+    def _reload(self) -> None:
+        self._load_file(force=True)
+        self._adopt(_redis_tokens())
+
+    def get_jwt(self) -> str:
+        now = time.monotonic()
+        if self._tokens is None or now >= self._next_stat:
+            # never queue behind a re-login in progress when a JWT is cached
+            if self._lock.acquire(blocking=self._tokens is None):
+                try:
+                    self._next_stat = now + ANGEL_SESSION_STAT_SEC
+                    self._load_file()
+                    if not self._redis_checked:
+                        # first use: another host may already hold a newer session
+                        self._redis_checked = True
+                        self._adopt(_redis_tokens())
+                finally:
+                    self._lock.release()
+        jwt = (self._tokens or {}).get("jwtToken")
+        if not jwt:
+            raise RuntimeError(f"{self.tokens_path} missing 'jwtToken'")
+        return jwt
+
+    def apply_rotation(self, data: Any) -> None:
+        try:
+            tokens = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            if self._adopt(tokens):
+                self.rotations_in += 1
+
+    # ---------------- refresh ----------------
+    def refresh(self, stale_jwt: Optional[str] = None) -> str:
+        """
+        A valid JWT after `stale_jwt` was rejected. Only one caller per
+        process does the work; the others find a different JWT and return it.
+        """
+        with self._lock:
+            cur = (self._tokens or {}).get("jwtToken")
+            if cur and stale_jwt and cur != stale_jwt:
+                self.coalesced += 1
+                return cur
+            self.refreshes += 1
+
+            # rotated elsewhere (file rewritten / another host logged in)?
+            self._reload()
+            cur = (self._tokens or {}).get("jwtToken")
+            if cur and cur != stale_jwt:
+                return cur
+
+            if ANGEL_RELOGIN_ON_AUTH_ERROR and time.monotonic() - self._last_login >= ANGEL_RELOGIN_COOLDOWN_SEC:
+                self._login_coalesced(stale_jwt)
+        return self.get_jwt()
+
+    async def arefresh(self, stale_jwt: Optional[str] = None) -> str:
+        return await asyncio.to_thread(self.refresh, stale_jwt)
+
+    def _login_coalesced(self, stale_jwt: Optional[str]) -> None:
+        """Re-login under the cluster lock, or wait for whoever holds it. Caller holds self._lock."""
+        from routes.AngelOne.angel_login import login_and_get_token
+
+        self._last_login = time.monotonic()
+        owner = uuid.uuid4().hex
+        try:
+            r = get_sync_redis()
+            got = bool(r.set(LOGIN_LOCK_KEY, owner, nx=True, ex=ANGEL_LOGIN_LOCK_SEC))
+        except Exception:
+            r, got = None, True  # no Redis: nothing to coordinate with
+
+        if got:
+            try:
+                self.logins += 1
+                login_and_get_token(self.tokens_path)  # writes the file + publishes
+                self._reload()
+            except Exception as e:
+                logger.error(f"Angel re-login failed: {e}")
+            finally:
+                if r is not None:
+                    try:
+                        if r.get(LOGIN_LOCK_KEY) == owner:
+                            r.delete(LOGIN_LOCK_KEY)
+                    except Exception:
+                        pass
+            return
+
+        deadline = time.monotonic() + ANGEL_LOGIN_WAIT_SEC
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            shared = _redis_tokens()
+            if shared and shared.get("jwtToken") != stale_jwt:
+                self._adopt(shared)
+                return
+
+    # ---------------- scheduled rotation ----------------
+    def rotate(self) -> None:
+        """Scheduler job: log in unless the shared session is still fresh."""
+        shared = _redis_tokens()
+        if shared and shared.get("saved_at"):
+            try:
+                age = (datetime.now() - datetime.fromisoformat(shared["saved_at"])).total_seconds()
+            except ValueError:
+                age = None
+            if age is not None and age < ANGEL_SESSION_MIN_AGE_SEC:
+                with self._lock:
+                    self._adopt(shared)
+                return
+        with self._lock:
+            self._login_coalesced((self._tokens or {}).get("jwtToken"))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "tokens_path": self.tokens_path,
+            "saved_at": (self._tokens or {}).get("saved_at"),
+            "file_loads": self.file_loads,
+            "rotations_in": self.rotations_in,
+            "refreshes": self.refreshes,
+            "coalesced": self.coalesced,
+            "logins": self.logins,
+        }
+
+
+_sessions: Dict[str, AngelSession] = {}
+_sessions_lock = threading.Lock()
+_listener: Optional[asyncio.Task] = None
+
+
+def get_session(tokens_path: str = "tokens.json") -> AngelSession:
+    s = _sessions.get(tokens_path)
+    if s is not None:
+        return s
+    with _sessions_lock:
+        if tokens_path not in _sessions:
+            _sessions[tokens_path] = AngelSession(tokens_path)
+        return _sessions[tokens_path]
+
+
+def rotate_job(tokens_path: str = "tokens.json") -> None:
+    get_session(tokens_path).rotate()
+
+
+# ---------------- rotation listener (app lifespan) ----------------
+async def _listen() -> None:
+    backoff = 0.5
+    while True:
+        pubsub = get_async_pubsub_redis().pubsub()
+        try:
+            await pubsub.subscribe(ROTATED_CH)
+            backoff = 0.5
+            async for msg in pubsub.listen():
+                if msg.get("type") != "message":
+                    continue
+                for s in list(_sessions.values()):
+                    s.apply_rotation(msg["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Angel session listener error, reconnecting in {backoff:.1f}s: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10.0)
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+
+
+def start() -> None:
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.create_task(_listen())
+
+
+async def stop() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        await asyncio.gather(_listener, return_exceptions=True)
+        _listener = None
+
+
+def session_metrics() -> Dict[str, Any]:
+    return {
+        "listening": _listener is not None and not _listener.done(),
+        "sessions": [s.metrics() for s in _sessions.values()],
+    }
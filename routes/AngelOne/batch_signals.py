@@ -0,0 +1,267 @@
+# routes/AngelOne/batch_signals.py
+"""
+Cross-sectional (whole universe at once) indicators + scoring.
+
+build_signals and the producer fast loop used to go symbol by symbol:
+compute_indicators -> score_signal with per-row dict lookups. Here the
+universe is handled as arrays instead:
+
+  batch_indicators(frames)     closes stacked into one (symbols x bars)
+                               matrix, right-aligned (newest bar in the last
+                               column, shorter series NaN-padded on the left);
+                               every recursion advances one column for all
+                               symbols per step. Also returns each series'
+                               IndicatorState committed through its
+                               second-to-last bar, so cold series can be
+                               checkpointed without a per-bar Python replay.
+  score_signals_batch(q, ind)  score_signal as boolean rule masks over
+                               numpy columns; decisions are rendered with the
+                               exact same reasons / checks.
+
+Series only depend on their own bars, so right-aligning by position is
+enough (no calendar alignment needed). score_signal / compute_indicators
+stay the reference implementations; scripts/signal_parity.py compares both
+paths and times a NIFTY500-sized universe.
+"""
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from routes.AngelOne.indicators import (
+    EMA_SPANS,
+    MACD_SIGNAL,
+    RSI_PERIOD,
+    SMA_WINDOWS,
+    IndicatorState,
+    _alpha,
+)
+
+
+# ======================================================================
+#  Indicators
+# ======================================================================
+def stack_closes(frames: Sequence[pd.DataFrame]) -> np.ndarray:
+    """(len(frames), longest) float matrix of closes, right-aligned, NaN-padded."""
+    width = max((len(df) for df in frames), default=0)
+    x = np.full((len(frames), width), np.nan)
+    for i, df in enumerate(frames):
+        c = df["close"].to_numpy(dtype=float)
+        if len(c):
+            x[i, width - len(c):] = c
+    return x
+
+
+def _ewm_step(prev: np.ndarray, x: np.ndarray, alpha: float) -> np.ndarray:
+    # ewm(adjust=False): seeded with the first valid value, NaN before it
+    return np.where(np.isnan(prev), x, alpha * x + (1.0 - alpha) * prev)
+
+
+def _paths(x: np.ndarray) -> Dict[str, np.ndarray]:
+    """Every recursion over all columns; returns the values at the last two columns."""
+    n, width = x.shape
+    nan = np.full(n, np.nan)
+    ema = {s: nan.copy() for s in EMA_SPANS}
+    sig, gain, loss = nan.copy(), nan.copy(), nan.copy()
+    prev_ema, prev_sig, prev_gain, prev_loss = {}, nan, nan, nan
+    a_rsi, a_sig = 1.0 / RSI_PERIOD, _alpha(MACD_SIGNAL)
+
+    for t in range(width):
+        xt = x[:, t]
+        if t == width - 1:
+            prev_ema, prev_sig, prev_gain, prev_loss = dict(ema), sig, gain, loss
+        for s in EMA_SPANS:
+            ema[s] = _ewm_step(ema[s], xt, _alpha(s))
+        sig = _ewm_step(sig, ema[12] - ema[26], a_sig)
+        if t > 0:
+            delta = xt - x[:, t - 1]  # NaN on a series' first bar
+            gain = _ewm_step(gain, np.maximum(delta, 0.0), a_rsi)
+            loss = _ewm_step(loss, np.maximum(-delta, 0.0), a_rsi)
+
+    return {
+        **{f"ema{s}": ema[s] for s in EMA_SPANS},
+        "sig": sig, "gain": gain, "loss": loss,
+        **{f"prev_ema{s}": prev_ema.get(s, nan) for s in EMA_SPANS},
+        "prev_sig": prev_sig, "prev_gain": prev_gain, "prev_loss": prev_loss,
+    }
+
+
+def _num(v: float) -> Optional[float]:
+    return None if math.isnan(v) else float(v)
+
+
+def batch_indicators(frames: Sequence[pd.DataFrame]) -> List[Tuple[IndicatorState, Dict[str, Any]]]:
+    """
+    compute_indicators for every frame (columns time, close; ascending) at
+    once. Returns [(state committed through the second-to-last bar,
+    indicators with the last bar applied)] in input order.
+    """
+    if not frames:
+        return []
+    x = stack_closes(frames)
+    p = _paths(x)
+    counts = (~np.isnan(x)).sum(axis=1)
+    sma = {}
+    for w in SMA_WINDOWS:
+        tail = x[:, -w:] if x.shape[1] >= w else x
+        sma[w] = np.where(counts >= w, np.nansum(tail, axis=1) / w, np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = np.where(p["loss"] == 0, np.nan, 100.0 - 100.0 / (1.0 + p["gain"] / p["loss"]))
+    macd = p["ema12"] - p["ema26"]
+
+    out: List[Tuple[IndicatorState, Dict[str, Any]]] = []
+    for i, df in enumerate(frames):
+        n = int(counts[i])
+        ind = {
+            "ema20": float(p["ema20"][i]),
+            "ema50": float(p["ema50"][i]),
+            "sma50": _num(sma[50][i]),
+            "sma200": _num(sma[200][i]),
+            "rsi14": float(rsi[i]),
+            "macd": float(macd[i]),
+            "macd_signal": float(p["sig"][i]),
+            "macd_hist": float(macd[i] - p["sig"][i]),
+        }
+        out.append((_committed_state(df, x[i], n, p, i), ind))
+    return out
+
+
+def _committed_state(df: pd.DataFrame, row: np.ndarray, n: int, p: Dict[str, np.ndarray], i: int) -> IndicatorState:
+    """IndicatorState after committing all but the last of the row's n bars."""
+    st = IndicatorState()
+    if n < 2:
+        return st
+    closed = row[len(row) - n: len(row) - 1]
+    st.n = n - 1
+    st.last_ts = str(df["time"].iloc[-2])
+    st.last_close = float(closed[-1])
+    st.ema = {s: float(p[f"prev_ema{s}"][i]) for s in EMA_SPANS}
+    st.macd_signal = float(p["prev_sig"][i])
+    st.avg_gain = _num(p["prev_gain"][i])
+    st.avg_loss = _num(p["prev_loss"][i])
+    st.window.extend(float(c) for c in closed[-st.window.maxlen:])
+    vals = list(st.window)
+    st.sums = {w: math.fsum(vals[-w:]) for w in SMA_WINDOWS}
+    return st
+
+
+# ======================================================================
+#  Scoring (vectorized score_signal)
+# ======================================================================
+def _column(rows: Sequence[Dict[str, Any]], key: str) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+    raw = [r.get(key) for r in rows]
+    present = np.fromiter((v is not None for v in raw), dtype=bool, count=len(raw))
+    values = np.fromiter((float(v) if v is not None else np.nan for v in raw), dtype=float, count=len(raw))
+    return raw, present, values
+
+
+_SUMMARY = {
+    "BUY": "BUY because trend + momentum are supportive and confirmations are positive.",
+    "SELL": "SELL because trend + momentum are weak and confirmations are negative.",
+    "WAIT": "WAIT because signals are mixed/neutral; better to wait for confirmation.",
+}
+
+
+def score_signals_batch(quotes: Sequence[Dict[str, Any]], inds: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """score_signal(quotes[i], inds[i]) for every i, scored as rule masks."""
+    ltp_raw, has_ltp, ltp = _column(quotes, "ltp")
+    ema_raw, has_ema, ema20 = _column(inds, "ema20")
+    rsi_raw, has_rsi, rsi = _column(inds, "rsi14")
+    vol_raw, has_vol, vol = _column(quotes, "tradeVolume")
+    buy_raw, has_buy, buy = _column(quotes, "totBuyQuan")
+    sell_raw, has_sell, sell = _column(quotes, "totSellQuan")
+
+    # NaN compares False everywhere, exactly like the float() compares in score_signal
+    has_trend = has_ltp & has_ema
+    trend_up = has_trend & (ltp > ema20)
+    rsi_strong = has_rsi & (rsi > 60)
+    rsi_weak = has_rsi & ~rsi_strong & (rsi < 40)
+    vol_ok = has_vol & (vol > 0)
+    has_flow = has_buy & has_sell
+    buy_dom = has_flow & (buy > sell)
+    sell_dom = has_flow & (buy < sell)
+
+    score = (
+        np.where(has_trend, np.where(trend_up, 2, -2), 0)
+        + 2 * rsi_strong.astype(int) - 2 * rsi_weak.astype(int)
+        + vol_ok.astype(int)
+        + buy_dom.astype(int) - sell_dom.astype(int)
+    )
+    signal = np.where(score >= 3, "BUY", np.where(score <= -3, "SELL", "WAIT"))
+
+    out: List[Dict[str, Any]] = []
+    for i in range(len(quotes)):
+        reasons: List[str] = []
+
+        trend_ok = None
+        if has_trend[i]:
+            trend_ok = bool(trend_up[i])
+            if trend_ok:
+                reasons.append(f"Trend bullish: LTP ({ltp[i]:.2f}) > EMA20 ({ema20[i]:.2f}) [+2]")
+            else:
+                reasons.append(f"Trend bearish: LTP ({ltp[i]:.2f}) < EMA20 ({ema20[i]:.2f}) [-2]")
+        else:
+            reasons.append("Trend check skipped: Missing LTP/EMA20 [0]")
+
+        rsi_state = None
+        if has_rsi[i]:
+            if rsi_strong[i]:
+                rsi_state = "strong"
+                reasons.append(f"Momentum strong: RSI14 ({rsi[i]:.2f}) > 60 [+2]")
+            elif rsi_weak[i]:
+                rsi_state = "weak"
+                reasons.append(f"Momentum weak: RSI14 ({rsi[i]:.2f}) < 40 [-2]")
+            else:
+                rsi_state = "neutral"
+                reasons.append(f"Momentum neutral: RSI14 ({rsi[i]:.2f}) in 40–60 [0]")
+        else:
+            reasons.append("Momentum check skipped: Missing RSI14 [0]")
+
+        v_ok = None
+        if has_vol[i]:
+            v_ok = bool(vol_ok[i])
+            if v_ok:
+                reasons.append(f"Liquidity present: Volume ({vol[i]:.0f}) > 0 [+1]")
+            else:
+                reasons.append("Low activity: Volume is 0 [0]")
+        else:
+            reasons.append("Volume check skipped: Missing tradeVolume [0]")
+
+        flow_state = None
+        if has_flow[i]:
+            if buy_dom[i]:
+                flow_state = "buy-dominant"
+                reasons.append(f"Order flow bullish: BuyQty ({buy[i]:.0f}) > SellQty ({sell[i]:.0f}) [+1]")
+            elif sell_dom[i]:
+                flow_state = "sell-dominant"
+                reasons.append(f"Order flow bearish: BuyQty ({buy[i]:.0f}) < SellQty ({sell[i]:.0f}) [-1]")
+            else:
+                flow_state = "balanced"
+                reasons.append("Order flow balanced: BuyQty == SellQty [0]")
+        else:
+            reasons.append("Order flow check skipped: Missing totBuyQuan/totSellQuan [0]")
+
+        sig = str(signal[i])
+        out.append(
+            {
+                "score": int(score[i]),
+                "signal": sig,
+                "summary": _SUMMARY[sig],
+                "reasons": reasons,
+                "checks": {
+                    "ltp": ltp_raw[i],
+                    "ema20": ema_raw[i],
+                    "rsi14": rsi_raw[i],
+                    "tradeVolume": vol_raw[i],
+                    "totBuyQuan": buy_raw[i],
+                    "totSellQuan": sell_raw[i],
+                    "trend_ok": trend_ok,
+                    "rsi_state": rsi_state,
+                    "vol_ok": v_ok,
+                    "flow_state": flow_state,
+                },
+            }
+        )
+    return out
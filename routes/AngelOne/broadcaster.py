@@ -0,0 +1,216 @@
+# broadcaster.py
+"""
+Per-process pub/sub broadcaster for SSE streams.
+
+ONE Redis pubsub connection per worker subscribes to every channel the SSE
+routes need; messages are fanned out in memory to one bounded asyncio.Queue
+per connected browser. A full queue drops its OLDEST item (snapshots are
+full state, so only the newest matters).
+
+The last message per channel is kept in memory and handed to new clients
+immediately; before the first message it is loaded once via the channel's
+loader (e.g. Redis snapshot key / latest DB row).
+
+Channels carrying keyframes + deltas (see snapshot_delta.py) get a
+SnapshotState instead: every message is applied to it, new clients get its
+keyframe, and its loader returns the messages to replay (keyframe + delta
+log) whenever the state is missing or stale after a gap.
+
+Clients that stop consuming (no get() for idle_timeout seconds) are reaped:
+removed from the hub and sent a close sentinel.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from db.redis_pool import get_async_pubsub_redis
+from routes.AngelOne.snapshot_delta import SnapshotState
+
+# plain channel: latest message | state channel: messages to replay
+Loader = Callable[[], Awaitable[Any]]
+
+CLOSE = object()
+
+
+class Subscriber:
+    def __init__(self, channel: str, maxsize: int):
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.last_active = time.monotonic()
+        self.dropped = 0
+
+    def offer(self, item) -> None:
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()  # drop oldest
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(item)
+
+    async def get(self, timeout: float):
+        """Next message, or None on timeout (caller sends a ping). CLOSE when reaped."""
+        self.last_active = time.monotonic()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.last_active = time.monotonic()
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        channels: Iterable[str],
+        loaders: Optional[Dict[str, Loader]] = None,
+        states: Optional[Dict[str, SnapshotState]] = None,
+        queue_size: int = 16,
+        idle_timeout: float = 120.0,
+    ):
+        self.channels = list(channels)
+        self.loaders = loaders or {}
+        self.states = states or {}
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+
+        self.last: Dict[str, str] = {}
+        self.subs: Dict[str, Set[Subscriber]] = {c: set() for c in self.channels}
+
+        self._listener: Optional[asyncio.Task] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._load_lock = asyncio.Lock()
+
+        # metrics
+        self.messages_in = 0
+        self.dropped = 0
+        self.reaped = 0
+        self.reconnects = 0
+
+    # ---------------- lifecycle ----------------
+    def ensure_started(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self) -> None:
+        for t in (self._listener, self._reaper):
+            if t is not None:
+                t.cancel()
+        for t in (self._listener, self._reaper):
+            if t is not None:
+                try:
+                    await t
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._listener = self._reaper = None
+        for subs in self.subs.values():
+            for s in subs:
+                s.offer(CLOSE)
+            subs.clear()
+
+    async def _listen(self) -> None:
+        backoff = 0.5
+        while True:
+            pubsub = get_async_pubsub_redis().pubsub()
+            try:
+                await pubsub.subscribe(*self.channels)
+                print(f"[Broadcaster] ✅ subscribed {self.channels}")
+                backoff = 0.5
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    self._fanout(msg["channel"], msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                print(f"[Broadcaster] ⚠️ pubsub error, reconnecting in {backoff:.1f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def _fanout(self, channel: str, data: str) -> None:
+        self.messages_in += 1
+        state = self.states.get(channel)
+        if state is not None:
+            try:
+                state.apply(data)
+            except Exception as e:
+                state.stale = True
+                print(f"[Broadcaster] ⚠️ bad message on {channel}: {e}")
+        else:
+            self.last[channel] = data
+        for s in self.subs.get(channel, ()):
+            before = s.dropped
+            s.offer(data)
+            self.dropped += s.dropped - before
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(5.0, self.idle_timeout / 4))
+            cutoff = time.monotonic() - self.idle_timeout
+            for subs in self.subs.values():
+                for s in [s for s in subs if s.last_active < cutoff]:
+                    subs.discard(s)
+                    s.offer(CLOSE)
+                    self.reaped += 1
+
+    # ---------------- clients ----------------
+    async def latest(self, channel: str) -> Optional[str]:
+        state = self.states.get(channel)
+        if state is not None:
+            return await self._latest_state(channel, state)
+        if channel in self.last:
+            return self.last[channel]
+        loader = self.loaders.get(channel)
+        if loader is None:
+            return None
+        async with self._load_lock:
+            if channel not in self.last:
+                try:
+                    data = await loader()
+                except Exception as e:
+                    print(f"[Broadcaster] ⚠️ initial load failed for {channel}: {e}")
+                    return None
+                if data is not None:
+                    # a live message may have arrived while loading; it wins
+                    self.last.setdefault(channel, data)
+        return self.last.get(channel)
+
+    async def _latest_state(self, channel: str, state: SnapshotState) -> Optional[str]:
+        if state.stale and channel in self.loaders:
+            async with self._load_lock:
+                if state.stale:
+                    try:
+                        state.replay(await self.loaders[channel]() or [])
+                    except Exception as e:
+                        print(f"[Broadcaster] ⚠️ resync failed for {channel}: {e}")
+        return state.keyframe_json()
+
+    async def subscribe(self, channel: str) -> Subscriber:
+        self.ensure_started()
+        sub = Subscriber(channel, self.queue_size)
+        self.subs.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self.subs.get(sub.channel, set()).discard(sub)
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            "listening": self._listener is not None and not self._listener.done(),
+            "clients": {c: len(s) for c, s in self.subs.items()},
+            "messages_in": self.messages_in,
+            "dropped_oldest": self.dropped,
+            "reaped_idle": self.reaped,
+            "reconnects": self.reconnects,
+            "cached_channels": sorted(self.last),
+            "state_seq": {c: st.seq for c, st in self.states.items()},
+            "state_stale": {c: st.stale for c, st in self.states.items()},
+        }
@@ -0,0 +1,273 @@
+# routes/AngelOne/candle_store.py
+"""
+Local Angel One candle history for signal building (angel_candle table).
+
+build_signals used to download the full lookback (60d of 30m + 520d of
+daily bars) for every stock on every heavy refresh. Now each series
+(exchange, token, interval) is stored once and only the delta is fetched:
+
+  - first sync / lookback widened  -> full range from Angel, upserted
+  - afterwards                     -> from the newest stored bar (it may
+                                      still have been forming) to now
+  - no call at all while the last sync is younger than RESYNC_SEC for the
+    interval, or the market closed before the last sync
+
+angel_candle_sync keeps (covered_from, last_ts, synced_at) per series so
+deciding whether to call Angel needs no scan of the candle rows. Failed
+fetches fall back to the stored bars (stale beats missing).
+
+fetch_many() issues the Angel calls for a whole universe concurrently on
+an AngelClient; candle_frame() then consumes those responses instead of
+calling Angel itself.
+"""
+import os
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from sqlalchemy import and_, delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.models import AngelCandle, AngelCandleSync
+from routes.AngelOne.angel_client import AngelClient
+from routes.AngelOne.angel_data import get_candles
+
+IST = ZoneInfo("Asia/Kolkata")
+ANGEL_TS_FMT = "%Y-%m-%d %H:%M"
+
+SESSION_OPEN = time(9, 15)
+SESSION_CLOSE = time(15, 30)
+
+# forming bar is re-fetched at most this often (seconds)
+RESYNC_SEC = {
+    "ONE_DAY": int(os.getenv("ANGEL_CANDLE_RESYNC_DAY_SEC", "900")),
+}
+RESYNC_DEFAULT_SEC = int(os.getenv("ANGEL_CANDLE_RESYNC_SEC", "300"))
+
+# rows older than the lookback (+ this margin) are pruned
+PRUNE_MARGIN = timedelta(days=7)
+
+SeriesKey = Tuple[str, str, str]
+
+
+class SyncStats:
+    def __init__(self):
+        self.api_calls = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bars_upserted = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "api_calls": self.api_calls,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "bars_upserted": self.bars_upserted,
+        }
+
+
+def _last_close(now: datetime) -> datetime:
+    """Most recent weekday 15:30 IST at or before now (holidays not modelled)."""
+    d = now.date()
+    while True:
+        close = datetime.combine(d, SESSION_CLOSE, tzinfo=IST)
+        if d.weekday() < 5 and close <= now:
+            return close
+        d -= timedelta(days=1)
+
+
+def _market_open(now: datetime) -> bool:
+    return now.weekday() < 5 and SESSION_OPEN <= now.time() <= SESSION_CLOSE
+
+
+def load_sync_states(db: Session, intervals: List[str]) -> Dict[SeriesKey, AngelCandleSync]:
+    """All sync rows for these intervals in one query (one row per series)."""
+    rows = db.execute(select(AngelCandleSync).where(AngelCandleSync.interval.in_(intervals))).scalars().all()
+    return {(r.exchange, r.token, r.interval): r for r in rows}
+
+
+def _fetch_from(state: Optional[AngelCandleSync], interval: str, from_ts: datetime, now: datetime) -> Optional[datetime]:
+    """Start of the range to ask Angel for, or None when nothing new can exist."""
+    if state is None or state.covered_from is None or state.last_ts is None or state.covered_from > from_ts:
+        return from_ts
+
+    synced_at = state.synced_at.astimezone(IST)
+    if (now - synced_at).total_seconds() < RESYNC_SEC.get(interval, RESYNC_DEFAULT_SEC):
+        return None
+    if not _market_open(now) and synced_at >= _last_close(now):
+        return None
+    return max(from_ts, state.last_ts.astimezone(IST))
+
+
+def _parse(resp: Dict[str, Any]) -> List[Dict[str, Any]]:
+    rows = []
+    for r in (resp or {}).get("data") or []:
+        if not isinstance(r, list) or len(r) < 6:
+            continue
+        rows.append(
+            {
+                "ts": datetime.fromisoformat(str(r[0])),
+                "open_price": float(r[1]),
+                "high_price": float(r[2]),
+                "low_price": float(r[3]),
+                "close_price": float(r[4]),
+                "volume": int(float(r[5])),
+            }
+        )
+    return rows
+
+
+def _upsert(db: Session, key: SeriesKey, rows: List[Dict[str, Any]]) -> None:
+    ex, tok, interval = key
+    stmt = insert(AngelCandle).values(
+        [{"exchange": ex, "token": tok, "interval": interval, **r} for r in rows]
+    )
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["exchange", "token", "interval", "ts"],
+        set_={
+            "open_price": excluded.open_price,
+            "high_price": excluded.high_price,
+            "low_price": excluded.low_price,
+            "close_price": excluded.close_price,
+            "volume": excluded.volume,
+        },
+    )
+    db.execute(stmt)
+
+
+def _save_state(db: Session, key: SeriesKey, states: Dict[SeriesKey, AngelCandleSync], covered_from: datetime, last_ts: Optional[datetime], now: datetime) -> None:
+    state = states.get(key)
+    if state is None:
+        ex, tok, interval = key
+        state = AngelCandleSync(exchange=ex, token=tok, interval=interval)
+        db.add(state)
+        states[key] = state
+    if state.covered_from is None or state.covered_from > covered_from:
+        state.covered_from = covered_from
+    if last_ts is not None and (state.last_ts is None or last_ts > state.last_ts):
+        state.last_ts = last_ts
+    state.synced_at = now
+
+
+def _load_frame(db: Session, key: SeriesKey, from_ts: datetime) -> Optional[pd.DataFrame]:
+    ex, tok, interval = key
+    rows = db.execute(
+        select(
+            AngelCandle.ts,
+            AngelCandle.open_price,
+            AngelCandle.high_price,
+            AngelCandle.low_price,
+            AngelCandle.close_price,
+            AngelCandle.volume,
+        )
+        .where(
+            AngelCandle.exchange == ex,
+            AngelCandle.token == tok,
+            AngelCandle.interval == interval,
+            AngelCandle.ts >= from_ts,
+        )
+        .order_by(AngelCandle.ts.asc())
+    ).all()
+    if not rows:
+        return None
+    # same columns as signals.candles_to_df
+    return pd.DataFrame(
+        [
+            {
+                "time": ts.astimezone(IST).isoformat(),
+                "open": float(o),
+                "high": float(h),
+                "low": float(l),
+                "close": float(c),
+                "volume": float(v or 0),
+            }
+            for ts, o, h, l, c, v in rows
+        ]
+    )
+
+
+async def fetch_many(
+    client: AngelClient,
+    states: Dict[SeriesKey, AngelCandleSync],
+    series: List[Tuple[SeriesKey, int]],
+    now: datetime,
+) -> Dict[SeriesKey, Dict[str, Any]]:
+    """Angel responses for every (series, lookback_days) that needs a fetch, requested concurrently."""
+    todo = []
+    for key, lookback_days in series:
+        fetch_from = _fetch_from(states.get(key), key[2], now - timedelta(days=lookback_days), now)
+        if fetch_from is not None:
+            todo.append((key, fetch_from))
+    resps = await client.candles_many(
+        [(ex, tok, interval, f.strftime(ANGEL_TS_FMT), now.strftime(ANGEL_TS_FMT)) for (ex, tok, interval), f in todo],
+        max_retries=3,
+    )
+    return {key: resp for (key, _), resp in zip(todo, resps)}
+
+
+def candle_frame(
+    db: Session,
+    states: Dict[SeriesKey, AngelCandleSync],
+    exchange: str,
+    token: str,
+    interval: str,
+    lookback_days: int,
+    now: datetime,
+    stats: SyncStats,
+    tokens_path: str = "tokens.json",
+    fetched: Optional[Dict[SeriesKey, Dict[str, Any]]] = None,
+) -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, Any]]]:
+    """
+    (candles over [now - lookback_days, now], raw Angel error if the fetch failed).
+    Calls Angel only for the missing / forming part of the series, unless
+    the response is already in `fetched` (see fetch_many).
+    """
+    key: SeriesKey = (exchange, str(token), interval)
+    from_ts = now - timedelta(days=lookback_days)
+    fetch_from = _fetch_from(states.get(key), interval, from_ts, now)
+
+    err = None
+    if fetch_from is None:
+        stats.skipped += 1
+    else:
+        stats.api_calls += 1
+        resp = (fetched or {}).get(key)
+        if resp is None:
+            resp = get_candles(
+                exchange, token, interval,
+                fetch_from.strftime(ANGEL_TS_FMT), now.strftime(ANGEL_TS_FMT),
+                tokens_path=tokens_path, max_retries=3,
+            )
+        if resp and resp.get("status"):
+            rows = _parse(resp)
+            try:
+                if rows:
+                    _upsert(db, key, rows)
+                    stats.bars_upserted += len(rows)
+                _save_state(db, key, states, fetch_from, max((r["ts"] for r in rows), default=None), now)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                stats.failed += 1
+                err = {"error": f"candle store write failed: {e}"}
+        else:
+            stats.failed += 1
+            err = resp
+
+    return _load_frame(db, key, from_ts), err
+
+
+def prune(db: Session, interval: str, lookback_days: int, now: datetime) -> int:
+    """Drop bars no lookback needs any more; covered_from moves up with them."""
+    cutoff = now - timedelta(days=lookback_days) - PRUNE_MARGIN
+    res = db.execute(delete(AngelCandle).where(and_(AngelCandle.interval == interval, AngelCandle.ts < cutoff)))
+    db.execute(
+        update(AngelCandleSync)
+        .where(AngelCandleSync.interval == interval, AngelCandleSync.covered_from < cutoff)
+        .values(covered_from=cutoff)
+    )
+    db.commit()
+    return int(res.rowcount or 0)
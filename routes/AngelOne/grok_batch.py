@@ -0,0 +1,209 @@
+# routes/AngelOne/grok_batch.py
+"""
+Batched + cached Grok trade plans.
+
+Every strong signal used to cost one Grok request, and a retry after a
+timeout paid for the same prompt again. GrokBatcher.plans() takes the
+plan_input() dicts of several symbols (a GrokQueue worker's batch) and:
+
+  - looks each one up in Redis first (PLAN_CACHE_PREFIX + sha1 of the
+    canonical input JSON, GROK_CACHE_TTL_SEC); identical inputs never
+    reach Grok twice
+  - packs the misses into prompts of at most GROK_BATCH_MAX_ITEMS symbols
+    and GROK_BATCH_MAX_TOKENS estimated tokens (input plus
+    GROK_BATCH_OUT_TOKENS per plan for the answer) and sends each pack
+    as one JSON-array prompt (generate_trade_plans_batch)
+  - every returned plan is schema-checked against its own input; the
+    ones that fail (or a whole failed pack) are re-asked one symbol per
+    request, as before
+  - only plans that pass validate_plan() are cached, so the non-JSON
+    fallback of a single call is stored in the DB but retried next time
+  - all calls of one plans() share its budget_sec (the caller's attempt
+    timeout): a pack gets half of what is left, its one-by-one fallback
+    the rest. A call that would get less than GROK_MIN_CALL_SEC is not
+    made and its items come back with a TimeoutError, so the queue retries
+    them instead of a thread that outlives the attempt and bills twice
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from db.redis_pool import get_async_redis
+from routes.AngelOne.Grok_recomendation import (
+    GROK_CONNECT_TIMEOUT_SEC,
+    estimate_tokens,
+    generate_trade_plans_batch,
+    trade_plan_for_input,
+    validate_plan,
+)
+
+GROK_BATCH_MAX_ITEMS = int(os.getenv("GROK_BATCH_MAX_ITEMS", "8"))
+GROK_BATCH_MAX_TOKENS = int(os.getenv("GROK_BATCH_MAX_TOKENS", "12000"))
+GROK_BATCH_OUT_TOKENS = int(os.getenv("GROK_BATCH_OUT_TOKENS", "600"))
+GROK_CACHE_TTL_SEC = int(os.getenv("GROK_CACHE_TTL_SEC", str(6 * 3600)))
+GROK_MIN_CALL_SEC = float(os.getenv("GROK_MIN_CALL_SEC", "10"))
+
+PLAN_CACHE_PREFIX = "angel:grok:plan:"
+
+Item = Dict[str, Any]
+Outcome = Tuple[Optional[Dict[str, Any]], Optional[BaseException]]
+
+
+def plan_cache_key(item: Item) -> str:
+    canon = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return PLAN_CACHE_PREFIX + hashlib.sha1(canon.encode("utf-8")).hexdigest()
+
+
+def _read_timeout(deadline: float, share: float = 1.0) -> Optional[int]:
+    """Read timeout for a call allowed `share` of the time left, None when that is too short."""
+    left = (deadline - time.monotonic()) * share - GROK_CONNECT_TIMEOUT_SEC
+    return int(left) if left >= GROK_MIN_CALL_SEC else None
+
+
+class GrokBatcher:
+    def __init__(
+        self,
+        max_items: int = GROK_BATCH_MAX_ITEMS,
+        max_tokens: int = GROK_BATCH_MAX_TOKENS,
+        out_tokens: int = GROK_BATCH_OUT_TOKENS,
+        cache_ttl: int = GROK_CACHE_TTL_SEC,
+    ):
+        self.max_items = max(1, max_items)
+        self.max_tokens = max_tokens
+        self.out_tokens = out_tokens
+        self.cache_ttl = cache_ttl
+
+        # metrics
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batch_calls = 0
+        self.batch_items = 0
+        self.batch_invalid = 0
+        self.batch_failed = 0
+        self.single_calls = 0
+        self.skipped_calls = 0
+
+    # ---------------- packing ----------------
+    def pack(self, items: List[Item]) -> List[List[int]]:
+        """Indexes of `items` grouped under the item / token budgets (order kept)."""
+        groups: List[List[int]] = []
+        cur: List[int] = []
+        used = 0
+        for i, item in enumerate(items):
+            cost = estimate_tokens(item) + self.out_tokens
+            if cur and (len(cur) >= self.max_items or used + cost > self.max_tokens):
+                groups.append(cur)
+                cur, used = [], 0
+            cur.append(i)
+            used += cost
+        if cur:
+            groups.append(cur)
+        return groups
+
+    # ---------------- cache ----------------
+    async def _cache_get(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        try:
+            raw = await get_async_redis().mget(keys)
+        except Exception as e:
+            print(f"[GrokBatcher] ⚠️ plan cache read failed: {e}")
+            return [None] * len(keys)
+        out: List[Optional[Dict[str, Any]]] = []
+        for v in raw:
+            try:
+                out.append(json.loads(v) if v else None)
+            except ValueError:
+                out.append(None)
+        return out
+
+    async def _cache_put(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        if not entries or self.cache_ttl <= 0:
+            return
+        try:
+            pipe = get_async_redis().pipeline(transaction=False)
+            for key, plan in entries.items():
+                pipe.set(key, json.dumps(plan, ensure_ascii=False), ex=self.cache_ttl)
+            await pipe.execute()
+        except Exception as e:
+            print(f"[GrokBatcher] ⚠️ plan cache write failed: {e}")
+
+    # ---------------- calls ----------------
+    async def _single(self, item: Item, deadline: float) -> Outcome:
+        timeout_sec = _read_timeout(deadline)
+        if timeout_sec is None:
+            self.skipped_calls += 1
+            return None, asyncio.TimeoutError("no Grok budget left for this attempt")
+        self.single_calls += 1
+        try:
+            return await asyncio.to_thread(trade_plan_for_input, item, timeout_sec), None
+        except Exception as e:
+            return None, e
+
+    async def _group(self, items: List[Item], deadline: float) -> List[Outcome]:
+        timeout_sec = _read_timeout(deadline, 0.5)  # the other half is the fallback's
+        if len(items) == 1 or timeout_sec is None:
+            return list(await asyncio.gather(*(self._single(it, deadline) for it in items)))
+
+        self.batch_calls += 1
+        self.batch_items += len(items)
+        try:
+            plans = await asyncio.to_thread(generate_trade_plans_batch, items, timeout_sec)
+        except Exception as e:
+            self.batch_failed += 1
+            print(f"[GrokBatcher] ⚠️ batch of {len(items)} failed, asking one by one: {e}")
+            plans = [None] * len(items)
+
+        out: List[Optional[Outcome]] = [(p, None) if p is not None else None for p in plans]
+        redo = [i for i, o in enumerate(out) if o is None]
+        self.batch_invalid += len(redo)
+        if redo:
+            retried = await asyncio.gather(*(self._single(items[i], deadline) for i in redo))
+            for i, o in zip(redo, retried):
+                out[i] = o
+        return out  # type: ignore[return-value]
+
+    async def plans(self, items: List[Item], budget_sec: float = 60) -> List[Outcome]:
+        """(plan, error) per item, in order; every Grok call ends within budget_sec."""
+        deadline = time.monotonic() + budget_sec
+        keys = [plan_cache_key(it) for it in items]
+        cached = await self._cache_get(keys)
+
+        out: List[Optional[Outcome]] = [None] * len(items)
+        miss: List[int] = []
+        for i, plan in enumerate(cached):
+            if plan is not None:
+                out[i] = (plan, None)
+            else:
+                miss.append(i)
+        self.cache_hits += len(items) - len(miss)
+        self.cache_misses += len(miss)
+
+        if miss:
+            todo = [items[i] for i in miss]
+            groups = self.pack(todo)
+            results = await asyncio.gather(*(self._group([todo[j] for j in g], deadline) for g in groups))
+            fresh: Dict[str, Dict[str, Any]] = {}
+            for g, res in zip(groups, results):
+                for j, (plan, err) in zip(g, res):
+                    i = miss[j]
+                    out[i] = (plan, err)
+                    if err is None and validate_plan(plan, items[i]):
+                        fresh[keys[i]] = plan
+            await self._cache_put(fresh)
+        return out  # type: ignore[return-value]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "max_items": self.max_items,
+            "max_tokens": self.max_tokens,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "batch_calls": self.batch_calls,
+            "batch_items": self.batch_items,
+            "batch_invalid": self.batch_invalid,
+            "batch_failed": self.batch_failed,
+            "single_calls": self.single_calls,
+            "skipped_calls": self.skipped_calls,
+        }
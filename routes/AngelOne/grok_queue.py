@@ -0,0 +1,217 @@
+# routes/AngelOne/grok_queue.py
+"""
+Bounded async work queue for Grok recommendations.
+
+The producer fast loop used to check the DB, call Grok and insert the row
+inline for every strong signal, so one slow LLM call held up the quote
+tick for the whole universe. Now the loop only calls offer() (no await)
+and a fixed pool of workers does the rest:
+
+  - per-process: a symbol is offered at most once per trade date
+    (in-memory set) and the queue is bounded (GROK_QUEUE_MAX; full -> drop,
+    the next tick offers it again)
+  - cluster-wide: a worker claims `angel:grok:claim:<date>:<EX>:<TOKEN>`
+    with SET NX before doing anything, instead of polling the DB; a lost
+    claim means another worker / host already has it
+  - a worker takes up to `batch` queued jobs at once (whatever the tick
+    offered; it never waits for more) and hands the claimed ones to
+    run(jobs) -> [(result, error), ...] (the LLM call, see grok_batch.py)
+  - each attempt gets GROK_TIMEOUT_SEC; jobs that failed are retried (only
+    those) up to GROK_RETRIES times with jittered exponential backoff
+  - done(job, result, error) is called exactly once per claimed job, with
+    the result or the last error (store + publish happen there)
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from db.redis_pool import get_async_redis
+
+GROK_WORKERS = int(os.getenv("GROK_WORKERS", "2"))
+GROK_QUEUE_MAX = int(os.getenv("GROK_QUEUE_MAX", "200"))
+GROK_TIMEOUT_SEC = float(os.getenv("GROK_TIMEOUT_SEC", "120"))
+GROK_RETRIES = int(os.getenv("GROK_RETRIES", "2"))
+GROK_BACKOFF_SEC = float(os.getenv("GROK_BACKOFF_SEC", "2"))
+GROK_CLAIM_TTL_SEC = int(os.getenv("GROK_CLAIM_TTL_SEC", str(36 * 3600)))
+
+CLAIM_PREFIX = "angel:grok:claim:"
+
+Job = Dict[str, Any]
+Outcome = Tuple[Any, Optional[BaseException]]
+Run = Callable[[List[Job]], Awaitable[List[Outcome]]]
+Done = Callable[[Job, Any, Optional[BaseException]], Awaitable[None]]
+
+
+def claim_key(trade_date: date, exchange: str, token: str) -> str:
+    return f"{CLAIM_PREFIX}{trade_date.isoformat()}:{exchange}:{token}"
+
+
+class GrokQueue:
+    def __init__(
+        self,
+        run: Run,
+        done: Done,
+        workers: int = GROK_WORKERS,
+        maxsize: int = GROK_QUEUE_MAX,
+        timeout: float = GROK_TIMEOUT_SEC,
+        retries: int = GROK_RETRIES,
+        batch: int = 1,
+    ):
+        self.run = run
+        self.done = done
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.batch = max(1, batch)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, maxsize))
+        self._tasks: List[asyncio.Task] = []
+        self._offered: Tuple[Optional[date], Set[Tuple[str, str]]] = (None, set())
+
+        # metrics
+        self.offered = 0
+        self.dropped = 0
+        self.claimed = 0
+        self.claim_lost = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_duration_s: Optional[float] = None
+
+    # ---------------- lifecycle ----------------
+    def start(self) -> None:
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------------- producer side ----------------
+    def offer(self, trade_date: date, exchange: str, token: str, job: Job) -> bool:
+        """Queue job unless this symbol was already offered today. Never blocks."""
+        day, seen = self._offered
+        if day != trade_date:
+            seen = set()
+            self._offered = (trade_date, seen)
+        key = (exchange, token)
+        if key in seen:
+            return False
+        try:
+            self.queue.put_nowait((trade_date, exchange, token, job))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        seen.add(key)
+        self.offered += 1
+        return True
+
+    # ---------------- workers ----------------
+    async def _claim(self, trade_date: date, exchange: str, token: str) -> bool:
+        r = get_async_redis()
+        return bool(await r.set(claim_key(trade_date, exchange, token), "1", nx=True, ex=GROK_CLAIM_TTL_SEC))
+
+    async def _run_with_retries(self, jobs: List[Job]) -> List[Outcome]:
+        out: List[Outcome] = [(None, None)] * len(jobs)
+        todo = list(range(len(jobs)))
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += len(todo)
+                await asyncio.sleep(random.uniform(0.5, 1.5) * GROK_BACKOFF_SEC * (2 ** (attempt - 1)))
+            try:
+                res = await asyncio.wait_for(self.run([jobs[i] for i in todo]), timeout=self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                err = e if not isinstance(e, asyncio.TimeoutError) else TimeoutError(f"Grok timed out after {self.timeout:g}s")
+                res = [(None, err)] * len(todo)
+            failed = []
+            for i, (result, err) in zip(todo, res):
+                out[i] = (result, err)
+                if err is not None:
+                    failed.append(i)
+            todo = failed
+            if not todo:
+                break
+        return out
+
+    def _take(self) -> List[Tuple[date, str, str, Job]]:
+        """Whatever else is already queued, up to the batch size (no waiting)."""
+        taken = []
+        while len(taken) < self.batch - 1:
+            try:
+                taken.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return taken
+
+    async def _claim_all(self, entries: List[Tuple[date, str, str, Job]]) -> List[Tuple[date, str, str, Job]]:
+        claimed = []
+        results = await asyncio.gather(*(self._claim(d, ex, tok) for d, ex, tok, _ in entries), return_exceptions=True)
+        for (d, ex, tok, job), ok in zip(entries, results):
+            if isinstance(ok, BaseException):
+                print(f"[GrokQueue] ⚠️ claim failed for {ex}:{tok}: {ok}")
+                # unclaimed jobs may be offered again by the next tick
+                self._offered[1].discard((ex, tok))
+            elif not ok:
+                self.claim_lost += 1
+            else:
+                self.claimed += 1
+                claimed.append((d, ex, tok, job))
+        return claimed
+
+    async def _worker(self) -> None:
+        while True:
+            entries = [await self.queue.get()]
+            entries += self._take()
+            try:
+                claimed = await self._claim_all(entries)
+                if not claimed:
+                    continue
+
+                t0 = time.monotonic()
+                self.batches += 1
+                self.last_batch_size = len(claimed)
+                results = await self._run_with_retries([job for _, _, _, job in claimed])
+                self.last_duration_s = round(time.monotonic() - t0, 3)
+
+                for (_, exchange, token, job), (result, err) in zip(claimed, results):
+                    if err is None:
+                        self.succeeded += 1
+                    else:
+                        self.failed += 1
+                        print(f"[GrokQueue] ⚠️ {exchange}:{token} failed after {self.retries + 1} attempts: {err}")
+                    try:
+                        await self.done(job, result, err)
+                    except Exception as e:
+                        print(f"[GrokQueue] ❌ completing {exchange}:{token} failed: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[GrokQueue] ❌ worker error: {e}")
+            finally:
+                for _ in entries:
+                    self.queue.task_done()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "workers": len([t for t in self._tasks if not t.done()]),
+            "queued": self.queue.qsize(),
+            "offered": self.offered,
+            "dropped_full": self.dropped,
+            "claimed": self.claimed,
+            "claim_lost": self.claim_lost,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_duration_s": self.last_duration_s,
+        }
@@ -0,0 +1,115 @@
+# routes/AngelOne/indicator_store.py
+"""
+Checkpoints for the incremental indicator engine (angel_indicator_state).
+
+One JSONB row per series (exchange, token, interval), loaded in one query
+at the start of a heavy refresh and written back in one upsert for the
+series that moved, so restarts resume from the checkpoint instead of
+replaying history.
+
+indicators_many() does a whole interval at once: series with a usable
+checkpoint advance incrementally, the rest (first run, revised bars) are
+rebuilt together by the cross-sectional batch engine, which also hands
+back their checkpoints.
+
+INDICATOR_VERIFY=1 also runs the pandas compute_indicators and logs any
+series whose values drift beyond INDICATOR_VERIFY_TOL.
+"""
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db.models import AngelIndicatorState
+from routes.AngelOne.batch_signals import batch_indicators
+from routes.AngelOne.indicators import IndicatorState, compute_indicators, incremental_indicators, resume_index
+
+SeriesKey = Tuple[str, str, str]
+
+INDICATOR_VERIFY = os.getenv("INDICATOR_VERIFY", "false").lower() in ("1", "true", "yes", "y")
+INDICATOR_VERIFY_TOL = float(os.getenv("INDICATOR_VERIFY_TOL", "1e-6"))
+
+
+class IndicatorStates:
+    def __init__(self, db: Session, intervals: List[str]):
+        rows = db.execute(
+            select(AngelIndicatorState).where(AngelIndicatorState.interval.in_(intervals))
+        ).scalars().all()
+        self.states: Dict[SeriesKey, IndicatorState] = {}
+        for r in rows:
+            st = IndicatorState.from_json(r.state)
+            if st is not None:
+                self.states[(r.exchange, r.token, r.interval)] = st
+        self.dirty: Dict[SeriesKey, IndicatorState] = {}
+        self.replayed = 0
+        self.mismatches = 0
+
+    def indicators(self, key: SeriesKey, df: pd.DataFrame) -> Dict[str, Any]:
+        st, out, replayed = incremental_indicators(self.states.get(key), df)
+        self.states[key] = st
+        if replayed:
+            self.replayed += replayed
+            self.dirty[key] = st
+        if INDICATOR_VERIFY:
+            self._verify(key, df, out)
+        return out
+
+    def indicators_many(self, keys: List[SeriesKey], frames: List[pd.DataFrame]) -> List[Dict[str, Any]]:
+        """indicators() for many series; cold ones are rebuilt in one batch."""
+        out: List[Dict[str, Any]] = [{} for _ in keys]
+        cold: List[int] = []
+        for i, (key, df) in enumerate(zip(keys, frames)):
+            st = self.states.get(key)
+            if resume_index(st, df["time"].astype(str).tolist(), df["close"].astype(float).tolist()) is None:
+                cold.append(i)
+            else:
+                out[i] = self.indicators(key, df)
+
+        for i, (st, ind) in zip(cold, batch_indicators([frames[i] for i in cold])):
+            key = keys[i]
+            self.states[key] = st
+            if st.n:
+                self.replayed += st.n
+                self.dirty[key] = st
+            if INDICATOR_VERIFY:
+                self._verify(key, frames[i], ind)
+            out[i] = ind
+        return out
+
+    def _verify(self, key: SeriesKey, df: pd.DataFrame, out: Dict[str, Any]) -> None:
+        ref = compute_indicators(df)
+        for k, v in ref.items():
+            o = out.get(k)
+            if v is None or o is None:
+                same = v is None and o is None
+            elif math.isnan(v) or math.isnan(o):
+                same = math.isnan(v) and math.isnan(o)
+            else:
+                same = abs(v - o) <= INDICATOR_VERIFY_TOL * max(1.0, abs(v))
+            if not same:
+                self.mismatches += 1
+                print(f"[Indicators] ⚠️ {key} {k}: incremental={o} pandas={v}")
+
+    def save(self, db: Session) -> int:
+        """One upsert for every series whose checkpoint moved."""
+        if not self.dirty:
+            return 0
+        stmt = insert(AngelIndicatorState).values(
+            [
+                {"exchange": ex, "token": tok, "interval": interval, "state": st.to_json()}
+                for (ex, tok, interval), st in self.dirty.items()
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["exchange", "token", "interval"],
+            set_={"state": stmt.excluded.state, "updated_at": func.now()},
+        )
+        db.execute(stmt)
+        db.commit()
+        n = len(self.dirty)
+        self.dirty.clear()
+        return n
@@ -1,7 +1,10 @@
 # routes/AngelOne/indicators.py
+import math
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
 import numpy as np
 import pandas as pd
-from typing import Dict, Any
 
 
 def ema(series: pd.Series, span: int) -> pd.Series:
@@ -57,3 +60,190 @@ def compute_indicators(df: pd.DataFrame) -> Dict[str, Any]:
     out["macd_hist"] = float(h.iloc[-1])
     return out
 
+
+
+# ======================================================================
+#  Incremental engine (same numbers as compute_indicators, O(1) per bar)
+# ======================================================================
+EMA_SPANS = (20, 50, 12, 26)
+SMA_WINDOWS = (50, 200)
+RSI_PERIOD = 14
+MACD_SIGNAL = 9
+STATE_VERSION = 1
+
+_REANCHOR_EVERY = max(SMA_WINDOWS)  # re-sum rolling windows exactly to stop float drift
+
+
+def _alpha(span: int) -> float:
+    return 2.0 / (span + 1.0)
+
+
+class IndicatorState:
+    """
+    Indicator state for one series, committed through all CLOSED bars.
+
+    The newest bar of a series may still be forming, so it is never
+    committed: compute(tip_close) applies it on top of the committed state
+    without mutating it, and a revised tip simply recomputes. commit(close)
+    folds a closed bar in (EMA / Wilder RSI recursions, rolling SMA sums).
+
+    Mirrors the pandas definitions above:
+      ema  -> ewm(span, adjust=False)         seed = first close
+      rsi  -> Wilder ewm(alpha=1/14) of gains / losses from the 2nd bar on,
+              NaN when avg_loss == 0 (as replace(0, nan))
+      sma  -> None until `window` bars
+      macd -> ema12 - ema26, signal = ema9(macd) seeded with the first macd
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.last_ts: Optional[str] = None
+        self.last_close: Optional[float] = None
+        self.ema: Dict[int, float] = {}
+        self.macd_signal: Optional[float] = None
+        self.avg_gain: Optional[float] = None
+        self.avg_loss: Optional[float] = None
+        self.window: Deque[float] = deque(maxlen=max(SMA_WINDOWS))
+        self.sums: Dict[int, float] = {w: 0.0 for w in SMA_WINDOWS}
+        self._since_anchor = 0
+
+    # ---------------- core step ----------------
+    def _step(self, close: float):
+        x = float(close)
+        ema = {
+            s: x if self.n == 0 else _alpha(s) * x + (1.0 - _alpha(s)) * self.ema[s]
+            for s in EMA_SPANS
+        }
+        macd_line = ema[12] - ema[26]
+        sig = macd_line if self.macd_signal is None else (
+            _alpha(MACD_SIGNAL) * macd_line + (1.0 - _alpha(MACD_SIGNAL)) * self.macd_signal
+        )
+
+        avg_gain, avg_loss = self.avg_gain, self.avg_loss
+        if self.last_close is not None:
+            delta = x - self.last_close
+            g, l = max(delta, 0.0), max(-delta, 0.0)
+            a = 1.0 / RSI_PERIOD
+            if avg_gain is None:
+                avg_gain, avg_loss = g, l
+            else:
+                avg_gain = a * g + (1.0 - a) * avg_gain
+                avg_loss = a * l + (1.0 - a) * avg_loss
+
+        sums = {}
+        for w in SMA_WINDOWS:
+            s = self.sums[w] + x
+            if len(self.window) >= w:
+                s -= self.window[-w]
+            sums[w] = s
+
+        return x, ema, sig, avg_gain, avg_loss, sums
+
+    def _outputs(self, n: int, ema, sig, avg_gain, avg_loss, sums) -> Dict[str, Any]:
+        if avg_gain is None or avg_loss == 0:
+            rsi14 = float("nan")
+        else:
+            rsi14 = 100.0 - (100.0 / (1.0 + avg_gain / avg_loss))
+        macd_line = ema[12] - ema[26]
+        return {
+            "ema20": float(ema[20]),
+            "ema50": float(ema[50]),
+            "sma50": float(sums[50] / 50) if n >= 50 else None,
+            "sma200": float(sums[200] / 200) if n >= 200 else None,
+            "rsi14": float(rsi14),
+            "macd": float(macd_line),
+            "macd_signal": float(sig),
+            "macd_hist": float(macd_line - sig),
+        }
+
+    def commit(self, ts: str, close: float) -> None:
+        x, ema, sig, avg_gain, avg_loss, sums = self._step(close)
+        self.ema, self.macd_signal = ema, sig
+        self.avg_gain, self.avg_loss = avg_gain, avg_loss
+        self.window.append(x)
+        self.n += 1
+        self.last_ts, self.last_close = ts, x
+
+        self._since_anchor += 1
+        if self._since_anchor >= _REANCHOR_EVERY:
+            vals = list(self.window)
+            self.sums = {w: math.fsum(vals[-w:]) for w in SMA_WINDOWS}
+            self._since_anchor = 0
+        else:
+            self.sums = sums
+
+    def compute(self, tip_close: float) -> Dict[str, Any]:
+        """Indicators with the (possibly forming) tip bar applied; state unchanged."""
+        _x, ema, sig, avg_gain, avg_loss, sums = self._step(tip_close)
+        return self._outputs(self.n + 1, ema, sig, avg_gain, avg_loss, sums)
+
+    # ---------------- checkpoint ----------------
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "v": STATE_VERSION,
+            "n": self.n,
+            "last_ts": self.last_ts,
+            "last_close": self.last_close,
+            "ema": {str(k): v for k, v in self.ema.items()},
+            "macd_signal": self.macd_signal,
+            "avg_gain": self.avg_gain,
+            "avg_loss": self.avg_loss,
+            "window": list(self.window),
+            "since_anchor": self._since_anchor,
+        }
+
+    @classmethod
+    def from_json(cls, d: Optional[Dict[str, Any]]) -> Optional["IndicatorState"]:
+        if not d or d.get("v") != STATE_VERSION:
+            return None
+        st = cls()
+        st.n = int(d["n"])
+        st.last_ts = d.get("last_ts")
+        st.last_close = d.get("last_close")
+        st.ema = {int(k): float(v) for k, v in (d.get("ema") or {}).items()}
+        st.macd_signal = d.get("macd_signal")
+        st.avg_gain = d.get("avg_gain")
+        st.avg_loss = d.get("avg_loss")
+        st.window.extend(float(x) for x in d.get("window") or [])
+        vals = list(st.window)
+        st.sums = {w: math.fsum(vals[-w:]) for w in SMA_WINDOWS}
+        st._since_anchor = 0
+        return st
+
+
+def resume_index(state: Optional[IndicatorState], times: List[str], closes: List[float]) -> Optional[int]:
+    """First bar after the checkpoint, or None when the state must be rebuilt."""
+    if state is None or state.last_ts is None or state.last_close is None:
+        return None
+    try:
+        i = times.index(state.last_ts)
+    except ValueError:
+        return None
+    if not math.isclose(closes[i], state.last_close, rel_tol=0, abs_tol=1e-9):
+        return None
+    # the checkpoint must stay behind the tip (the tip is never committed)
+    return i + 1 if i + 1 < len(closes) else None
+
+
+def incremental_indicators(state: Optional[IndicatorState], df: pd.DataFrame) -> Tuple[IndicatorState, Dict[str, Any], int]:
+    """
+    Bring `state` up to date with df (columns time, close; ascending) and
+    return (state, indicators, bars_replayed).
+
+    Only bars after the checkpoint are touched. The state is rebuilt from df
+    when it cannot be trusted: no checkpoint, checkpoint bar no longer in df,
+    or its close was revised upstream.
+    """
+    times = df["time"].astype(str).tolist()
+    closes = df["close"].astype(float).tolist()
+
+    start = resume_index(state, times, closes)
+    last = len(closes) - 1
+    if start is None:
+        state, start = IndicatorState(), 0
+
+    # everything but the last bar is closed -> commit; last bar is the tip
+    for i in range(start, last):
+        state.commit(times[i], closes[i])
+
+    return state, state.compute(closes[last]), max(0, last - start)
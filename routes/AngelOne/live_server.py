@@ -4,10 +4,10 @@ import json
 import asyncio
 import hashlib
 from datetime import datetime, date
-from typing import Any, Dict, Optional, List, Tuple
+from typing import Any, Callable, Dict, Optional, List, Tuple
 
 from fastapi import APIRouter, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from sse_starlette.sse import EventSourceResponse
 import redis.asyncio as redis
 from sqlalchemy.exc import IntegrityError
@@ -20,14 +20,28 @@ from routes.AngelOne.signals import (
     flatten_stocklist,
     chunk_tokens,
     parse_quote_map,
-    score_signal,
 )
-
-from routes.AngelOne.Grok_recomendation import generate_trade_plan_with_grok
+from routes.AngelOne.batch_signals import score_signals_batch
+
+from routes.AngelOne.Grok_recomendation import plan_input
+from routes.AngelOne.grok_batch import GROK_BATCH_MAX_ITEMS, GrokBatcher
+from routes.AngelOne.grok_queue import GROK_TIMEOUT_SEC, GrokQueue
+from routes.AngelOne.producer_shards import ShardMembership, merge_shards, symbol_key
+from routes.AngelOne.broadcaster import CLOSE, Broadcaster
+from routes.AngelOne.snapshot_delta import (
+    DELTA,
+    ERROR,
+    KEYFRAME,
+    DeltaEncoder,
+    SnapshotState,
+    error_message,
+    peek,
+)
 
 # ✅ Quote API (FAST)
-from routes.AngelOne.angel_data import quote_full_bulk
+from routes.AngelOne.angel_client import AngelClient
 
+from db.redis_pool import get_async_redis
 from db.connection import SessionLocal  # <-- change if your file name is different
 from db.models import GrokRecommendation  # <-- change to your actual model import
 
@@ -36,18 +50,22 @@ GROK_PUBSUB_CH = "angel:grok:pubsub"
 
 router = APIRouter(tags=["Angel One Live Signals"])
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
-
 # Redis Keys (signals snapshot)
-SNAPSHOT_KEY = "angel:signals:snapshot"
+SNAPSHOT_KEY = "angel:signals:snapshot"          # latest keyframe message
+DELTA_LOG_KEY = "angel:signals:deltas"           # deltas since that keyframe
+SEQ_KEY = "angel:signals:seq"                    # monotonic across leaders
+KEYFRAME_EVERY = int(os.getenv("SIGNALS_KEYFRAME_EVERY", "20"))
 SNAPSHOT_TS_KEY = "angel:signals:snapshot:ts"
 PUBSUB_CH = "angel:signals:pubsub"
 
 # Cache indicators separately (so fast quotes can reuse)
-IND_CACHE_KEY = "angel:signals:indicators_cache"
+IND_HASH_KEY = "angel:signals:indicators"         # EX:TOKEN -> indicators JSON
+IND_VER_KEY = "angel:signals:indicators:ver"      # EX:TOKEN -> generation it last changed in
+IND_GEN_KEY = "angel:signals:indicators:gen"      # generation readers sync to (set with the fields)
+IND_SEQ_KEY = "angel:signals:indicators:seq"      # allocates generations
 IND_TS_KEY = "angel:signals:indicators_cache:ts"
 
-# Leader lock
+# Leader lock (the leader merges the producer shards and publishes)
 LOCK_KEY = "angel:signals:leader"
 LOCK_TTL_SEC = 180
 
@@ -65,7 +83,7 @@ def today_date() -> date:
 
 
 async def get_redis() -> redis.Redis:
-    r = redis.from_url(REDIS_URL, decode_responses=True)
+    r = get_async_redis()  # shared pool (db/redis_pool.py)
     await r.ping()
     return r
 
@@ -88,27 +106,47 @@ async def refresh_leader_lock(r: redis.Redis, leader_id: str) -> bool:
 # ---------------------------
 # Snapshot publish/store (signals)
 # ---------------------------
-async def publish_snapshot(r: redis.Redis, payload: Dict[str, Any]) -> None:
-    s = to_json(payload)
+async def publish_snapshot(r: redis.Redis, encoder: DeltaEncoder, payload: Dict[str, Any]) -> None:
+    """
+    Versioned publish (see snapshot_delta.py): keyframe every KEYFRAME_EVERY
+    ticks, per-symbol delta otherwise. Redis keeps keyframe + delta log so
+    any worker can rebuild the current state.
+    """
+    seq = int(await r.incr(SEQ_KEY))
+    kind, msg = await asyncio.to_thread(encoder.encode, payload, seq)
     ts = datetime.now().isoformat()
-    await r.set(SNAPSHOT_KEY, s)
-    await r.set(SNAPSHOT_TS_KEY, ts)
-    await r.publish(PUBSUB_CH, s)
+
+    pipe = r.pipeline(transaction=True)
+    if kind == KEYFRAME:
+        pipe.set(SNAPSHOT_KEY, msg)
+        pipe.delete(DELTA_LOG_KEY)
+    else:
+        pipe.rpush(DELTA_LOG_KEY, msg)
+    pipe.set(SNAPSHOT_TS_KEY, ts)
+    pipe.publish(PUBSUB_CH, msg)
+    await pipe.execute()
+
+
+async def publish_error(r: redis.Redis, encoder: DeltaEncoder, payload: Dict[str, Any]) -> None:
+    # errors are forwarded to clients but never stored / applied to the state
+    await r.publish(PUBSUB_CH, error_message(encoder.seq or 0, payload))
 
 
-async def read_latest_snapshot(r: redis.Redis) -> Optional[str]:
-    return await r.get(SNAPSHOT_KEY)
+async def read_snapshot_log(r: redis.Redis) -> List[str]:
+    """Keyframe + deltas since it, in order (what a worker replays to resync)."""
+    pipe = r.pipeline(transaction=True)
+    pipe.get(SNAPSHOT_KEY)
+    pipe.lrange(DELTA_LOG_KEY, 0, -1)
+    keyframe, deltas = await pipe.execute()
+    return [keyframe, *deltas] if keyframe else []
 
 
 # ---------------------------
 # Indicators cache (Redis)
 # ---------------------------
-async def write_indicators_cache(r: redis.Redis, items: List[Dict[str, Any]]) -> None:
-    """
-    Store indicators for each (exchange, token)
-    """
-    cache: Dict[str, Any] = {}
-    stored = 0
+def _indicator_fields(items: List[Dict[str, Any]]) -> Dict[str, str]:
+    """EX:TOKEN -> encoded indicators for every item that has some."""
+    fields: Dict[str, str] = {}
     for it in items:
         ex = str(it.get("exchange", "")).upper().strip()
         tok = str(it.get("token", "")).strip()
@@ -117,23 +155,93 @@ async def write_indicators_cache(r: redis.Redis, items: List[Dict[str, Any]]) ->
 
         indicators = it.get("indicators") or {}
         if isinstance(indicators, dict) and indicators:
-            cache[f"{ex}:{tok}"] = indicators
-            stored += 1
+            fields[f"{ex}:{tok}"] = to_json(indicators)
+    return fields
+
+
+async def write_indicators_cache(
+    r: redis.Redis,
+    items: List[Dict[str, Any]],
+    full: bool = True,
+    owns: Optional[Callable[[str], bool]] = None,
+) -> None:
+    """
+    Store indicators for each (exchange, token) as one hash field.
+
+    Only fields whose value changed are written; they get the new generation
+    in IND_VER_KEY. full=True (a whole-universe refresh) also drops symbols
+    that are no longer present; full=False updates just the given subset.
+    With `owns` (a producer shard) full=True only drops fields this shard owns.
+    """
+    fields = _indicator_fields(items)
+    current = await r.hgetall(IND_HASH_KEY)
+    changed = {k: v for k, v in fields.items() if current.get(k) != v}
+    removed = [k for k in current if k not in fields and (owns is None or owns(k))] if full else []
+
+    if changed or removed:
+        gen = int(await r.incr(IND_SEQ_KEY))
+        pipe = r.pipeline(transaction=True)
+        if changed:
+            pipe.hset(IND_HASH_KEY, mapping=changed)
+            pipe.hset(IND_VER_KEY, mapping={k: gen for k in changed})
+        if removed:
+            pipe.hdel(IND_HASH_KEY, *removed)
+            pipe.hdel(IND_VER_KEY, *removed)
+        pipe.set(IND_TS_KEY, datetime.now().isoformat())
+        pipe.set(IND_GEN_KEY, gen)  # same transaction as the fields
+        await pipe.execute()
+    else:
+        await r.set(IND_TS_KEY, datetime.now().isoformat())
+    print(f"[AngelProducer] ✅ indicators_cache stored={len(fields)} changed={len(changed)} removed={len(removed)}")
+
 
-    await r.set(IND_CACHE_KEY, to_json(cache))
-    await r.set(IND_TS_KEY, datetime.now().isoformat())
-    print(f"[AngelProducer] ✅ indicators_cache stored={stored} keys (total_cache={len(cache)})")
+class IndicatorsCache:
+    """
+    Local decoded copy of the indicators hash. sync() costs one GET while
+    nothing changed; after a heavy refresh only fields whose version moved
+    are fetched and decoded.
+    """
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.versions: Dict[str, str] = {}
+        self.gen: Optional[str] = None
+        self.fields_loaded = 0
+
+    async def sync(self, r: redis.Redis) -> Dict[str, Any]:
+        gen = await r.get(IND_GEN_KEY)
+        if gen is not None and gen == self.gen:
+            return self.data
+
+        versions = await r.hgetall(IND_VER_KEY)
+        stale = [k for k, v in versions.items() if self.versions.get(k) != v]
+        if stale:
+            for k, raw in zip(stale, await r.hmget(IND_HASH_KEY, stale)):
+                if raw is None:
+                    versions.pop(k, None)  # removed meanwhile; next generation tells
+                    continue
+                try:
+                    self.data[k] = json.loads(raw)
+                except Exception:
+                    versions.pop(k, None)
+            self.fields_loaded += len(stale)
+        for k in [k for k in self.data if k not in versions]:
+            del self.data[k]
+
+        self.versions = versions
+        self.gen = gen
+        return self.data
 
 
 async def read_indicators_cache(r: redis.Redis) -> Dict[str, Any]:
-    raw = await r.get(IND_CACHE_KEY)
-    if not raw:
-        return {}
-    try:
-        obj = json.loads(raw)
-        return obj if isinstance(obj, dict) else {}
-    except Exception:
-        return {}
+    """Whole cache (one-off readers; the fast loop keeps an IndicatorsCache)."""
+    out: Dict[str, Any] = {}
+    for k, raw in (await r.hgetall(IND_HASH_KEY)).items():
+        try:
+            out[k] = json.loads(raw)
+        except Exception:
+            continue
+    return out
 
 
 async def read_indicators_ts(r: redis.Redis) -> Optional[str]:
@@ -208,22 +316,6 @@ def build_local_trade_plan(*, signal: str, score: int, quote_full: Dict[str, Any
 # ---------------------------
 # DB helpers (Grok recommendations)
 # ---------------------------
-def grok_exists_today(db: Session, *, trade_date: date, exchange: str, token: str) -> bool:
-    """
-    Check if (trade_date, exchange, token) already exists in DB.
-    """
-    return (
-        db.query(GrokRecommendation.id)
-        .filter(
-            GrokRecommendation.trade_date == trade_date,
-            GrokRecommendation.exchange == exchange,
-            GrokRecommendation.token == token,
-        )
-        .first()
-        is not None
-    )
-
-
 def insert_grok_reco(db: Session, payload: Dict[str, Any]) -> bool:
     """
     Insert recommendation. Returns True if inserted, False if duplicate (unique constraint).
@@ -241,6 +333,102 @@ def insert_grok_reco(db: Session, payload: Dict[str, Any]) -> bool:
         raise
 
 
+def _grok_quote(q: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "ltp": q.get("ltp"),
+        "open": q.get("open"),
+        "high": q.get("high"),
+        "low": q.get("low"),
+        "close": q.get("close"),
+        "tradeVolume": q.get("tradeVolume"),
+        "totBuyQuan": q.get("totBuyQuan"),
+        "totSellQuan": q.get("totSellQuan"),
+    }
+
+
+def _grok_local_plan(job: Dict[str, Any]) -> Dict[str, Any]:
+    return build_local_trade_plan(signal=job["signal"], score=job["score"], quote_full=_grok_quote(job["quote"]))
+
+
+def _grok_input(job: Dict[str, Any]) -> Dict[str, Any]:
+    it, q = job["item"], job["quote"]
+    return plan_input(
+        symbol=it.get("symbol") or it.get("name") or it.get("tradingsymbol") or "",
+        exchange=job["exchange"],
+        score=job["score"],
+        signal=job["signal"],
+        quote_full={**_grok_quote(q), "52WeekLow": q.get("52WeekLow"), "52WeekHigh": q.get("52WeekHigh")},
+        indicators_30m=job["indicators_30m"],
+        indicators_day=job["indicators_day"],
+        local_plan=_grok_local_plan(job),
+        news_context=[],
+    )
+
+
+grok_batcher = GrokBatcher()
+
+
+async def run_grok_jobs(jobs: List[Dict[str, Any]]) -> List[Tuple[Optional[Dict[str, Any]], Optional[BaseException]]]:
+    """Queue worker step: cached / batched Grok calls (GrokQueue applies timeout + retries)."""
+    # a batch call plus its per-symbol fallback has to fit in one queue attempt
+    # (a few seconds are left for the plan cache round trips)
+    return await grok_batcher.plans([_grok_input(j) for j in jobs], budget_sec=max(1.0, GROK_TIMEOUT_SEC - 5))
+
+
+async def complete_grok_job(job: Dict[str, Any], grok_plan: Optional[Dict[str, Any]], err: Optional[BaseException]) -> None:
+    """Queue completion: store (duplicate-safe) and publish on GROK_PUBSUB_CH."""
+    it, q = job["item"], job["quote"]
+    local_plan = _grok_local_plan(job)
+    if err is not None or not isinstance(grok_plan, dict):
+        grok_plan = {
+            "symbol": it.get("symbol") or it.get("name") or "",
+            "exchange": job["exchange"],
+            "direction": "BUY" if job["signal"] == "BUY" else "SELL",
+            "entry": (q.get("ltp") or None),
+            "stop_loss": (local_plan or {}).get("stop_loss"),
+            "targets": (local_plan or {}).get("targets") or {"t1": None, "t2": None, "t3": None},
+            "timeframe": "intraday",
+            "confidence": 0,
+            "rationale": ["Grok call failed", str(err)],
+            "risk_notes": ["Validate manually before taking any trade."],
+            "news": [],
+        }
+
+    db_payload = {
+        "trade_date": job["trade_date"],
+        "exchange": job["exchange"],
+        "token": job["token"],
+        "symbol": it.get("symbol"),
+        "name": it.get("name"),
+        "tradingsymbol": it.get("tradingsymbol"),
+        "category": it.get("category"),
+        "score": job["score"],
+        "signal": job["signal"],
+        "quote_full": _grok_quote(q),
+        "indicators": {"30m": job["indicators_30m"], "day": job["indicators_day"]},
+        "local_plan": local_plan,
+        "grok_plan": grok_plan,
+        "news": grok_plan.get("news") if isinstance(grok_plan, dict) else [],
+    }
+
+    def _insert() -> bool:
+        db = SessionLocal()
+        try:
+            return insert_grok_reco(db, db_payload)
+        finally:
+            db.close()
+
+    # duplicate-safe via unique constraint
+    inserted = await asyncio.to_thread(_insert)
+
+    # optional realtime publish (DB remains source of truth)
+    if inserted:
+        try:
+            await get_async_redis().publish(GROK_PUBSUB_CH, to_json(db_payload))
+        except Exception:
+            pass
+
+
 def serialize_grok_row(r: GrokRecommendation) -> Dict[str, Any]:
     return {
         "id": r.id,
@@ -263,9 +451,39 @@ def serialize_grok_row(r: GrokRecommendation) -> Dict[str, Any]:
 
 
 # ---------------------------
-# Producer
+# SSE broadcaster (one Redis pubsub per worker for all SSE clients)
 # ---------------------------
+async def _load_snapshot_log() -> List[str]:
+    return await read_snapshot_log(get_async_redis())
+
+
+async def _load_latest_grok() -> Optional[str]:
+    def _latest():
+        db = SessionLocal()
+        try:
+            row = db.query(GrokRecommendation).order_by(GrokRecommendation.id.desc()).first()
+            return serialize_grok_row(row) if row else None
+        finally:
+            db.close()
+
+    latest = await asyncio.to_thread(_latest)
+    return to_json(latest) if latest else None
+
+
+broadcaster = Broadcaster(
+    channels=[PUBSUB_CH, GROK_PUBSUB_CH],
+    loaders={PUBSUB_CH: _load_snapshot_log, GROK_PUBSUB_CH: _load_latest_grok},
+    states={PUBSUB_CH: SnapshotState()},
+    queue_size=int(os.getenv("SSE_QUEUE_SIZE", "16")),
+    idle_timeout=float(os.getenv("SSE_IDLE_TIMEOUT_SEC", "120")),
+)
+
+
 _producer_task: Optional[asyncio.Task] = None
+_shards: Optional[ShardMembership] = None
+
+# strong signals -> Grok plans, off the fast tick (see grok_queue.py)
+grok = GrokQueue(run=run_grok_jobs, done=complete_grok_job, batch=GROK_BATCH_MAX_ITEMS)
 
 
 def start_background_producer(
@@ -278,28 +496,39 @@ def start_background_producer(
     lookback_days_30m: int = 60,
     lookback_days_day: int = 520,
     quote_chunk_size: int = 50,
-    quote_sleep_s: float = 0.2,
-    candle_concurrency: int = 15,  # kept for compatibility
+    candle_concurrency: int = 15,
 ):
     """
-    ✅ FAST + LIGHT:
+    ✅ SHARDED:
+    - Every worker that calls this is a member; the universe is split by a
+      consistent-hash ring over the live members (producer_shards.py) and a
+      dead member's slice moves to the others within SHARD_MEMBER_TTL_SEC
+    - The leader (LOCK_KEY) merges the member shards into the one published
+      keyframe / delta stream; quotes / indicators / Grok scale with members
+
+    ✅ FAST + LIGHT (per member, own slice):
     - Every fast_refresh_sec: only quote_full_bulk (LTP) => fast updates
     - Every heavy_refresh_sec: heavy build_signals => updates indicators cache
+    - Quote chunks / candle deltas go out concurrently on a pooled async
+      Angel client, paced by the cluster-wide Angel rate-limit buckets
+      (candle_concurrency bounds in-flight candle calls)
     - SSE publishes latest snapshot every fast tick
 
     ✅ GROK:
-    - If score > 4 or < -4 => generate recommendation
-    - Store recommendation in DB (no redis cache)
-    - Same day duplicate check = DB + unique constraint
+    - If score > 4 or < -4 => offered to the Grok queue (never awaited in the tick)
+    - Queue workers batch several symbols per Grok prompt, reuse cached plans
+      for identical inputs (grok_batch.py), store in DB (source of truth)
+    - Same day duplicate check = Redis SET NX claim + unique constraint
     - Optional publish on GROK_PUBSUB_CH for realtime SSE
     """
     global _producer_task
     if _producer_task and not _producer_task.done():
         return
 
-    leader_id = sha1_text(f"{os.getpid()}-{os.urandom(6).hex()}")
+    leader_id = sha1_text(f"{os.getpid()}-{os.urandom(6).hex()}")  # also the shard member id
 
     async def _run():
+        global _shards
         try:
             r = await get_redis()
         except Exception as e:
@@ -308,13 +537,24 @@ def start_background_producer(
 
         stocklist = load_stocklist(stocklist_path)
         base_items = flatten_stocklist(stocklist)
+        order = {symbol_key(it): i for i, it in enumerate(base_items)}
+        angel = AngelClient(tokens_path)
+        ind_local = IndicatorsCache()
+        shards = _shards = ShardMembership(leader_id)
+        grok.start()
 
         publish_lock = asyncio.Lock()
         heavy_lock = asyncio.Lock()
+        rebalanced = asyncio.Event()
+        own_tick = asyncio.Event()
+        own_shard: Dict[str, Any] = {}  # latest local shard (the leader merges it without a round trip)
+        encoder = DeltaEncoder(keyframe_every=KEYFRAME_EVERY)
 
         async def run_heavy_once(tag: str = "manual"):
             try:
                 async with heavy_lock:
+                    ring = shards.ring
+                    mine = shards.shard(base_items)
                     res = await asyncio.to_thread(
                         build_signals,
                         stocklist_path=stocklist_path,
@@ -325,48 +565,68 @@ def start_background_producer(
                         lookback_days_day=lookback_days_day,
                         min_candles_30m=20,
                         min_candles_day=20,
+                        candle_concurrency=candle_concurrency,
+                        universe=mine,
                     )
                     items = (res.get("items") or [])
-                    await write_indicators_cache(r, items)
-                    print(f"[AngelProducer] ✅ heavy({tag}) refreshed at {datetime.now().isoformat()} items={len(items)}")
+                    await write_indicators_cache(r, items, owns=lambda k: ring.owner(k) == leader_id)
+                    print(f"[AngelProducer] ✅ heavy({tag}) refreshed at {datetime.now().isoformat()} items={len(items)} shard={len(mine)}/{len(base_items)}")
             except Exception as e:
                 print(f"[AngelProducer] ❌ heavy({tag}) error: {e}")
 
         async def heavy_loop():
             while True:
                 await run_heavy_once(tag="loop")
-                await asyncio.sleep(max(5, int(heavy_refresh_sec)))
+                rebalanced.clear()
+                try:
+                    # a rebalance hands us symbols: refresh them without waiting a full period
+                    await asyncio.wait_for(rebalanced.wait(), timeout=max(5, int(heavy_refresh_sec)))
+                    await asyncio.sleep(5)  # let the membership settle
+                except asyncio.TimeoutError:
+                    pass
+
+        async def membership_loop():
+            while True:
+                try:
+                    if await shards.heartbeat(r):
+                        rebalanced.set()
+                        print(f"[AngelProducer] 🔀 shards rebalanced: members={len(shards.members)} "
+                              f"epoch={shards.epoch} mine={len(shards.shard(base_items))}/{len(base_items)}")
+                except Exception as e:
+                    print(f"[AngelProducer] ⚠️ shard heartbeat failed: {e}")
+                await asyncio.sleep(shards.heartbeat_sec)
 
         async def fast_loop():
             while True:
                 try:
-                    ind_cache = await read_indicators_cache(r)
+                    ind_cache = await ind_local.sync(r)
                     ind_ts = await read_indicators_ts(r)
 
                     if not ind_cache and not ind_ts:
                         await run_heavy_once(tag="warmup")
-                        ind_cache = await read_indicators_cache(r)
+                        ind_cache = await ind_local.sync(r)
                         ind_ts = await read_indicators_ts(r)
 
+                    shard_items = shards.shard(base_items)
                     quote_maps: Dict[Tuple[str, str], Dict[str, Any]] = {}
-                    chunks = chunk_tokens(base_items, chunk_size=quote_chunk_size)
+                    chunks = chunk_tokens(shard_items, chunk_size=quote_chunk_size)
 
-                    for ex_tokens in chunks:
-                        resp = await asyncio.to_thread(quote_full_bulk, ex_tokens, tokens_path, 3)
+                    # ✅ all chunks concurrently (bounded) on the shared keep-alive client
+                    for resp in await angel.quote_full_many(chunks, max_retries=3):
                         data = (resp or {}).get("data") or {}
                         fetched = data.get("fetched") or []
                         if not fetched:
-                            print("[AngelProducer] quote_full_bulk empty:",
+                            print("[AngelProducer] quote_full empty:",
                                 "status=", resp.get("status"),
                                 "message=", resp.get("message"),
                                 "errorcode=", resp.get("errorcode"))
                         quote_maps.update(parse_quote_map(resp))
-                        await asyncio.sleep(quote_sleep_s)
 
                     out_items: List[Dict[str, Any]] = []
                     errors: List[Dict[str, Any]] = []
 
-                    for it in base_items:
+                    quoted: List[Tuple[Dict[str, Any], str, str, Dict[str, Any], Any, Dict[str, Any]]] = []
+                    for it in shard_items:
                         ex = it["exchange"]
                         tok = str(it["token"]).strip()
 
@@ -377,9 +637,14 @@ def start_background_producer(
 
                         indicators = ind_cache.get(f"{ex}:{tok}") or {}
                         ind30 = (indicators.get("30m") if isinstance(indicators, dict) else None) or {}
-                        sig = score_signal(q, ind30)
+                        quoted.append((it, ex, tok, q, indicators, ind30))
+
+                    # ✅ score the whole slice in one vectorized pass
+                    sigs = score_signals_batch([row[3] for row in quoted], [row[5] for row in quoted])
 
-                        # ✅ GROK recommendation trigger
+                    for (it, ex, tok, q, indicators, ind30), sig in zip(quoted, sigs):
+
+                        # ✅ GROK recommendation: enqueue only (workers call Grok / store / publish)
                         try:
                             sc = int(sig.get("score") or 0)
                         except Exception:
@@ -387,118 +652,20 @@ def start_background_producer(
 
                         if sc > 4 or sc < -4:
                             tdate = today_date()
-
-                            # 1) Quick DB exists check (non-blocking via thread)
-                            def _should_generate() -> bool:
-                                db = SessionLocal()
-                                try:
-                                    return not grok_exists_today(db, trade_date=tdate, exchange=ex, token=tok)
-                                finally:
-                                    db.close()
-
-                            should_generate = await asyncio.to_thread(_should_generate)
-
-                            if should_generate:
-                                indicators_day = (indicators.get("day") if isinstance(indicators, dict) else None) or {}
-                                local_plan = build_local_trade_plan(
-                                    signal=str(sig.get("signal") or "WAIT"),
-                                    score=sc,
-                                    quote_full={
-                                        "ltp": q.get("ltp"),
-                                        "open": q.get("open"),
-                                        "high": q.get("high"),
-                                        "low": q.get("low"),
-                                        "close": q.get("close"),
-                                        "tradeVolume": q.get("tradeVolume"),
-                                        "totBuyQuan": q.get("totBuyQuan"),
-                                        "totSellQuan": q.get("totSellQuan"),
-                                    },
-                                )
-
-                                # 2) Call grok (in thread)
-                                try:
-                                    grok_plan = await asyncio.to_thread(
-                                        generate_trade_plan_with_grok,
-                                        symbol=it.get("symbol") or it.get("name") or it.get("tradingsymbol") or "",
-                                        exchange=ex,
-                                        score=sc,
-                                        signal=str(sig.get("signal") or "WAIT"),
-                                        quote_full={
-                                            "ltp": q.get("ltp"),
-                                            "open": q.get("open"),
-                                            "high": q.get("high"),
-                                            "low": q.get("low"),
-                                            "close": q.get("close"),
-                                            "tradeVolume": q.get("tradeVolume"),
-                                            "totBuyQuan": q.get("totBuyQuan"),
-                                            "totSellQuan": q.get("totSellQuan"),
-                                            "52WeekLow": q.get("52WeekLow"),
-                                            "52WeekHigh": q.get("52WeekHigh"),
-                                        },
-                                        indicators_30m=ind30,
-                                        indicators_day=indicators_day,
-                                        local_plan=local_plan,
-                                        news_context=[],
-                                        timeout_sec=20,
-                                    )
-                                except Exception as e:
-                                    grok_plan = {
-                                        "symbol": it.get("symbol") or it.get("name") or "",
-                                        "exchange": ex,
-                                        "direction": "BUY" if str(sig.get("signal")) == "BUY" else "SELL",
-                                        "entry": (q.get("ltp") or None),
-                                        "stop_loss": (local_plan or {}).get("stop_loss"),
-                                        "targets": (local_plan or {}).get("targets") or {"t1": None, "t2": None, "t3": None},
-                                        "timeframe": "intraday",
-                                        "confidence": 0,
-                                        "rationale": ["Grok call failed", str(e)],
-                                        "risk_notes": ["Validate manually before taking any trade."],
-                                        "news": [],
-                                    }
-
-                                # 3) DB payload
-                                db_payload = {
+                            grok.offer(
+                                tdate, ex, tok,
+                                {
                                     "trade_date": tdate,
+                                    "item": it,
                                     "exchange": ex,
                                     "token": tok,
-                                    "symbol": it.get("symbol"),
-                                    "name": it.get("name"),
-                                    "tradingsymbol": it.get("tradingsymbol"),
-                                    "category": it.get("category"),
+                                    "quote": q,
                                     "score": sc,
                                     "signal": str(sig.get("signal") or "WAIT"),
-                                    "quote_full": {
-                                        "ltp": q.get("ltp"),
-                                        "open": q.get("open"),
-                                        "high": q.get("high"),
-                                        "low": q.get("low"),
-                                        "close": q.get("close"),
-                                        "tradeVolume": q.get("tradeVolume"),
-                                        "totBuyQuan": q.get("totBuyQuan"),
-                                        "totSellQuan": q.get("totSellQuan"),
-                                    },
-                                    "indicators": {"30m": ind30, "day": indicators_day},
-                                    "local_plan": local_plan,
-                                    "grok_plan": grok_plan,
-                                    "news": grok_plan.get("news") if isinstance(grok_plan, dict) else [],
-                                }
-
-                                # 4) Insert (duplicate-safe via unique constraint)
-                                def _insert() -> bool:
-                                    db = SessionLocal()
-                                    try:
-                                        return insert_grok_reco(db, db_payload)
-                                    finally:
-                                        db.close()
-
-                                inserted = await asyncio.to_thread(_insert)
-
-                                # 5) Optional realtime publish (DB remains source of truth)
-                                if inserted:
-                                    try:
-                                        await r.publish(GROK_PUBSUB_CH, to_json(db_payload))
-                                    except Exception:
-                                        pass
+                                    "indicators_30m": ind30,
+                                    "indicators_day": (indicators.get("day") if isinstance(indicators, dict) else None) or {},
+                                },
+                            )
 
                         out_items.append(
                             {
@@ -522,83 +689,131 @@ def start_background_producer(
                             }
                         )
 
-                    payload = {
-                        "ok": True,
-                        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "mode": "FAST_QUOTES",
-                        "intervals": {"30m": interval_30m, "day": interval_day},
-                        "refresh": {"fast_sec": fast_refresh_sec, "heavy_sec": heavy_refresh_sec},
+                    shard_payload = {
+                        "member": leader_id,
+                        "epoch": shards.epoch,
                         "indicators_cache_ts": ind_ts,
-                        "count": len(out_items),
-                        "errors_count": len(errors),
                         "items": out_items,
                         "errors": errors,
                     }
-
-                    async with publish_lock:
-                        await publish_snapshot(r, payload)
+                    own_shard.clear()
+                    own_shard.update(shard_payload)
+                    own_tick.set()
+                    if len(shards.members) > 1:
+                        # alone we are the leader too; nobody else reads our shard
+                        await shards.store(r, to_json(shard_payload), ttl_sec=3 * fast_refresh_sec)
 
                 except Exception as e:
                     err_payload = {"ok": False, "error": str(e), "ts": datetime.now().isoformat()}
                     try:
                         async with publish_lock:
-                            await publish_snapshot(r, err_payload)
+                            await publish_error(r, encoder, err_payload)
                     except Exception:
                         pass
 
                 await asyncio.sleep(max(1, int(fast_refresh_sec)))
 
-        # Leader election loop
-        while True:
-            try:
-                is_leader = await try_become_leader(r, leader_id)
-                if not is_leader:
-                    await asyncio.sleep(1.0)
-                    continue
-
-                print("[AngelProducer] ✅ Leader:", leader_id)
+        async def publish_loop():
+            # leader only: merge every member's latest shard into one snapshot
+            while True:
+                try:
+                    try:
+                        await asyncio.wait_for(own_tick.wait(), timeout=max(1, int(fast_refresh_sec)) * 2)
+                    except asyncio.TimeoutError:
+                        pass
+                    own_tick.clear()
+
+                    shard_map = await shards.load_others(r)
+                    if own_shard:
+                        shard_map[leader_id] = dict(own_shard)
+                    if shard_map:
+                        out_items, errors, ind_ts = merge_shards(shard_map, shards.ring, order)
+                        payload = {
+                            "ok": True,
+                            "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            "mode": "FAST_QUOTES",
+                            "intervals": {"30m": interval_30m, "day": interval_day},
+                            "refresh": {"fast_sec": fast_refresh_sec, "heavy_sec": heavy_refresh_sec},
+                            "indicators_cache_ts": ind_ts,
+                            "shards": {"members": len(shards.members), "reporting": len(shard_map), "epoch": shards.epoch},
+                            "count": len(out_items),
+                            "errors_count": len(errors),
+                            "items": out_items,
+                            "errors": errors,
+                        }
 
-                lost = asyncio.Event()
+                        async with publish_lock:
+                            await publish_snapshot(r, encoder, payload)
 
-                async def lock_keeper():
-                    # ✅ keeps the lock alive even during heavy warmup
+                except Exception as e:
+                    err_payload = {"ok": False, "error": str(e), "ts": datetime.now().isoformat()}
                     try:
-                        while True:
-                            ok = await refresh_leader_lock(r, leader_id)
-                            if not ok:
-                                lost.set()
-                                break
-                            await asyncio.sleep(5)
+                        async with publish_lock:
+                            await publish_error(r, encoder, err_payload)
                     except Exception:
-                        lost.set()
+                        pass
+
+        member_tasks: List[asyncio.Task] = []
+        try:
+            # Membership first (warmup must not stall heartbeats), then this member's slice
+            try:
+                await shards.heartbeat(r)
+            except Exception as e:
+                print(f"[AngelProducer] ⚠️ shard heartbeat failed: {e}")
+            member_tasks.append(asyncio.create_task(membership_loop()))
+            await run_heavy_once(tag="member_start")
+            member_tasks += [asyncio.create_task(heavy_loop()), asyncio.create_task(fast_loop())]
 
-                keeper_task = asyncio.create_task(lock_keeper())
+            # Leader election loop (publisher)
+            while True:
+                try:
+                    is_leader = await try_become_leader(r, leader_id)
+                    if not is_leader:
+                        await asyncio.sleep(1.0)
+                        continue
 
-                # ✅ Warmup (heavy) - lock will NOT expire now
-                await run_heavy_once(tag="leader_start")
+                    print("[AngelProducer] ✅ Leader:", leader_id)
+                    encoder.reset()  # first tick of a term is always a keyframe
 
-                heavy_task = asyncio.create_task(heavy_loop())
-                fast_task = asyncio.create_task(fast_loop())
+                    lost = asyncio.Event()
 
-                # ✅ wait until leadership is lost
-                await lost.wait()
+                    async def lock_keeper():
+                        try:
+                            while True:
+                                ok = await refresh_leader_lock(r, leader_id)
+                                if not ok:
+                                    lost.set()
+                                    break
+                                await asyncio.sleep(5)
+                        except Exception:
+                            lost.set()
 
-                print("[AngelProducer] ⚠️ Lost leadership")
-                heavy_task.cancel()
-                fast_task.cancel()
-                keeper_task.cancel()
+                    keeper_task = asyncio.create_task(lock_keeper())
+                    publish_task = asyncio.create_task(publish_loop())
+                    # drop the previous terms' finished tasks; keep ours so they stop with the producer
+                    member_tasks[:] = [t for t in member_tasks if not t.done()]
+                    member_tasks += [keeper_task, publish_task]
 
-                # small backoff
-                await asyncio.sleep(1)
+                    # ✅ wait until leadership is lost
+                    await lost.wait()
 
-            except Exception as e:
-                print(f"[AngelProducer] ❌ Leader loop error: {e}")
-                await asyncio.sleep(2)
+                    print("[AngelProducer] ⚠️ Lost leadership")
+                    publish_task.cancel()
+                    keeper_task.cancel()
 
+                    # small backoff
+                    await asyncio.sleep(1)
 
-            except Exception as e:
-                print(f"[AngelProducer] ❌ Leader loop error: {e}")
-                await asyncio.sleep(2)
+                except Exception as e:
+                    print(f"[AngelProducer] ❌ Leader loop error: {e}")
+                    await asyncio.sleep(2)
+        finally:
+            for t in member_tasks:
+                t.cancel()
+            try:
+                await shards.leave(r)  # the others take our slice on their next heartbeat
+            except Exception:
+                pass
 
     _producer_task = asyncio.create_task(_run())
 
@@ -611,6 +826,14 @@ async def health():
     return {"ok": True, "ts": datetime.now().isoformat()}
 
 
+@router.get("/angel/signals/shards")
+async def signals_shards():
+    """This worker's producer membership and the live shard ring."""
+    if _shards is None:
+        return {"member": None, "note": "producer not running on this worker"}
+    return _shards.metrics()
+
+
 @router.get("/angel/signals/once")
 def signals_once():
     """
@@ -629,51 +852,101 @@ def signals_once():
     return JSONResponse(res)
 
 
+_NO_SNAPSHOT = to_json({"ok": True, "items": [], "note": "No snapshot yet"})
+
+
+@router.get("/angel/signals/snapshot")
+async def signals_snapshot(mode: str = Query("keyframe", pattern="^(keyframe|full)$")):
+    """Resync point for delta clients (keyframe) / one-shot full snapshot."""
+    # the pubsub listener keeps the state current even with no stream clients here
+    broadcaster.ensure_started()
+    keyframe = await broadcaster.latest(PUBSUB_CH)
+    if mode == "full":
+        body = broadcaster.states[PUBSUB_CH].full_json() if keyframe else None
+    else:
+        body = keyframe
+    return Response(content=body or _NO_SNAPSHOT, media_type="application/json")
+
+
 @router.get("/angel/signals/stream")
-async def signals_stream(ping_sec: int = Query(15, ge=5, le=60)):
-    r = await get_redis()
-    pubsub = r.pubsub()
-    await pubsub.subscribe(PUBSUB_CH)
+async def signals_stream(
+    ping_sec: int = Query(15, ge=5, le=60),
+    mode: str = Query("delta", pattern="^(delta|full)$", description="delta: keyframe + deltas | full: legacy full snapshot per tick"),
+):
+    """
+    mode=delta -> "keyframe" event, then "delta" events (id = seq, delta.base = previous seq).
+                  A client seeing base != its last seq has a gap: reconnect or GET /angel/signals/snapshot.
+                  If this client's queue overflowed, the server sends a fresh keyframe itself.
+    mode=full  -> legacy "snapshot" events with the full payload (rebuilt per worker, once per seq).
+    """
+    sub = await broadcaster.subscribe(PUBSUB_CH)
+    state = broadcaster.states[PUBSUB_CH]
+
+    def _keyframe_event(keyframe: Optional[str]):
+        if mode == "full":
+            return {"event": "snapshot", "id": str(state.seq or ""), "data": state.full_json() or _NO_SNAPSHOT}
+        if not keyframe:
+            return {"event": "snapshot", "data": _NO_SNAPSHOT}
+        return {"event": KEYFRAME, "id": str(peek(keyframe)[1]), "data": keyframe}
 
     async def event_generator():
         try:
-            latest = await read_latest_snapshot(r)
-            if latest:
-                yield {"event": "snapshot", "id": datetime.now().isoformat(), "data": latest}
-            else:
-                yield {
-                    "event": "snapshot",
-                    "id": datetime.now().isoformat(),
-                    "data": to_json({"ok": True, "items": [], "note": "No snapshot yet"}),
-                }
-
-            last_ping = asyncio.get_event_loop().time()
+            keyframe = await broadcaster.latest(PUBSUB_CH)
+            sent_seq = peek(keyframe)[1] if keyframe else None
+            yield _keyframe_event(keyframe)
 
+            dropped = sub.dropped
             while True:
-                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if msg and msg.get("type") == "message":
-                    yield {"event": "snapshot", "id": datetime.now().isoformat(), "data": msg["data"]}
-
-                now = asyncio.get_event_loop().time()
-                if now - last_ping >= ping_sec:
+                data = await sub.get(timeout=ping_sec)
+                if data is CLOSE:
+                    break
+                if data is None:
                     yield {"event": "ping", "data": to_json({"ts": datetime.now().isoformat()})}
-                    last_ping = now
+                    continue
+
+                kind, seq = peek(data)
+                if kind == ERROR:
+                    yield {"event": "snapshot" if mode == "full" else ERROR, "data": to_json(json.loads(data).get("error"))}
+                    continue
+
+                if sub.dropped != dropped or (kind == DELTA and sent_seq is None):
+                    # this client missed messages (queue overflow) / has no base -> resync
+                    dropped = sub.dropped
+                    keyframe = await broadcaster.latest(PUBSUB_CH)
+                    if keyframe:
+                        sent_seq = peek(keyframe)[1]
+                        yield _keyframe_event(keyframe)
+                    continue
 
-                await asyncio.sleep(0.05)
+                if seq is None or (sent_seq is not None and seq <= sent_seq):
+                    continue  # already contained in the keyframe we sent
+                sent_seq = seq
 
+                if mode == "full":
+                    yield {"event": "snapshot", "id": str(seq), "data": state.full_json() or _NO_SNAPSHOT}
+                else:
+                    yield {"event": kind, "id": str(seq), "data": data}
         finally:
-            try:
-                await pubsub.unsubscribe(PUBSUB_CH)
-                await pubsub.close()
-            except Exception:
-                pass
+            broadcaster.unsubscribe(sub)
 
     return EventSourceResponse(event_generator())
 
 
+@router.get("/angel/stream/metrics")
+async def stream_metrics():
+    """Per-worker SSE broadcaster counters (one Redis pubsub per worker)."""
+    return broadcaster.metrics()
+
+
 # ---------------------------
 # Routes (Grok Recommendations - DB source of truth)
 # ---------------------------
+@router.get("/angel/grok/queue/metrics")
+async def grok_queue_metrics():
+    """Grok work queue + batcher on this worker (only the producer leader feeds it)."""
+    return {**grok.metrics(), "batcher": grok_batcher.metrics()}
+
+
 @router.get("/angel/grok/recommendations")
 async def grok_recommendations(limit: int = Query(50, ge=1, le=200)):
     def _read():
@@ -719,48 +992,29 @@ async def grok_recommendations_today(limit: int = Query(200, ge=1, le=500)):
 async def grok_stream(ping_sec: int = Query(15, ge=5, le=60)):
     """
     Realtime SSE for new Grok recos.
-    DB stores the reco; this stream listens on Redis pubsub channel for new inserts.
+    DB stores the reco; the worker's broadcaster relays GROK_PUBSUB_CH inserts.
     """
-    r = await get_redis()
-    pubsub = r.pubsub()
-    await pubsub.subscribe(GROK_PUBSUB_CH)
+    sub = await broadcaster.subscribe(GROK_PUBSUB_CH)
 
     async def event_generator():
         try:
-            # Send latest DB record once on connect (init)
-            def _latest():
-                db = SessionLocal()
-                try:
-                    row = db.query(GrokRecommendation).order_by(GrokRecommendation.id.desc()).first()
-                    return serialize_grok_row(row) if row else None
-                finally:
-                    db.close()
-
-            latest = await asyncio.to_thread(_latest)
-            if latest:
-                yield {"event": "reco", "id": datetime.now().isoformat(), "data": to_json(latest)}
-            else:
-                yield {"event": "reco", "id": datetime.now().isoformat(), "data": to_json({"ok": True, "note": "No reco yet"})}
-
-            last_ping = asyncio.get_event_loop().time()
+            # latest reco once on connect (cached per worker, DB only on first use)
+            latest = await broadcaster.latest(GROK_PUBSUB_CH)
+            yield {
+                "event": "reco",
+                "id": datetime.now().isoformat(),
+                "data": latest or to_json({"ok": True, "note": "No reco yet"}),
+            }
 
             while True:
-                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if msg and msg.get("type") == "message":
-                    yield {"event": "reco", "id": datetime.now().isoformat(), "data": msg["data"]}
-
-                now = asyncio.get_event_loop().time()
-                if now - last_ping >= ping_sec:
+                data = await sub.get(timeout=ping_sec)
+                if data is CLOSE:
+                    break
+                if data is None:
                     yield {"event": "ping", "data": to_json({"ts": datetime.now().isoformat()})}
-                    last_ping = now
-
-                await asyncio.sleep(0.05)
-
+                    continue
+                yield {"event": "reco", "id": datetime.now().isoformat(), "data": data}
         finally:
-            try:
-                await pubsub.unsubscribe(GROK_PUBSUB_CH)
-                await pubsub.close()
-            except Exception:
-                pass
+            broadcaster.unsubscribe(sub)
 
     return EventSourceResponse(event_generator())
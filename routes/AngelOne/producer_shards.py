@@ -0,0 +1,197 @@
+# routes/AngelOne/producer_shards.py
+"""
+Consistent-hash sharding of the signal universe across producer members.
+
+The producer used to be one leader doing quotes, indicators and Grok for
+the whole stockList while every other worker idled. Now every worker that
+starts the producer is a member:
+
+  - membership: each member heartbeats into the sorted set MEMBERS_KEY
+    (score = expiry on the Redis clock, SHARD_MEMBER_TTL_SEC). One Lua
+    call prunes expired members, renews ours and returns the live set,
+    so a dead member drops out within the TTL on every other host
+  - ownership: a HashRing over the live members (SHARD_VNODES points each)
+    maps EX:TOKEN -> member; a join / leave / death only moves the keys
+    of the affected ring segments
+  - each member quotes / scores / refreshes indicators for its own
+    slice and stores the result under SHARD_KEY_PREFIX<member> (same TTL)
+  - the leader (existing lock) no longer computes anything itself besides
+    its own slice: it merges the live shards into the one published
+    keyframe / delta stream (merge_shards), so clients see one view
+
+Members are expected to run the same stockList; a member that cannot
+reach Redis keeps serving its last slice until the others evict it.
+"""
+import bisect
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from redis.exceptions import NoScriptError
+
+MEMBERS_KEY = "angel:signals:members"      # zset member -> heartbeat expiry (ms, Redis clock)
+SHARD_KEY_PREFIX = "angel:signals:shard:"   # member -> latest shard payload
+
+SHARD_HEARTBEAT_SEC = float(os.getenv("SHARD_HEARTBEAT_SEC", "2"))
+SHARD_MEMBER_TTL_SEC = float(os.getenv("SHARD_MEMBER_TTL_SEC", "10"))
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+
+_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local ttl = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if ARGV[1] ~= '' then
+    redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+end
+redis.call('PEXPIRE', KEYS[1], ttl * 3)
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+_SHA = hashlib.sha1(_LUA.encode()).hexdigest()
+
+
+def symbol_key(item: Dict[str, Any]) -> str:
+    """Same EX:TOKEN form as the indicators hash fields."""
+    return f"{str(item.get('exchange', '')).upper().strip()}:{str(item.get('token', '')).strip()}"
+
+
+def _point(s: str) -> int:
+    return int(hashlib.sha1(s.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    def __init__(self, members: Iterable[str], vnodes: int = SHARD_VNODES):
+        self.members = sorted(set(members))
+        points = sorted((_point(f"{m}#{i}"), m) for m in self.members for i in range(max(1, vnodes)))
+        self._hashes = [h for h, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _point(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class ShardMembership:
+    def __init__(
+        self,
+        member_id: str,
+        heartbeat_sec: float = SHARD_HEARTBEAT_SEC,
+        ttl_sec: float = SHARD_MEMBER_TTL_SEC,
+        vnodes: int = SHARD_VNODES,
+    ):
+        self.member_id = member_id
+        self.heartbeat_sec = heartbeat_sec
+        self.ttl_sec = max(ttl_sec, heartbeat_sec * 2)
+        self.vnodes = vnodes
+        # alone until the first heartbeat says otherwise
+        self.ring = HashRing([member_id], vnodes)
+        self.epoch = 0
+
+        # metrics
+        self.heartbeats = 0
+        self.heartbeat_errors = 0
+        self.rebalances = 0
+
+    @property
+    def members(self) -> List[str]:
+        return self.ring.members
+
+    @property
+    def shard_key(self) -> str:
+        return SHARD_KEY_PREFIX + self.member_id
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.member_id
+
+    def shard(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [it for it in items if self.owns(symbol_key(it))]
+
+    async def _eval(self, r, member: str) -> List[str]:
+        args = (_SHA, 1, MEMBERS_KEY, member, int(self.ttl_sec * 1000))
+        try:
+            return await r.evalsha(*args)
+        except NoScriptError:
+            await r.script_load(_LUA)
+            return await r.evalsha(*args)
+
+    async def heartbeat(self, r) -> bool:
+        """Renew our membership; True when the live set (and so the ring) changed."""
+        try:
+            live = await self._eval(r, self.member_id)
+        except Exception:
+            self.heartbeat_errors += 1
+            raise
+        self.heartbeats += 1
+        live = sorted(set(live) | {self.member_id})
+        if live == self.ring.members:
+            return False
+        self.ring = HashRing(live, self.vnodes)
+        self.epoch += 1
+        self.rebalances += 1
+        return True
+
+    async def leave(self, r) -> None:
+        """Graceful exit: the others pick our slice up on their next heartbeat."""
+        pipe = r.pipeline(transaction=True)
+        pipe.zrem(MEMBERS_KEY, self.member_id)
+        pipe.delete(self.shard_key)
+        await pipe.execute()
+
+    async def store(self, r, payload: str, ttl_sec: Optional[float] = None) -> None:
+        await r.set(self.shard_key, payload, px=int(max(self.ttl_sec, ttl_sec or 0) * 1000))
+
+    async def load_others(self, r) -> Dict[str, Dict[str, Any]]:
+        """Latest shard payload of every other live member (missing ones left out)."""
+        others = [m for m in self.members if m != self.member_id]
+        if not others:
+            return {}
+        out: Dict[str, Dict[str, Any]] = {}
+        for m, raw in zip(others, await r.mget([SHARD_KEY_PREFIX + m for m in others])):
+            if not raw:
+                continue
+            try:
+                out[m] = json.loads(raw)
+            except ValueError:
+                continue
+        return out
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "member": self.member_id,
+            "members": self.members,
+            "epoch": self.epoch,
+            "heartbeats": self.heartbeats,
+            "heartbeat_errors": self.heartbeat_errors,
+            "rebalances": self.rebalances,
+        }
+
+
+def merge_shards(
+    shards: Dict[str, Dict[str, Any]],
+    ring: HashRing,
+    order: Dict[str, int],
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[str]]:
+    """
+    (items, errors, newest indicators_cache_ts) over all shard payloads.
+
+    Items come back in stockList order. While a rebalance settles two
+    shards may both carry a symbol; the current ring owner's copy wins.
+    """
+    best: Dict[str, Tuple[bool, Dict[str, Any]]] = {}
+    errors: List[Dict[str, Any]] = []
+    ind_ts: Optional[str] = None
+    for member, shard in shards.items():
+        errors.extend(shard.get("errors") or [])
+        ts = shard.get("indicators_cache_ts")
+        if ts and (ind_ts is None or ts > ind_ts):
+            ind_ts = ts
+        for it in shard.get("items") or []:
+            k = symbol_key(it)
+            owned = ring.owner(k) == member
+            if k not in best or (owned and not best[k][0]):
+                best[k] = (owned, it)
+    items = sorted((it for _, it in best.values()), key=lambda it: order.get(symbol_key(it), len(order)))
+    return items, errors, ind_ts
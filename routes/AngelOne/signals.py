@@ -1,13 +1,18 @@
 # routes/AngelOne/signals.py
+import asyncio
 import json
-import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, Any, List, Tuple, Optional
 
 import pandas as pd
 
-from routes.AngelOne.angel_data import load_json, quote_full_bulk, get_candles
-from routes.AngelOne.indicators import compute_indicators
+from db.connection import SessionLocal
+from db.redis_pool import close_loop_redis_pools
+from routes.AngelOne import candle_store
+from routes.AngelOne.angel_client import ANGEL_CANDLE_CONCURRENCY, ANGEL_QUOTE_CONCURRENCY, AngelClient
+from routes.AngelOne.angel_data import load_json
+from routes.AngelOne.batch_signals import score_signals_batch
+from routes.AngelOne.indicator_store import IndicatorStates
 
 
 def save_json(path: str, data: Any) -> None:
@@ -276,34 +281,127 @@ def main(
     lookback_days_30m: int = 60,
     lookback_days_day: int = 520,
     quote_chunk_size: int = 50,
-    quote_sleep_s: float = 1.1,
     min_candles_30m: int = 60,
     min_candles_day: int = 60,
+    quote_concurrency: int = ANGEL_QUOTE_CONCURRENCY,
+    candle_concurrency: int = ANGEL_CANDLE_CONCURRENCY,
+    universe: Optional[List[Dict[str, Any]]] = None,
 ) -> Dict[str, Any]:
-    stocklist = load_stocklist(stocklist_path)
-    items = flatten_stocklist(stocklist)
-
-    # 1) QUOTES (FULL)  ✅ NEW angel_data signature (no headers)
-    quote_maps: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    # universe: pre-flattened items to build instead of the whole stockList (a producer shard)
+    items = universe if universe is not None else flatten_stocklist(load_stocklist(stocklist_path))
     chunks = chunk_tokens(items, chunk_size=quote_chunk_size)
+    now = datetime.now(candle_store.IST)
 
-    for ex_tokens in chunks:
-        resp = quote_full_bulk(ex_tokens, tokens_path=tokens_path, max_retries=3)
-        quote_maps.update(parse_quote_map(resp))
-        time.sleep(quote_sleep_s)
+    out_items: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
 
-    # 2) CANDLES + INDICATORS + SIGNAL
-    now = datetime.now()
+    db = SessionLocal()
+    stats = candle_store.SyncStats()
+    try:
+        states = candle_store.load_sync_states(db, [interval_30m, interval_day])
+        ind_states = IndicatorStates(db, [interval_30m, interval_day])
+
+        # 1) QUOTES (FULL) + candle deltas, concurrently on one keep-alive client
+        quote_maps, fetched = asyncio.run(
+            _in_own_loop(_fetch_remote(
+                items, chunks, states, now, tokens_path, interval_30m, interval_day,
+                lookback_days_30m, lookback_days_day, quote_concurrency, candle_concurrency,
+            ))
+        )
 
-    from_30m = (now - timedelta(days=lookback_days_30m)).strftime("%Y-%m-%d %H:%M")
-    to_30m = now.strftime("%Y-%m-%d %H:%M")
+        # 2) CANDLES (local store) + INDICATORS + SIGNAL
+        _build_items(
+            db, states, ind_states, stats, items, quote_maps, out_items, errors, now,
+            tokens_path, interval_30m, interval_day, lookback_days_30m, lookback_days_day,
+            min_candles_30m, min_candles_day, fetched,
+        )
+        try:
+            ind_states.save(db)
+        except Exception as e:
+            db.rollback()
+            print(f"[Signals] ⚠️ indicator checkpoint save failed: {e}")
+        for interval, days in ((interval_30m, lookback_days_30m), (interval_day, lookback_days_day)):
+            try:
+                candle_store.prune(db, interval, days, now)
+            except Exception as e:
+                db.rollback()
+                print(f"[Signals] ⚠️ candle prune failed ({interval}): {e}")
+    finally:
+        db.close()
 
-    from_day = (now - timedelta(days=lookback_days_day)).strftime("%Y-%m-%d %H:%M")
-    to_day = now.strftime("%Y-%m-%d %H:%M")
+    return {
+        "ok": True,
+        "generated_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "intervals": {"30m": interval_30m, "day": interval_day},
+        "lookbacks": {"30m_days": lookback_days_30m, "day_days": lookback_days_day},
+        "candle_sync": stats.as_dict(),
+        "indicator_bars_replayed": ind_states.replayed,
+        "count": len(out_items),
+        "errors_count": len(errors),
+        "items": out_items,
+        "errors": errors,
+    }
 
-    out_items: List[Dict[str, Any]] = []
-    errors: List[Dict[str, Any]] = []
 
+async def _in_own_loop(coro):
+    """Run `coro` on this thread's own loop, then release the Redis pools bound to that loop."""
+    try:
+        return await coro
+    finally:
+        await close_loop_redis_pools()
+
+
+async def _fetch_remote(
+    items: List[Dict[str, Any]],
+    chunks: List[Dict[str, List[str]]],
+    states,
+    now: datetime,
+    tokens_path: str,
+    interval_30m: str,
+    interval_day: str,
+    lookback_days_30m: int,
+    lookback_days_day: int,
+    quote_concurrency: int,
+    candle_concurrency: int,
+) -> Tuple[Dict[Tuple[str, str], Dict[str, Any]], Dict[candle_store.SeriesKey, Dict[str, Any]]]:
+    async with AngelClient(tokens_path, quote_concurrency=quote_concurrency, candle_concurrency=candle_concurrency) as client:
+        quote_maps: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for resp in await client.quote_full_many(chunks, max_retries=3):
+            quote_maps.update(parse_quote_map(resp))
+
+        # candles only for stocks that have a quote (the rest are skipped anyway)
+        series: List[Tuple[candle_store.SeriesKey, int]] = []
+        for it in items:
+            ex = it["exchange"]
+            tok = str(it["token"]).strip()
+            if (ex, tok) in quote_maps:
+                series.append(((ex, tok, interval_30m), lookback_days_30m))
+                series.append(((ex, tok, interval_day), lookback_days_day))
+        fetched = await candle_store.fetch_many(client, states, series, now)
+    return quote_maps, fetched
+
+
+def _build_items(
+    db,
+    states,
+    ind_states: IndicatorStates,
+    stats: candle_store.SyncStats,
+    items: List[Dict[str, Any]],
+    quote_maps: Dict[Tuple[str, str], Dict[str, Any]],
+    out_items: List[Dict[str, Any]],
+    errors: List[Dict[str, Any]],
+    now: datetime,
+    tokens_path: str,
+    interval_30m: str,
+    interval_day: str,
+    lookback_days_30m: int,
+    lookback_days_day: int,
+    min_candles_30m: int,
+    min_candles_day: int,
+    fetched: Optional[Dict[candle_store.SeriesKey, Dict[str, Any]]] = None,
+) -> None:
+    # 1) per-stock candle sync (I/O); indicators + scoring then run per interval for all stocks
+    ready: List[Tuple[Dict[str, Any], str, str, Dict[str, Any], pd.DataFrame, pd.DataFrame]] = []
     for it in items:
         ex = it["exchange"]
         tok = str(it["token"]).strip()
@@ -313,24 +411,32 @@ def main(
             errors.append({"type": "QUOTE_MISSING", "item": it})
             continue
 
-        # ✅ 30 MIN candles (NEW signature: no headers)
-        c30 = get_candles(ex, tok, interval_30m, from_30m, to_30m, tokens_path=tokens_path, max_retries=3)
-        df30 = candles_to_df(c30)
+        # ✅ 30 MIN candles (stored history + delta fetch)
+        df30, c30 = candle_store.candle_frame(
+            db, states, ex, tok, interval_30m, lookback_days_30m, now, stats,
+            tokens_path=tokens_path, fetched=fetched,
+        )
         if df30 is None or len(df30) < min_candles_30m:
             errors.append({"type": "CANDLE_30M_MISSING", "item": it, "raw": c30})
             continue
-        ind30 = compute_indicators(df30)
 
         # ✅ DAILY candles
-        cday = get_candles(ex, tok, interval_day, from_day, to_day, tokens_path=tokens_path, max_retries=3)
-        dfday = candles_to_df(cday)
+        dfday, cday = candle_store.candle_frame(
+            db, states, ex, tok, interval_day, lookback_days_day, now, stats,
+            tokens_path=tokens_path, fetched=fetched,
+        )
         if dfday is None or len(dfday) < min_candles_day:
             errors.append({"type": "CANDLE_DAY_MISSING", "item": it, "raw": cday})
             continue
-        indday = compute_indicators(dfday)
 
-        sig = score_signal(q, ind30)
+        ready.append((it, ex, tok, q, df30, dfday))
 
+    # 2) whole universe at once
+    inds30 = ind_states.indicators_many([(ex, tok, interval_30m) for _, ex, tok, _, _, _ in ready], [r[4] for r in ready])
+    indsday = ind_states.indicators_many([(ex, tok, interval_day) for _, ex, tok, _, _, _ in ready], [r[5] for r in ready])
+    sigs = score_signals_batch([r[3] for r in ready], inds30)
+
+    for (it, _ex, _tok, q, _df30, _dfday), ind30, indday, sig in zip(ready, inds30, indsday, sigs):
         out_items.append(
             {
                 **it,
@@ -353,17 +459,6 @@ def main(
             }
         )
 
-    return {
-        "ok": True,
-        "generated_at": now.strftime("%Y-%m-%d %H:%M:%S"),
-        "intervals": {"30m": interval_30m, "day": interval_day},
-        "lookbacks": {"30m_days": lookback_days_30m, "day_days": lookback_days_day},
-        "count": len(out_items),
-        "errors_count": len(errors),
-        "items": out_items,
-        "errors": errors,
-    }
-
 
 if __name__ == "__main__":
     res = main(
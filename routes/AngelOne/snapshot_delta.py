@@ -0,0 +1,184 @@
+# snapshot_delta.py
+"""
+Versioned signal snapshots: keyframes + per-symbol deltas.
+
+Producer side (DeltaEncoder) turns each fast-tick payload
+    {"ok", "generated_at", ..., "items": [ {exchange, token, quote_full, indicators, decision, ...} ]}
+into ONE of:
+
+    {"type":"keyframe","seq":N,"snapshot":{...full payload...}}
+    {"type":"delta","seq":N,"base":N-1,"meta":{changed top-level fields},
+     "upsert":{"NSE:2885":{changed item fields}}, "remove":["NSE:1594"],
+     "replace":{"NSE:11536":{whole item}}, "order":["NSE:2885", ...]}
+
+"replace" (an item lost fields) and "order" (the item list changed, in
+producer / stockList order) are only present when needed.
+
+Items are diffed per symbol and per top-level field (quote_full / indicators /
+decision ...), so a tick where only LTPs moved carries only quote_full of the
+symbols that moved. A keyframe is forced every `keyframe_every` ticks, on the
+first tick of a (new) leader and whenever the item set is rebuilt.
+
+Consumer side (SnapshotState) applies the same messages to rebuild the full
+snapshot in memory; a delta whose base != current seq marks the state stale
+(resync from keyframe + delta log).
+"""
+import re
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import orjson
+
+KEYFRAME = "keyframe"
+DELTA = "delta"
+ERROR = "error"
+
+_SEQ_RE = re.compile(rb'^\{"type":"(\w+)","seq":(\d+)')
+
+
+def item_key(it: Dict[str, Any]) -> str:
+    return f"{str(it.get('exchange', '')).upper()}:{str(it.get('token', '')).strip()}"
+
+
+def _dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+def peek(msg: str) -> Tuple[Optional[str], Optional[int]]:
+    """(type, seq) from the head of a message without parsing the body."""
+    m = _SEQ_RE.match(msg[:64].encode() if isinstance(msg, str) else msg[:64])
+    if not m:
+        return None, None
+    return m.group(1).decode(), int(m.group(2))
+
+
+class DeltaEncoder:
+    def __init__(self, keyframe_every: int = 20):
+        self.keyframe_every = max(1, keyframe_every)
+        self.seq: Optional[int] = None
+        self.since_keyframe = 0
+        self._meta: Dict[str, bytes] = {}
+        self._items: Dict[str, Dict[str, bytes]] = {}
+
+    def reset(self) -> None:
+        self.seq = None
+
+    def encode(self, payload: Dict[str, Any], seq: int) -> Tuple[str, str]:
+        items = payload.get("items") or []
+        meta = {k: v for k, v in payload.items() if k != "items"}
+
+        new_meta = {k: _dumps(v) for k, v in meta.items()}
+        new_items: Dict[str, Dict[str, bytes]] = {
+            item_key(it): {k: _dumps(v) for k, v in it.items()} for it in items
+        }
+
+        keyframe = self.seq is None or self.since_keyframe + 1 >= self.keyframe_every
+        if keyframe:
+            msg = {"type": KEYFRAME, "seq": seq, "snapshot": payload}
+            self.since_keyframe = 0
+        else:
+            meta_changes = {k: meta[k] for k, b in new_meta.items() if self._meta.get(k) != b}
+            upsert: Dict[str, Dict[str, Any]] = {}
+            replace: Dict[str, Dict[str, Any]] = {}
+            for it in items:
+                key = item_key(it)
+                prev = self._items.get(key)
+                cur = new_items[key]
+                if prev is None:
+                    upsert[key] = it
+                    continue
+                if any(f not in cur for f in prev):
+                    replace[key] = it  # a field was dropped: a merge would keep it
+                    continue
+                changed = {f: it[f] for f, b in cur.items() if prev.get(f) != b}
+                if changed:
+                    upsert[key] = changed
+            remove = [k for k in self._items if k not in new_items]
+            msg = {
+                "type": DELTA,
+                "seq": seq,
+                "base": self.seq,
+                "meta": meta_changes,
+                "upsert": upsert,
+                "remove": remove,
+            }
+            if replace:
+                msg["replace"] = replace
+            if list(new_items) != list(self._items):
+                msg["order"] = list(new_items)
+            self.since_keyframe += 1
+
+        self.seq = seq
+        self._meta = new_meta
+        self._items = new_items
+        # type + seq first: consumers peek() them without a full parse
+        return msg["type"], orjson.dumps(msg, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def error_message(seq: int, payload: Dict[str, Any]) -> str:
+    """Producer errors travel on the same channel; they never touch the state."""
+    return orjson.dumps({"type": ERROR, "seq": seq, "error": payload}, default=str).decode()
+
+
+class SnapshotState:
+    def __init__(self):
+        self.seq: Optional[int] = None
+        self.stale = True
+        self.meta: Dict[str, Any] = {}
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self._keyframe_cache: Optional[Tuple[int, str]] = None
+        self._full_cache: Optional[Tuple[int, str]] = None
+
+    def apply(self, msg: str) -> None:
+        kind, seq = peek(msg)
+        if kind == KEYFRAME:
+            snap = orjson.loads(msg)["snapshot"]
+            self.meta = {k: v for k, v in snap.items() if k != "items"}
+            self.items = {item_key(it): it for it in snap.get("items") or []}
+            self.seq, self.stale = seq, False
+        elif kind == DELTA:
+            if self.stale or self.seq is None:
+                return
+            d = orjson.loads(msg)
+            if d.get("base") != self.seq:
+                self.stale = True  # gap: missed a message -> resync
+                return
+            self.meta.update(d.get("meta") or {})
+            for key, fields in (d.get("upsert") or {}).items():
+                cur = self.items.get(key)
+                if cur is None:
+                    self.items[key] = fields
+                else:
+                    self.items[key] = {**cur, **fields}
+            for key, item in (d.get("replace") or {}).items():
+                self.items[key] = item
+            for key in d.get("remove") or []:
+                self.items.pop(key, None)
+            order = d.get("order")
+            if order is not None:
+                # new symbols in producer order, not appended at the end
+                self.items = {k: self.items[k] for k in order if k in self.items}
+            self.seq = seq
+
+    def replay(self, messages: Iterable[str]) -> None:
+        self.stale = True
+        for m in messages:
+            self.apply(m)
+
+    def full(self) -> Dict[str, Any]:
+        return {**self.meta, "items": list(self.items.values())}
+
+    def full_json(self) -> Optional[str]:
+        """Legacy full snapshot (serialized once per seq)."""
+        if self.seq is None:
+            return None
+        if not self._full_cache or self._full_cache[0] != self.seq:
+            self._full_cache = (self.seq, orjson.dumps(self.full(), default=str).decode())
+        return self._full_cache[1]
+
+    def keyframe_json(self) -> Optional[str]:
+        if self.seq is None:
+            return None
+        if not self._keyframe_cache or self._keyframe_cache[0] != self.seq:
+            msg = {"type": KEYFRAME, "seq": self.seq, "snapshot": self.full()}
+            self._keyframe_cache = (self.seq, orjson.dumps(msg, default=str).decode())
+        return self._keyframe_cache[1]
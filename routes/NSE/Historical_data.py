@@ -1,20 +1,55 @@
 # routes/NSE/Historical_data.py
 
 import logging
+import math
+import orjson
+import re
 from datetime import date, datetime, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from sqlalchemy import Float, cast
 from sqlalchemy.orm import Session
 from zoneinfo import ZoneInfo
 
 from db.connection import get_db
 from db.models import NseCmBhavcopy, NseCmIntraday1Min, NseCmSecurity
+from utils.Http.json_response import AppJSONResponse
+from utils.Market.candle_buckets import (
+    SESSION_MINUTES,
+    bucket_minutes,
+    bucket_params,
+    bucketed_ohlc_sql,
+    floor_to_bucket,
+)
+from utils.Market.candle_encoding import (
+    BINARY_MEDIA_TYPE,
+    FORMAT_BINARY,
+    FORMAT_COLUMNAR,
+    FORMATS,
+    Candle,
+    to_binary,
+    to_columnar,
+    to_json_rows,
+)
+from utils.Market.candle_rollups import (
+    ROLLUP_INTRADAY_READ_SQL,
+    ROLLUP_PERIOD_READ_SQL,
+    intraday_rollup_complete,
+    period_bucket_ts,
+    period_start,
+    pick_intraday_level,
+)
+from utils.Market.intraday_store import store as intraday_store
+from utils.Market.sparkline_store import KIND_CM
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/nse/historical", tags=["Historical Data"])
 
+_INTRADAY_BUCKETS_SQL = bucketed_ohlc_sql("nse_cm_intraday_1min", "token_id")
+
 
 def _ist_now_date() -> date:
     return datetime.now(ZoneInfo("Asia/Kolkata")).date()
@@ -66,83 +101,220 @@ def _resolve_token_id(db: Session, symbol: str) -> int:
     raise HTTPException(status_code=404, detail=f"Token not found for symbol: {sym}")
 
 
-def _bhav_row_to_candle(r: NseCmBhavcopy) -> Dict[str, Any]:
-    return {
-        "t": str(r.trade_date),
-        "o": float(r.open_price) if r.open_price is not None else None,
-        "h": float(r.high_price) if r.high_price is not None else None,
-        "l": float(r.low_price) if r.low_price is not None else None,
-        "c": float(r.close_price) if r.close_price is not None else None,
-        "v": int(r.total_traded_qty) if r.total_traded_qty is not None else None,
-            "source": "bhavcopy",
-    }
-
-
-def _intraday_row_to_candle(r: NseCmIntraday1Min) -> Dict[str, Any]:
-    return {
-        "t": r.interval_start.isoformat(),
-        "o": float(r.open_price) if r.open_price is not None else None,
-        "h": float(r.high_price) if r.high_price is not None else None,
-        "l": float(r.low_price) if r.low_price is not None else None,
-        "c": float(r.close_price) if r.close_price is not None else None,
-        "v": int(r.volume) if r.volume is not None else None,
-        "source": "intraday_1m",
-    }
-
-
-def _aggregate_intraday_to_daily(
-    rows: List[NseCmIntraday1Min], trade_date: date
-) -> Optional[Dict[str, Any]]:
+# Column projection (no ORM entities, no joined `security` load); prices come
+# back as float straight from the driver instead of Decimal.
+_INTRADAY_COLS = (
+    NseCmIntraday1Min.interval_start,
+    cast(NseCmIntraday1Min.open_price, Float),
+    cast(NseCmIntraday1Min.high_price, Float),
+    cast(NseCmIntraday1Min.low_price, Float),
+    cast(NseCmIntraday1Min.close_price, Float),
+    NseCmIntraday1Min.volume,
+)
+
+_BHAV_COLS = (
+    NseCmBhavcopy.trade_date,
+    cast(NseCmBhavcopy.open_price, Float),
+    cast(NseCmBhavcopy.high_price, Float),
+    cast(NseCmBhavcopy.low_price, Float),
+    cast(NseCmBhavcopy.close_price, Float),
+    NseCmBhavcopy.total_traded_qty,
+)
+
+
+def _f(x) -> Optional[float]:
+    return float(x) if x is not None else None
+
+
+def _i(x) -> Optional[int]:
+    return int(x) if x is not None else None
+
+
+def _bhav_row_to_candle(r) -> Candle:
+    t, o, h, l, c, v = r
+    return (t, o, h, l, c, v, "bhavcopy")
+
+
+def _intraday_row_to_candle(r) -> Candle:
+    t, o, h, l, c, v = r
+    return (t, o, h, l, c, v, "intraday_1m")
+
+
+def _bucket_row_to_candle(r: Dict[str, Any], bucket_min: int) -> Candle:
+    c = r["close_price"] if r["close_price"] is not None else r["last_price"]
+    return (
+        r["bucket_start"],
+        _f(r["open_price"]),
+        _f(r["high_price"]),
+        _f(r["low_price"]),
+        _f(c),
+        _i(r["volume"]),
+        f"intraday_{bucket_min}m",
+    )
+
+
+def _period_row_to_candle(r: Dict[str, Any], resolution: str) -> Candle:
+    return (
+        # period start date (IST), same "t" format as 1d candles
+        r["bucket_start"].astimezone(ZoneInfo("Asia/Kolkata")).date(),
+        _f(r["open_price"]),
+        _f(r["high_price"]),
+        _f(r["low_price"]),
+        _f(r["close_price"]),
+        _i(r["volume"]),
+        f"rollup_{resolution}",
+    )
+
+
+def _aggregate_intraday_to_daily(rows, trade_date: date) -> Optional[Candle]:
     """
-    Intraday rows -> 1 daily candle
+    Intraday rows (_INTRADAY_COLS) -> 1 daily candle
     Assumes rows are ordered by interval_start asc
     """
     if not rows:
         return None
 
-    o = rows[0].open_price
-    c = rows[-1].close_price
+    o = rows[0][1]
+    c = rows[-1][4]
 
-    highs = [r.high_price for r in rows if r.high_price is not None]
-    lows = [r.low_price for r in rows if r.low_price is not None]
+    highs = [r[2] for r in rows if r[2] is not None]
+    lows = [r[3] for r in rows if r[3] is not None]
     h = max(highs) if highs else None
     l = min(lows) if lows else None
 
-    vols = [r.volume for r in rows if r.volume is not None]
+    vols = [r[5] for r in rows if r[5] is not None]
     v = int(sum(vols)) if vols else None
 
-    return {
-        "t": str(trade_date),
-        "o": float(o) if o is not None else None,
-        "h": float(h) if h is not None else None,
-        "l": float(l) if l is not None else None,
-        "c": float(c) if c is not None else None,
-        "v": v,
-        "source": "intraday_agg_1d",
-    }
+    return (trade_date, o, h, l, c, v, "intraday_agg_1d")
+
+
+def _today_candle(db: Session, token_id: int, today: date) -> Optional[Candle]:
+    """Today's daily candle: worker memory when it holds today, else intraday rows from DB."""
+    agg = intraday_store.day_ohlcv(KIND_CM, token_id, today)
+    if agg is not None:
+        return (today, *agg, "intraday_agg_1d") if agg else None
+    return _aggregate_intraday_to_daily(_today_intraday_rows(db, token_id, today), today)
+
+
+def _today_intraday_rows(db: Session, token_id: int, today: date):
+    return (
+        db.query(*_INTRADAY_COLS)
+        .filter(
+            NseCmIntraday1Min.token_id == token_id,
+            NseCmIntraday1Min.trade_date == today,
+        )
+        .order_by(NseCmIntraday1Min.interval_start.asc())
+        .all()
+    )
+
+
+def _render(meta: Dict[str, Any], candles: List[Candle], fmt: str):
+    """
+    json     -> legacy {"...meta", "data": [{t,o,h,l,c,v,source}]}
+    columnar -> {"...meta", "format": "columnar", "data": {t:[epoch],o:[],...}}
+    binary   -> packed arrays (see utils/Market/candle_encoding.py), meta in X-Candle-Meta
+    """
+    meta = {**meta, "count": len(candles)}
+
+    if fmt == FORMAT_BINARY:
+        return Response(
+            content=to_binary(candles),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={"X-Candle-Meta": orjson.dumps(meta).decode()},
+        )
+
+    if fmt == FORMAT_COLUMNAR:
+        return AppJSONResponse({**meta, "format": FORMAT_COLUMNAR, "data": to_columnar(candles)})
+
+    return AppJSONResponse({**meta, "data": to_json_rows(candles)})
+
+
+_INTERVAL_RE = re.compile(r"^(\d+)\s*(m|min|mins|minute|minutes|h|hr|hour|hours)$")
+
+
+def _parse_interval(raw: str) -> Tuple[str, int]:
+    """
+    "1m" / "5m" / "15min" / "1h" / "2h" -> ("min", N)
+    "1d" -> ("1d", 1) ; "1w" -> ("1w", 1) ; "1M" / "1mo" -> ("1M", 1)
+
+    NOTE: "1M" (month) vs "1m" (minute) is case-sensitive.
+    """
+    s = (raw or "").strip()
+    if s == "1M":
+        return "1M", 1
+
+    s = s.lower()
+    if s in ("1mo", "1mon", "1month", "month", "monthly"):
+        return "1M", 1
+    if s in ("1w", "1wk", "1week", "week", "weekly"):
+        return "1w", 1
+    if s in ("1d", "1day", "day", "daily"):
+        return "1d", 1
+
+    m = _INTERVAL_RE.match(s)
+    if m:
+        n = int(m.group(1))
+        minutes = n * 60 if m.group(2).startswith("h") else n
+        if 1 <= minutes <= SESSION_MINUTES:
+            return "min", minutes
+
+    raise HTTPException(
+        status_code=400,
+        detail="Invalid interval. Use Nm (1m, 5m, 15m, ...), Nh (1h, 2h), 1d, 1w or 1M.",
+    )
+
+
+def _minutes_label(minutes: int) -> str:
+    return f"{minutes // 60}h" if minutes % 60 == 0 else f"{minutes}m"
+
 
+def _merge_into_period(out: List[Candle], today_candle: Candle, period_d: date) -> None:
+    """Fold today's intraday candle into the current week / month bar."""
+    _t, _o, th, tl, tc, tv, _src = today_candle
 
-@router.get("/candles", summary="Single candles API (auto chooses Bhavcopy vs Intraday)")
+    if out and out[-1][0] == period_d:
+        t, o, h, l, c, v, src = out[-1]
+        if th is not None:
+            h = th if h is None else max(h, th)
+        if tl is not None:
+            l = tl if l is None else min(l, tl)
+        if tc is not None:
+            c = tc
+        if tv is not None:
+            v = (v or 0) + tv
+        out[-1] = (t, o, h, l, c, v, src)
+        return
+
+    out.append((period_d, *today_candle[1:]))
+
+
+@router.get("/candles", summary="Single candles API (auto chooses Bhavcopy / Rollups / Intraday)")
 def get_candles(
     symbol: str = Query(..., min_length=1),
-    interval: str = Query("1d", description="1d or 1m"),
-    # for 1d: YYYY-MM-DD ; for 1m: ISO datetime
-    from_date: Optional[date] = Query(None, alias="from", description="YYYY-MM-DD (for 1d)"),
-    to_date: Optional[date] = Query(None, alias="to", description="YYYY-MM-DD (for 1d)"),
-    from_dt: Optional[datetime] = Query(None, alias="from_dt", description="ISO datetime (for 1m)"),
-    to_dt: Optional[datetime] = Query(None, alias="to_dt", description="ISO datetime (for 1m)"),
+    interval: str = Query("1d", description="1m, 5m, 15m, 30m, 1h, any Nm / Nh, 1d, 1w, 1M"),
+    # for 1d / 1w / 1M: YYYY-MM-DD ; for intraday: ISO datetime
+    from_date: Optional[date] = Query(None, alias="from", description="YYYY-MM-DD (for 1d / 1w / 1M)"),
+    to_date: Optional[date] = Query(None, alias="to", description="YYYY-MM-DD (for 1d / 1w / 1M)"),
+    from_dt: Optional[datetime] = Query(None, alias="from_dt", description="ISO datetime (for intraday)"),
+    to_dt: Optional[datetime] = Query(None, alias="to_dt", description="ISO datetime (for intraday)"),
     limit: int = Query(5000, ge=1, le=50000),
+    max_points: Optional[int] = Query(None, ge=10, le=50000, description="Intraday only: downsample to at most N OHLC buckets"),
+    format: str = Query("json", description="json | columnar (parallel arrays, epoch t) | binary (LE int64/float32)"),
     db: Session = Depends(get_db),
 ):
     sym = symbol.strip().upper()
-    interval = interval.strip().lower()
+    kind, minutes = _parse_interval(interval)
+
+    fmt = format.strip().lower()
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(FORMATS)}.")
 
     token_id = _resolve_token_id(db, sym)
 
     # -------------------------
-    # 1) INTRADAY 1m (IST aware)
+    # 1) INTRADAY Nm (IST aware)
     # -------------------------
-    if interval in ("1m", "1min", "1minute"):
+    if kind == "min":
         IST = ZoneInfo("Asia/Kolkata")
         now_ist = datetime.now(IST)
 
@@ -162,32 +334,92 @@ def get_candles(
         if from_dt > to_dt:
             raise HTTPException(status_code=400, detail="from_dt cannot be after to_dt")
 
-        rows = (
-            db.query(NseCmIntraday1Min)
-            .filter(
-                NseCmIntraday1Min.token_id == token_id,
-                NseCmIntraday1Min.interval_start >= from_dt,
-                NseCmIntraday1Min.interval_start <= to_dt,
+        # bucket width: requested interval, widened (in whole intervals) for max_points
+        bucket_min = minutes
+        auto_min = bucket_minutes(from_dt, to_dt, max_points)
+        if auto_min > bucket_min:
+            bucket_min = min(math.ceil(auto_min / minutes) * minutes, SESSION_MINUTES)
+
+        label = _minutes_label(minutes)
+        row_limit = min(max_points, limit) if max_points else limit
+
+        if bucket_min > 1:
+            # ✅ coarsest stored rollup that divides the bucket, else raw 1m in SQL
+            level = pick_intraday_level(bucket_min)
+            bucket_rows = []
+            if level:
+                from_ts = floor_to_bucket(from_dt, from_dt.astimezone(IST).date(), bucket_min)
+                bucket_rows = db.execute(
+                    ROLLUP_INTRADAY_READ_SQL,
+                    {
+                        "key": token_id,
+                        "res": level,
+                        "from_ts": from_ts,
+                        "to_ts": to_dt,
+                        "bucket_min": bucket_min,
+                        "limit": row_limit,
+                    },
+                ).mappings().all()
+                if not intraday_rollup_complete(db, bucket_rows, from_ts, to_dt):
+                    bucket_rows = []
+
+            # rollups missing / partly built for this range -> aggregate 1m rows
+            if not bucket_rows:
+                level = None
+                bucket_rows = db.execute(
+                    _INTRADAY_BUCKETS_SQL,
+                    bucket_params(token_id, from_dt, to_dt, bucket_min, row_limit),
+                ).mappings().all()
+
+            return _render(
+                {
+                    "symbol": sym,
+                    "interval": label,
+                    "resolution_min": bucket_min,
+                    "rollup": level,
+                    "token_id": token_id,
+                    "from_dt": from_dt.isoformat(),
+                    "to_dt": to_dt.isoformat(),
+                },
+                [_bucket_row_to_candle(r, bucket_min) for r in bucket_rows],
+                fmt,
             )
-            .order_by(NseCmIntraday1Min.interval_start.asc())
-            .limit(limit)
-            .all()
-        )
 
-        return {
-            "symbol": sym,
-            "interval": "1m",
-            "token_id": token_id,
-            "count": len(rows),
-            "from_dt": from_dt.isoformat(),
-            "to_dt": to_dt.isoformat(),
-            "data": [_intraday_row_to_candle(r) for r in rows],
-        }
+        # ✅ single session held in worker memory -> no DB round-trip
+        rows = None
+        session_d = from_dt.astimezone(IST).date()
+        if session_d == to_dt.astimezone(IST).date():
+            rows = intraday_store.rows_1m(KIND_CM, token_id, session_d, from_dt, to_dt, limit)
+
+        if rows is None:
+            rows = (
+                db.query(*_INTRADAY_COLS)
+                .filter(
+                    NseCmIntraday1Min.token_id == token_id,
+                    NseCmIntraday1Min.interval_start >= from_dt,
+                    NseCmIntraday1Min.interval_start <= to_dt,
+                )
+                .order_by(NseCmIntraday1Min.interval_start.asc())
+                .limit(limit)
+                .all()
+            )
+
+        return _render(
+            {
+                "symbol": sym,
+                "interval": "1m",
+                "token_id": token_id,
+                "from_dt": from_dt.isoformat(),
+                "to_dt": to_dt.isoformat(),
+            },
+            [_intraday_row_to_candle(r) for r in rows],
+            fmt,
+        )
 
     # -------------------------
     # 2) DAILY 1d (Bhavcopy + intraday for today's candle)
     # -------------------------
-    if interval in ("1d", "1day", "day"):
+    if kind == "1d":
         today = _ist_now_date()
 
         if not to_date:
@@ -201,11 +433,11 @@ def get_candles(
         # Fetch bhavcopy for [from_date..min(to_date, yesterday)]
         end_bhav = min(to_date, today - timedelta(days=1))
 
-        out: List[Dict[str, Any]] = []
+        out: List[Candle] = []
 
         if from_date <= end_bhav:
             bhav_rows = (
-                db.query(NseCmBhavcopy)
+                db.query(*_BHAV_COLS)
                 .filter(
                     NseCmBhavcopy.symbol == sym,
                     NseCmBhavcopy.trade_date >= from_date,
@@ -219,16 +451,7 @@ def get_candles(
 
         # If request includes today, build today's daily candle from intraday
         if to_date >= today:
-            intra_rows_today = (
-                db.query(NseCmIntraday1Min)
-                .filter(
-                    NseCmIntraday1Min.token_id == token_id,
-                    NseCmIntraday1Min.trade_date == today,
-                )
-                .order_by(NseCmIntraday1Min.interval_start.asc())
-                .all()
-            )
-            today_candle = _aggregate_intraday_to_daily(intra_rows_today, today)
+            today_candle = _today_candle(db, token_id, today)
             if today_candle:
                 out.append(today_candle)
 
@@ -238,14 +461,70 @@ def get_candles(
         if len(out) > limit:
             out = out[:limit]
 
-        return {
+        return _render(
+            {
+                "symbol": sym,
+                "interval": "1d",
+                "token_id": token_id,
+                "from": str(from_date),
+                "to": str(to_date),
+            },
+            out,
+            fmt,
+        )
+
+    # -------------------------
+    # 3) WEEKLY 1w / MONTHLY 1M (stored rollups + today's intraday)
+    # -------------------------
+    today = _ist_now_date()
+
+    if not to_date:
+        to_date = today
+    if not from_date:
+        from_date = to_date - timedelta(days=365 * 5)
+
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="from cannot be after to")
+
+    rows = db.execute(
+        ROLLUP_PERIOD_READ_SQL,
+        {
+            "key": token_id,
+            "res": kind,
+            "from_ts": period_bucket_ts(from_date, kind),
+            "to_ts": period_bucket_ts(to_date, kind),
+            "limit": limit,
+        },
+    ).mappings().all()
+
+    out: List[Candle] = [_period_row_to_candle(r, kind) for r in rows]
+
+    # bhavcopy for today lands after close -> fold live intraday into current bar
+    if to_date >= today:
+        has_bhav_today = (
+            db.query(NseCmBhavcopy.id)
+            .filter(NseCmBhavcopy.token_id == token_id, NseCmBhavcopy.trade_date == today)
+            .first()
+        )
+        if not has_bhav_today:
+            today_candle = _today_candle(db, token_id, today)
+            if today_candle:
+                _merge_into_period(out, today_candle, period_start(today, kind))
+
+    if not out:
+        raise HTTPException(status_code=404, detail="No candle data found for requested range.")
+
+    if len(out) > limit:
+        out = out[:limit]
+
+    return _render(
+        {
             "symbol": sym,
-            "interval": "1d",
+            "interval": kind,
             "token_id": token_id,
-            "count": len(out),
             "from": str(from_date),
             "to": str(to_date),
-            "data": out,
-        }
-
-    raise HTTPException(status_code=400, detail="Invalid interval. Use '1d' or '1m'.")
+        },
+        out,
+        fmt,
+    )
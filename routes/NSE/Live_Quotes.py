@@ -0,0 +1,229 @@
+# routes/NSE/Live_Quotes.py
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+
+from db.connection import async_query
+from utils.Market.quote_hub import (
+    MAX_SYMBOLS_PER_CLIENT,
+    QuoteClient,
+    hub,
+    normalize_symbols,
+    read_live_quotes,
+)
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/live", tags=["Live Quotes"])
+
+# Protocol (JSON text frames)
+#   client -> {"action": "subscribe",   "symbols": ["RELIANCE", "TCS"]}   (or "RELIANCE,TCS")
+#             {"action": "unsubscribe", "symbols": ["TCS"]}
+#             {"action": "ping"}
+#   server -> {"type": "subscribed", "symbols": [...], "rejected": [...]}
+#             {"type": "snapshot", "data": {"RELIANCE": {...}}}      (current state)
+#             {"type": "quotes", "data": [{...}, {...}]}             (latest per symbol)
+#             {"type": "unsubscribed", "symbols": [...]}
+#             {"type": "pong"} / {"type": "error", "detail": "..."}
+
+
+def _frame(payload) -> str:
+    return orjson.dumps(payload).decode()
+
+
+async def _subscribe(client: QuoteClient, symbols) -> None:
+    wanted = normalize_symbols(symbols)
+    added = hub.subscribe(client, wanted)
+    rejected = [s for s in wanted if s not in added and s not in client.symbols]
+    client.push(_frame({"type": "subscribed", "symbols": added, "rejected": rejected}))
+    if added:
+        client.push(_frame({"type": "snapshot", "data": await hub.snapshot(client, added)}))
+
+
+async def _reader(websocket: WebSocket, client: QuoteClient) -> None:
+    while True:
+        raw = await websocket.receive_text()
+        try:
+            msg = orjson.loads(raw)
+            action = str(msg.get("action", "")).lower()
+        except Exception:
+            client.push(_frame({"type": "error", "detail": "invalid JSON"}))
+            continue
+
+        symbols = msg.get("symbols") or []
+        if action in ("subscribe", "unsubscribe") and not isinstance(symbols, (str, list)):
+            client.push(_frame({"type": "error", "detail": "symbols must be a list or a comma separated string"}))
+            continue
+
+        if action == "subscribe":
+            await _subscribe(client, symbols)
+        elif action == "unsubscribe":
+            removed = hub.unsubscribe(client, normalize_symbols(symbols))
+            client.push(_frame({"type": "unsubscribed", "symbols": removed}))
+        elif action == "ping":
+            client.push(_frame({"type": "pong"}))
+        else:
+            client.push(_frame({"type": "error", "detail": f"unknown action '{action}'"}))
+
+
+@router.websocket("/ws")
+async def live_quotes_ws(
+    websocket: WebSocket,
+    symbols: str = Query("", description="Optional initial subscription: comma separated symbols"),
+):
+    await websocket.accept()
+
+    client = QuoteClient(websocket.send_text)
+    hub.register(client)
+    sender = asyncio.create_task(client.run_sender())
+    reader = asyncio.create_task(_reader(websocket, client))
+
+    try:
+        if symbols:
+            await _subscribe(client, symbols)
+
+        done, _ = await asyncio.wait({sender, reader}, return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            exc = t.exception()
+            if isinstance(exc, asyncio.TimeoutError):
+                # client cannot keep up even with coalescing -> drop it
+                hub.slow_disconnects += 1
+                logger.info(f"[WS] slow client dropped ({len(client.symbols)} symbols)")
+                try:
+                    await websocket.close(code=1013)
+                except Exception:
+                    pass
+            elif exc is not None and not isinstance(exc, WebSocketDisconnect):
+                logger.warning(f"[WS] connection error: {exc}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unregister(client)
+        for t in (sender, reader):
+            t.cancel()
+        await asyncio.gather(sender, reader, return_exceptions=True)
+
+
+# -----------------------------
+# REST: GET/POST /live/quotes
+# -----------------------------
+MAX_SYMBOLS_PER_REQUEST = int(os.getenv("LIVE_QUOTES_MAX_SYMBOLS", "2000"))
+
+
+class LiveQuotesRequest(BaseModel):
+    symbols: List[str] = Field(..., description="Symbols, e.g. ['RELIANCE', 'TCS']")
+    fields: Optional[List[str]] = Field(None, description="Only these hash fields (HMGET)")
+
+
+# Misses only: latest 1-min bar per symbol (EQ preferred), same shape as the
+# live:cm:symbol hash. LATERAL + LIMIT 1 walks ix_intraday_token_date_time backwards.
+_DB_LATEST_SQL = text("""
+    WITH wanted AS (
+        SELECT DISTINCT ON (s.symbol) s.symbol, s.token_id
+        FROM nse_cm_securities s
+        WHERE s.symbol = ANY(:symbols)
+          AND s.active_flag IS TRUE
+        ORDER BY s.symbol, (s.series = 'EQ') DESC NULLS LAST, s.token_id
+    )
+    SELECT
+      w.symbol,
+      w.token_id,
+      b.last_price::float8             AS ltp,
+      b.best_bid_price::float8         AS bid,
+      b.best_ask_price::float8         AS ask,
+      b.best_bid_qty                   AS bid_qty,
+      b.best_ask_qty                   AS ask_qty,
+      b.volume                         AS volume,
+      b.avg_price::float8              AS avg,
+      b.open_price::float8             AS o,
+      b.high_price::float8             AS h,
+      b.low_price::float8              AS l,
+      b.close_price::float8            AS c,
+      b.indicative_close_price::float8 AS indicative_close,
+      b.interval_start                 AS ts,
+      b.trade_date                     AS trade_date
+    FROM wanted w
+    CROSS JOIN LATERAL (
+        SELECT *
+        FROM nse_cm_intraday_1min b
+        WHERE b.token_id = w.token_id
+        ORDER BY b.trade_date DESC, b.interval_start DESC
+        LIMIT 1
+    ) b
+""")
+
+
+async def _db_latest_quotes(symbols: List[str], fields: Optional[List[str]]) -> Dict[str, Dict[str, Any]]:
+    rows = await async_query(_DB_LATEST_SQL, {"symbols": symbols})
+    out: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        q = dict(r)
+        q["ts"] = q["ts"].isoformat() if q["ts"] is not None else None
+        q["trade_date"] = str(q["trade_date"]) if q["trade_date"] is not None else None
+        q["seq"] = None
+        if fields:
+            q = {f: q.get(f) for f in fields}
+        out[r["symbol"]] = q
+    return out
+
+
+async def _live_quotes(symbols: List[str], fields: Optional[List[str]], fallback: bool) -> Dict[str, Any]:
+    wanted = normalize_symbols(symbols)
+    if not wanted:
+        raise HTTPException(status_code=400, detail="symbols is required")
+    if len(wanted) > MAX_SYMBOLS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"max {MAX_SYMBOLS_PER_REQUEST} symbols per request")
+    fields = [f.strip() for f in fields or [] if f and f.strip()] or None
+
+    try:
+        data = await read_live_quotes(wanted, fields)
+    except Exception as e:
+        # Redis down -> everything is a miss
+        logger.warning(f"[LIVE-QUOTES] redis read failed: {e}")
+        data = {}
+    from_redis = len(data)
+
+    missing = [s for s in wanted if s not in data]
+    if missing and fallback:
+        try:
+            data.update(await _db_latest_quotes(missing, fields))
+        except Exception as e:
+            logger.error(f"[LIVE-QUOTES] DB fallback failed: {e}", exc_info=True)
+        missing = [s for s in wanted if s not in data]
+
+    return {
+        "count": len(data),
+        "data": {s: data[s] for s in wanted if s in data},
+        "missing": missing,
+        "sources": {"redis": from_redis, "db": len(data) - from_redis},
+    }
+
+
+@router.get("/quotes")
+async def live_quotes(
+    symbols: str = Query(..., description="Comma separated symbols, e.g. RELIANCE,TCS"),
+    fields: Optional[str] = Query(None, description="Comma separated hash fields, e.g. ltp,ts"),
+    fallback: bool = Query(True, description="Read misses from the latest DB bar"),
+):
+    """Latest quotes from the live:cm:symbol hashes (one Redis round-trip)."""
+    return await _live_quotes(symbols.split(","), fields.split(",") if fields else None, fallback)
+
+
+@router.post("/quotes")
+async def live_quotes_bulk(
+    body: LiveQuotesRequest,
+    fallback: bool = Query(True, description="Read misses from the latest DB bar"),
+):
+    """Same as GET /live/quotes for watchlists too large for a query string."""
+    return await _live_quotes(body.symbols, body.fields, fallback)
+
+
+@router.get("/ws/metrics")
+async def live_quotes_ws_metrics():
+    """Per-worker fan-out / backpressure counters."""
+    return {**hub.metrics(), "max_symbols_per_client": MAX_SYMBOLS_PER_CLIENT}
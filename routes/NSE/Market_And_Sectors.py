@@ -1,15 +1,19 @@
 # routes/NSE/Market_And_Sectors.py
 
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session
 
 from db.connection import get_db
 from db.models import NseCmIndex1Min
+from utils.Market.candle_buckets import bucket_minutes, bucket_params, bucketed_ohlc_sql, last_of
+from utils.Market.response_cache import cached_json
+from utils.Market.intraday_store import safe_sample_points
+from utils.Market.sparkline_store import KIND_IND
 
 logger = logging.getLogger(__name__)
 
@@ -210,104 +214,205 @@ def _resolve_index_ids(codes: List[str]) -> List[int]:
     return uniq
 
 
-def _latest_row(db: Session, index_id: int):
-    return (
-        db.query(NseCmIndex1Min)
-        .filter(NseCmIndex1Min.index_id == index_id)
-        .order_by(NseCmIndex1Min.interval_start.desc())
-        .first()
-    )
+# -----------------------------
+# Set-based snapshot (all requested indexes in one query)
+# -----------------------------
+_SNAPSHOT_SQL = text("""
+SELECT
+  ids.index_id,
+  l.trade_date,
+  l.interval_start,
+  l.open_price,
+  l.high_price,
+  l.low_price,
+  l.close_price,
+  l.last_price,
+  l.percentage_change,
+  l.volume,
+  l.turnover,
+  p.prev_close
+FROM unnest(CAST(:index_ids AS integer[])) AS ids(index_id)
+
+-- ✅ latest bar (index seek on index_id, trade_date, interval_start)
+JOIN LATERAL (
+  SELECT
+    i.trade_date, i.interval_start,
+    i.open_price, i.high_price, i.low_price, i.close_price, i.last_price,
+    i.percentage_change, i.volume, i.turnover
+  FROM nse_cm_indices_1min i
+  WHERE i.index_id = ids.index_id
+  ORDER BY i.trade_date DESC, i.interval_start DESC
+  LIMIT 1
+) l ON TRUE
+
+-- ✅ prev close = previous trade_date last bar (index seek)
+LEFT JOIN LATERAL (
+  SELECT COALESCE(i.close_price, i.last_price) AS prev_close
+  FROM nse_cm_indices_1min i
+  WHERE i.index_id = ids.index_id
+    AND i.trade_date < l.trade_date
+  ORDER BY i.trade_date DESC, i.interval_start DESC
+  LIMIT 1
+) p ON TRUE
+""")
+
+
+# DB fallback sampler for indexes not covered by the sparkline buffer:
+# 10 points over [latest_ts - 1 day, latest_ts] per index, picked DB side.
+_SAMPLE_SQL = text("""
+WITH win AS (
+  SELECT w.index_id, w.start_ts
+  FROM unnest(
+    CAST(:index_ids AS integer[]),
+    CAST(:start_ts AS timestamptz[])
+  ) AS w(index_id, start_ts)
+),
+base AS (
+  SELECT
+    i.index_id,
+    i.interval_start,
+    i.last_price AS last,
+    row_number() OVER (PARTITION BY i.index_id ORDER BY i.interval_start) AS rn,
+    count(*)    OVER (PARTITION BY i.index_id) AS cnt
+  FROM win w
+  JOIN nse_cm_indices_1min i
+    ON i.index_id = w.index_id
+   AND i.trade_date >= CAST(timezone('Asia/Kolkata', w.start_ts) AS date)
+   AND i.interval_start >= w.start_ts
+),
+picks AS (
+  SELECT index_id, interval_start, last
+  FROM base
+  WHERE cnt <= 10
+     OR rn IN (
+       1,
+       (1 + (cnt-1) * 1 / 9),
+       (1 + (cnt-1) * 2 / 9),
+       (1 + (cnt-1) * 3 / 9),
+       (1 + (cnt-1) * 4 / 9),
+       (1 + (cnt-1) * 5 / 9),
+       (1 + (cnt-1) * 6 / 9),
+       (1 + (cnt-1) * 7 / 9),
+       (1 + (cnt-1) * 8 / 9),
+       cnt
+     )
+)
+SELECT index_id, interval_start, last
+FROM picks
+ORDER BY index_id, interval_start
+""")
 
 
-def _sample_1day_lastprice_10(db: Session, index_id: int) -> List[Dict[str, Any]]:
+def _f(x):
+    return float(x) if x is not None else None
+
+
+def _sample_1day_lastprice_10_batch(db: Session, latest_rows: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
     """
-    Returns 10 sampled points for last 1 day (ONLY last_price):
-      - first row
-      - last row
-      - 8 evenly spaced in between
-    Uses DB's latest timestamp to define 1-day window (avoids "now" mismatch).
+    {index_id: [{interval_start, last} x10]} for every latest row:
+      1) ingestion-maintained buffer (per trade_date), constant cost
+      2) ONE window-function query for whatever the buffer did not cover
     """
-    latest_ts = (
-        db.query(func.max(NseCmIndex1Min.interval_start))
-        .filter(NseCmIndex1Min.index_id == index_id)
-        .scalar()
-    )
-    if not latest_ts:
-        return []
+    out: Dict[int, List[Dict[str, Any]]] = {}
 
-    start_ts = latest_ts - timedelta(days=1)
+    by_date: Dict[Any, List[int]] = {}
+    for r in latest_rows:
+        by_date.setdefault(r["trade_date"], []).append(int(r["index_id"]))
 
-    rows = (
-        db.query(NseCmIndex1Min.interval_start, NseCmIndex1Min.last_price)
-        .filter(NseCmIndex1Min.index_id == index_id)
-        .filter(NseCmIndex1Min.interval_start >= start_ts)
-        .order_by(NseCmIndex1Min.interval_start.asc())
-        .all()
-    )
+    for td, ids in by_date.items():
+        out.update(safe_sample_points(KIND_IND, td, ids))
 
-    if not rows:
-        return []
+    missing = [r for r in latest_rows if int(r["index_id"]) not in out and r["interval_start"]]
+    if not missing:
+        return out
 
-    n = len(rows)
-    target = 10
+    rows = db.execute(
+        _SAMPLE_SQL,
+        {
+            "index_ids": [int(r["index_id"]) for r in missing],
+            "start_ts": [r["interval_start"] - timedelta(days=1) for r in missing],
+        },
+    ).mappings().all()
 
-    # if <= 10 rows, return all
-    if n <= target:
-        return [
+    for r in rows:
+        out.setdefault(int(r["index_id"]), []).append(
             {
-                "interval_start": r.interval_start.isoformat() if r.interval_start else None,
-                "last": float(r.last_price) if r.last_price is not None else None,
+                "interval_start": r["interval_start"].isoformat() if r["interval_start"] else None,
+                "last": _f(r["last"]),
             }
-            for r in rows
-        ]
+        )
+    return out
+
+
+def _compute_snapshots(db: Session, index_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Latest bar + prev close + 10-point sparkline for all index_ids.
+    Constant number of round-trips regardless of len(index_ids).
+    Indexes without data are skipped (logged).
+    """
+    if not index_ids:
+        return []
 
-    # pick 10 evenly spaced indices from 0..n-1
-    idxs = [int(i * (n - 1) / (target - 1)) for i in range(target)]
+    rows = db.execute(_SNAPSHOT_SQL, {"index_ids": index_ids}).mappings().all()
+    latest_by_id = {int(r["index_id"]): r for r in rows}
+
+    for idx in index_ids:
+        if idx not in latest_by_id:
+            logger.warning(f"Skipping index_id={idx}: No data for index_id={idx}")
 
-    out = []
-    for i in idxs:
-        r = rows[i]
-        out.append(
+    hist_map = _sample_1day_lastprice_10_batch(db, list(latest_by_id.values()))
+
+    snapshots: List[Dict[str, Any]] = []
+    for idx in index_ids:
+        row = latest_by_id.get(idx)
+        if row is None:
+            continue
+
+        snapshots.append(
             {
-                "interval_start": r.interval_start.isoformat() if r.interval_start else None,
-                "last": float(r.last_price) if r.last_price is not None else None,
+                "index_id": idx,
+                "name": _index_name(idx),
+                "symbol": _index_symbol(idx),
+                "interval_start": row["interval_start"].isoformat() if row["interval_start"] else None,
+                "trade_date": row["trade_date"].isoformat() if row["trade_date"] else None,
+                "open": _f(row["open_price"]),
+                "high": _f(row["high_price"]),
+                "low": _f(row["low_price"]),
+                "close": _f(row["close_price"]),
+                "last": _f(row["last_price"]),
+                "prev_close": _f(row["prev_close"]),
+                "pct_change": _f(row["percentage_change"]),
+                "volume": int(row["volume"]) if row["volume"] is not None else None,
+                "turnover": _f(row["turnover"]),
+                "historical": hist_map.get(idx, []),  # ✅ chart points
             }
         )
-    return out
+    return snapshots
 
 
-def _compute_snapshot(db: Session, index_id: int) -> Dict[str, Any]:
-    row = _latest_row(db, index_id)
-    if not row:
-        raise HTTPException(status_code=404, detail=f"No data for index_id={index_id}")
-
-    hist_1d_10 = _sample_1day_lastprice_10(db, index_id)
-
-    return {
-        "index_id": index_id,
-        "name": _index_name(index_id),
-        "symbol": _index_symbol(index_id),
-        "interval_start": row.interval_start.isoformat() if row.interval_start else None,
-        "trade_date": row.trade_date.isoformat() if row.trade_date else None,
-        "open": float(row.open_price) if row.open_price is not None else None,
-        "high": float(row.high_price) if row.high_price is not None else None,
-        "low": float(row.low_price) if row.low_price is not None else None,
-        "close": float(row.close_price) if row.close_price is not None else None,
-        "last": float(row.last_price) if row.last_price is not None else None,
-        "pct_change": float(row.percentage_change) if row.percentage_change is not None else None,
-        "volume": int(row.volume) if row.volume is not None else None,
-        "turnover": float(row.turnover) if row.turnover is not None else None,
-        "historical": hist_1d_10,  # ✅ chart points
-    }
+_HIST_BUCKETS_SQL = bucketed_ohlc_sql(
+    "nse_cm_indices_1min",
+    "index_id",
+    extra_aggs=(last_of("percentage_change"), "sum(turnover) AS turnover"),
+)
 
 
 # -----------------------------
 # Endpoints
 # -----------------------------
+def _market_and_sectors_payload(db: Session, index_ids: List[int]) -> Dict[str, Any]:
+    snapshots = _compute_snapshots(db, index_ids)
+    return {"count": len(snapshots), "indices": snapshots}
+
+
+DEFAULT_INDICES = "NIFTY50,NIFTY100,NIFTY500"
+
+
 @router.get("/")
 def market_and_sectors(
+    request: Request,
     indices: str = Query(
-        "NIFTY50,NIFTY100,NIFTY500",
+        DEFAULT_INDICES,
         description="Comma separated list of index codes (NIFTY50,...) OR numeric index_id",
     ),
     db: Session = Depends(get_db),
@@ -318,16 +423,12 @@ def market_and_sectors(
 
     index_ids = _resolve_index_ids(codes)
 
-    snapshots: List[Dict[str, Any]] = []
-    for idx in index_ids:
-        try:
-            snapshots.append(_compute_snapshot(db, idx))
-        except HTTPException as exc:
-            logger.warning(f"Skipping index_id={idx}: {exc.detail}")
-        except Exception:
-            logger.exception(f"Failed computing snapshot for index_id={idx}")
-
-    return {"count": len(snapshots), "indices": snapshots}
+    return cached_json(
+        "market-and-sectors",
+        {"indices": index_ids},
+        lambda: _market_and_sectors_payload(db, index_ids),
+        accept_encoding=request.headers.get("accept-encoding", ""),
+    )
 
 
 @router.get("/historical")
@@ -335,6 +436,8 @@ def market_and_sectors_historical(
     index: str = Query("NIFTY50", description="Single index code (e.g. NIFTY50) or numeric index_id"),
     days: int = Query(1, ge=1, le=90, description="Trading window in days (default 1)"),
     limit: int = Query(2000, ge=10, le=20000, description="Max rows to return"),
+    max_points: Optional[int] = Query(None, ge=10, le=20000, description="Downsample to at most N OHLC buckets"),
+    resolution: Optional[int] = Query(None, ge=1, le=375, description="Bucket size in minutes (overrides max_points)"),
     db: Session = Depends(get_db),
 ):
     index_id = _resolve_index_ids([index])[0]
@@ -350,6 +453,42 @@ def market_and_sectors_historical(
 
     start_ts = latest_ts - timedelta(days=days)
 
+    # ✅ downsampled path: OHLC buckets computed in SQL
+    bucket_min = bucket_minutes(start_ts, latest_ts, max_points, resolution)
+    if bucket_min > 1:
+        rows = db.execute(
+            _HIST_BUCKETS_SQL,
+            bucket_params(index_id, start_ts, latest_ts, bucket_min, max_points or limit),
+        ).mappings().all()
+
+        data = [
+            {
+                "interval_start": r["bucket_start"].isoformat() if r["bucket_start"] else None,
+                "trade_date": r["trade_date"].isoformat() if r["trade_date"] else None,
+                "open": _f(r["open_price"]),
+                "high": _f(r["high_price"]),
+                "low": _f(r["low_price"]),
+                "close": _f(r["close_price"]),
+                "last": _f(r["last_price"]),
+                "pct_change": _f(r["percentage_change"]),
+                "volume": int(r["volume"]) if r["volume"] is not None else None,
+                "turnover": _f(r["turnover"]),
+            }
+            for r in rows
+        ]
+
+        return {
+            "index_id": index_id,
+            "name": _index_name(index_id),
+            "symbol": _index_symbol(index_id),
+            "days": days,
+            "resolution_min": bucket_min,
+            "latest_interval_start": latest_ts.isoformat(),  # debug
+            "start_interval_start": start_ts.isoformat(),    # debug
+            "count": len(data),
+            "data": data,
+        }
+
     rows = (
         db.query(
             NseCmIndex1Min.interval_start,
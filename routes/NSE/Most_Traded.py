@@ -1,11 +1,12 @@
 # routes/NSE/Most_Traded.py
 
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy import func, select, text
 from sqlalchemy.orm import Session
 
 from db.connection import get_db
+from utils.Market.response_cache import cached_json
 from db.models import (
     NseIndexConstituent,
     NseIndexMaster,
@@ -263,8 +264,14 @@ def _compute_most_traded(db: Session, index_code: str = "ALL", limit: int = 50)
 # -----------------------------
 @router.get("/")
 def most_traded_companies(
+    request: Request,
     index: str = Query("ALL", description="Index filter: ALL / NIFTY50 / NIFTY100 / NIFTY500"),
     limit: int = Query(10, ge=1, le=500),
     db: Session = Depends(get_db),
 ):
-    return _compute_most_traded(db=db, index_code=index, limit=limit)
+    return cached_json(
+        "most-traded",
+        {"index": (index or "ALL").strip().upper(), "limit": limit},
+        lambda: _compute_most_traded(db=db, index_code=index, limit=limit),
+        accept_encoding=request.headers.get("accept-encoding", ""),
+    )
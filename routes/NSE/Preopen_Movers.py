@@ -262,9 +262,11 @@ WHERE df.dayfirst_price IS NOT NULL
 
 # -----------------------------
 # Endpoint (cache-first)
+#   sync def on purpose: every step is sync SQLAlchemy (incl. cache upsert),
+#   so FastAPI runs it in the threadpool instead of blocking the event loop
 # -----------------------------
 @router.get("/")
-async def preopen_movers(
+def preopen_movers(
     index: str = Query("NIFTY50", description="Index: NIFTY50 / NIFTY100 / NIFTY500"),
     limit: int = Query(3, ge=1, le=50, description="Top gainers/losers to return"),
     mode: str = Query("auto", description="auto | cached | live"),
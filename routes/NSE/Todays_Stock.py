@@ -1,14 +1,16 @@
 # routes/NSE/Todays_Stock.py
 
+import asyncio
 import logging
 from datetime import timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import func, select, literal, text
 from sqlalchemy.orm import Session
 
-from db.connection import get_db
+from db.connection import async_query
 from db.models import (
     NseIndexConstituent,
     NseIndexMaster,
@@ -16,6 +18,9 @@ from db.models import (
     NseCmSecurity,
     NseCmBhavcopy,
 )
+from utils.Market.response_cache import cached_json_async
+from utils.Market.intraday_store import safe_sample_points
+from utils.Market.sparkline_store import KIND_CM
 
 router = APIRouter(prefix="/today-stock", tags=["Today Stock"])
 logger = logging.getLogger(__name__)
@@ -27,215 +32,189 @@ INDEX_MAP = {
     # ALL -> all EQ
 }
 
+FILTERS = ("GAINERS", "LOSERS", "MOST_ACTIVE", "52W_HIGH", "52W_LOW")
+
+# Layout:
+#   statements (_*_stmt / _*_SQL)  -> shared by both executors
+#   pure assembly (_build_items / _payload)
+#   executors: _compute_todays_stock (sync Session) / _compute_todays_stock_async (asyncpg)
+
 
 # ===========================
-#  Token universe helpers
+#  Statements
 # ===========================
-def _get_index_row(db: Session, index_key: str) -> NseIndexMaster:
+def _normalize_index_key(index_key: str) -> str:
     key = (index_key or "").upper().strip()
-    if key not in INDEX_MAP:
+    if key != "ALL" and key not in INDEX_MAP:
         raise HTTPException(
             status_code=400,
             detail=f"Unsupported index '{index_key}'. Use NIFTY50 / NIFTY100 / NIFTY500 / ALL.",
         )
+    return key
 
-    index_symbol, short_code = INDEX_MAP[key]
-
-    row = (
-        db.query(NseIndexMaster)
-        .filter((NseIndexMaster.index_symbol == index_symbol) | (NseIndexMaster.short_code == short_code))
-        .one_or_none()
-    )
-
-    if row is None:
-        row = (
-            db.query(NseIndexMaster)
-            .filter(func.lower(NseIndexMaster.index_symbol) == index_symbol.lower())
-            .one_or_none()
-        )
-
-    if row is None:
-        row = (
-            db.query(NseIndexMaster)
-            .filter(func.lower(NseIndexMaster.short_code) == short_code.lower())
-            .one_or_none()
-        )
-
-    if row is None:
-        raise HTTPException(status_code=404, detail=f"Index not found in NseIndexMaster for {index_key}")
-
-    return row
 
+def _index_row_stmts(key: str):
+    """Lookup attempts in order (exact, then case-insensitive symbol, then short_code)."""
+    index_symbol, short_code = INDEX_MAP[key]
+    return [
+        select(NseIndexMaster).where(
+            (NseIndexMaster.index_symbol == index_symbol) | (NseIndexMaster.short_code == short_code)
+        ),
+        select(NseIndexMaster).where(func.lower(NseIndexMaster.index_symbol) == index_symbol.lower()),
+        select(NseIndexMaster).where(func.lower(NseIndexMaster.short_code) == short_code.lower()),
+    ]
 
-def _get_index_name_and_token_ids(db: Session, index_key: str) -> Tuple[str, List[int]]:
-    key = (index_key or "").upper().strip()
-
-    if key == "ALL":
-        token_ids = (
-            db.execute(
-                select(NseCmSecurity.token_id)
-                .where(NseCmSecurity.series == "EQ", NseCmSecurity.token_id.isnot(None))
-                .distinct()
-            )
-            .scalars()
-            .all()
-        )
-        return "ALL_EQ", [int(x) for x in token_ids if x is not None]
-
-    if key not in INDEX_MAP:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported index '{index_key}'. Use NIFTY50 / NIFTY100 / NIFTY500 / ALL.",
-        )
-
-    index_row = _get_index_row(db, key)
 
-    token_ids = (
-        db.execute(
+def _token_ids_stmt(index_id: Optional[int]):
+    if index_id is None:
+        # ALL -> every EQ token
+        return (
             select(NseCmSecurity.token_id)
-            .select_from(NseIndexConstituent)
-            .join(NseCmSecurity, NseCmSecurity.symbol == NseIndexConstituent.symbol)
-            .where(
-                NseIndexConstituent.index_id == index_row.id,
-                NseCmSecurity.series == "EQ",
-                NseCmSecurity.token_id.isnot(None),
-            )
+            .where(NseCmSecurity.series == "EQ", NseCmSecurity.token_id.isnot(None))
             .distinct()
         )
-        .scalars()
-        .all()
+    return (
+        select(NseCmSecurity.token_id)
+        .select_from(NseIndexConstituent)
+        .join(NseCmSecurity, NseCmSecurity.symbol == NseIndexConstituent.symbol)
+        .where(
+            NseIndexConstituent.index_id == index_id,
+            NseCmSecurity.series == "EQ",
+            NseCmSecurity.token_id.isnot(None),
+        )
+        .distinct()
     )
 
-    return index_row.index_symbol, [int(x) for x in token_ids if x is not None]
 
+def _latest_td_stmt(token_ids: List[int]):
+    # token-filtered max date (accurate)
+    return select(func.max(NseCmIntraday1Min.trade_date)).where(NseCmIntraday1Min.token_id.in_(token_ids))
 
-# ===========================
-#  Trade date helpers
-# ===========================
-def _get_latest_trade_date_for_tokens(db: Session, token_ids: List[int]):
-    if not token_ids:
-        raise HTTPException(status_code=404, detail="No tokens found for given index")
 
-    # token-filtered max date (accurate)
-    latest_td = db.execute(
-        select(func.max(NseCmIntraday1Min.trade_date)).where(NseCmIntraday1Min.token_id.in_(token_ids))
-    ).scalar()
+def _prev_td_stmt(token_ids: List[int], latest_trade_date):
+    return select(func.max(NseCmIntraday1Min.trade_date)).where(
+        NseCmIntraday1Min.token_id.in_(token_ids),
+        NseCmIntraday1Min.trade_date < latest_trade_date,
+    )
 
-    if latest_td is None:
-        raise HTTPException(status_code=404, detail="No intraday data found for given index tokens")
-    return latest_td
 
+# token_id -> latest row on that trade_date (DISTINCT ON)
+_LATEST_SQL = text("""
+    SELECT DISTINCT ON (token_id)
+      token_id,
+      interval_start,
+      last_price,
+      close_price,
+      total_traded_qty,
+      volume
+    FROM nse_cm_intraday_1min
+    WHERE trade_date = :td
+      AND token_id = ANY(:token_ids)
+    ORDER BY token_id, interval_start DESC
+""")
+
+# token_id -> prev_close (coalesce close_price,last_price) from prev day last candle
+_PREV_CLOSE_SQL = text("""
+    SELECT DISTINCT ON (token_id)
+      token_id,
+      COALESCE(close_price, last_price) AS prev_close
+    FROM nse_cm_intraday_1min
+    WHERE trade_date = :td
+      AND token_id = ANY(:token_ids)
+    ORDER BY token_id, interval_start DESC
+""")
+
+# DB-side 10-point sampling: no full-day pull to python
+_SAMPLE_SQL = text("""
+    WITH base AS (
+      SELECT
+        token_id,
+        interval_start,
+        COALESCE(last_price, close_price) AS last,
+        row_number() OVER (PARTITION BY token_id ORDER BY interval_start) AS rn,
+        count(*)    OVER (PARTITION BY token_id) AS cnt
+      FROM nse_cm_intraday_1min
+      WHERE trade_date = :td
+        AND token_id = ANY(:token_ids)
+    ),
+    picks AS (
+      SELECT token_id, interval_start, last
+      FROM base
+      WHERE cnt <= 10
+         OR rn IN (
+           1,
+           (1 + (cnt-1) * 1 / 9),
+           (1 + (cnt-1) * 2 / 9),
+           (1 + (cnt-1) * 3 / 9),
+           (1 + (cnt-1) * 4 / 9),
+           (1 + (cnt-1) * 5 / 9),
+           (1 + (cnt-1) * 6 / 9),
+           (1 + (cnt-1) * 7 / 9),
+           (1 + (cnt-1) * 8 / 9),
+           cnt
+         )
+    )
+    SELECT token_id, interval_start, last
+    FROM picks
+    ORDER BY token_id, interval_start;
+""")
 
-def _get_prev_trade_date_for_tokens(db: Session, token_ids: List[int], latest_trade_date):
-    if not token_ids or latest_trade_date is None:
-        return None
 
-    return db.execute(
-        select(func.max(NseCmIntraday1Min.trade_date)).where(
-            NseCmIntraday1Min.token_id.in_(token_ids),
-            NseCmIntraday1Min.trade_date < latest_trade_date,
-        )
-    ).scalar()
+def _security_meta_stmt(token_ids: List[int]):
+    return select(
+        NseCmSecurity.token_id,
+        NseCmSecurity.symbol,
+        NseCmSecurity.series,
+        NseCmSecurity.company_name,
+    ).where(NseCmSecurity.token_id.in_(token_ids), NseCmSecurity.series == "EQ")
 
 
-# ===========================
-#  Fast intraday lookup (DISTINCT ON)
-# ===========================
-def _latest_intraday_map(db: Session, token_ids: List[int], trade_date):
-    """
-    token_id -> latest row on that trade_date
-    """
-    if not token_ids or trade_date is None:
-        return {}
+def _cutoffs(latest_trade_date):
+    return latest_trade_date - timedelta(days=365), latest_trade_date
+
 
-    sql = text("""
-        SELECT DISTINCT ON (token_id)
-          token_id,
-          interval_start,
-          last_price,
-          close_price,
-          total_traded_qty,
-          volume
-        FROM nse_cm_intraday_1min
-        WHERE trade_date = :td
-          AND token_id = ANY(:token_ids)
-        ORDER BY token_id, interval_start DESC
-    """)
-
-    rows = db.execute(sql, {"td": trade_date, "token_ids": token_ids}).mappings().all()
-    return {int(r["token_id"]): r for r in rows}
-
-
-def _prev_close_map(db: Session, token_ids: List[int], trade_date):
+def _extreme_52w_stmt(token_ids: List[int], cutoff_start, cutoff_end, high: bool):
     """
-    token_id -> prev_close (coalesce close_price,last_price) from prev day last candle
+    52w high / low from bhavcopy (grouped).
+    Note: join symbol+series; bhavcopy series can be null => treat as EQ via coalesce
     """
-    if not token_ids or trade_date is None:
-        return {}
-
-    sql = text("""
-        SELECT DISTINCT ON (token_id)
-          token_id,
-          COALESCE(close_price, last_price) AS prev_close
-        FROM nse_cm_intraday_1min
-        WHERE trade_date = :td
-          AND token_id = ANY(:token_ids)
-        ORDER BY token_id, interval_start DESC
-    """)
+    bhav_series = func.coalesce(NseCmBhavcopy.series, literal("EQ"))
+    price = NseCmBhavcopy.high_price if high else NseCmBhavcopy.low_price
+    agg = func.max(price) if high else func.min(price)
 
-    rows = db.execute(sql, {"td": trade_date, "token_ids": token_ids}).mappings().all()
-    return {int(r["token_id"]): r["prev_close"] for r in rows}
+    return (
+        select(
+            NseCmSecurity.token_id.label("token_id"),
+            agg.label("value"),
+        )
+        .select_from(NseCmBhavcopy)
+        .join(
+            NseCmSecurity,
+            (NseCmSecurity.symbol == NseCmBhavcopy.symbol) & (NseCmSecurity.series == bhav_series),
+        )
+        .where(
+            NseCmBhavcopy.trade_date >= cutoff_start,
+            NseCmBhavcopy.trade_date <= cutoff_end,
+            NseCmSecurity.token_id.in_(token_ids),
+            NseCmSecurity.series == "EQ",
+            price.isnot(None),
+        )
+        .group_by(NseCmSecurity.token_id)
+    )
 
 
 # ===========================
-#  DB-side 10-point sampling (fast)
+#  Row -> map helpers (pure)
 # ===========================
-def _sample_1day_lastprice_10_batch_fast(
-    db: Session, token_ids: List[int], trade_date
-) -> Dict[int, List[Dict[str, Any]]]:
-    """
-    Returns {token_id: [{interval_start,last} x10]}
-    DB side sampling: no full-day pull to python.
-    """
-    if not token_ids or trade_date is None:
-        return {}
+def _by_token(rows) -> Dict[int, Any]:
+    return {int(r["token_id"]): r for r in rows if r.get("token_id") is not None}
 
-    sql = text("""
-        WITH base AS (
-          SELECT
-            token_id,
-            interval_start,
-            COALESCE(last_price, close_price) AS last,
-            row_number() OVER (PARTITION BY token_id ORDER BY interval_start) AS rn,
-            count(*)    OVER (PARTITION BY token_id) AS cnt
-          FROM nse_cm_intraday_1min
-          WHERE trade_date = :td
-            AND token_id = ANY(:token_ids)
-        ),
-        picks AS (
-          SELECT token_id, interval_start, last
-          FROM base
-          WHERE cnt <= 10
-             OR rn IN (
-               1,
-               (1 + (cnt-1) * 1 / 9),
-               (1 + (cnt-1) * 2 / 9),
-               (1 + (cnt-1) * 3 / 9),
-               (1 + (cnt-1) * 4 / 9),
-               (1 + (cnt-1) * 5 / 9),
-               (1 + (cnt-1) * 6 / 9),
-               (1 + (cnt-1) * 7 / 9),
-               (1 + (cnt-1) * 8 / 9),
-               cnt
-             )
-        )
-        SELECT token_id, interval_start, last
-        FROM picks
-        ORDER BY token_id, interval_start;
-    """)
 
-    rows = db.execute(sql, {"td": trade_date, "token_ids": token_ids}).mappings().all()
+def _value_by_token(rows, col: str) -> Dict[int, Any]:
+    return {int(r["token_id"]): r[col] for r in rows if r.get("token_id") is not None}
+
 
+def _samples_by_token(rows) -> Dict[int, List[Dict[str, Any]]]:
     out: Dict[int, List[Dict[str, Any]]] = {}
     for r in rows:
         tid = int(r["token_id"])
@@ -248,85 +227,20 @@ def _sample_1day_lastprice_10_batch_fast(
     return out
 
 
-def _attach_samples(db: Session, rows: List[Dict[str, Any]], latest_trade_date):
-    token_ids = [int(r["token_id"]) for r in rows if r.get("token_id") is not None]
-    if not token_ids:
-        return {}
-
-    # Safety: very large limits => skip samples (optional but recommended)
-    # if len(token_ids) > 80:
-    #     return {}
-
-    return _sample_1day_lastprice_10_batch_fast(db, token_ids, latest_trade_date)
-
-
 # ===========================
-#  Serialization
+#  Assembly (pure)
 # ===========================
-def _serialize_rows(rows: List[Dict[str, Any]], sample_map: Optional[Dict[int, List[Dict[str, Any]]]] = None):
-    sample_map = sample_map or {}
-    return [
-        {
-            "token_id": r["token_id"],
-            "symbol": r["symbol"],
-            "series": r["series"],
-            "company_name": r["company_name"],
-            "last_price": float(r["last_price"]) if r.get("last_price") is not None else None,
-            "prev_close": float(r["prev_close"]) if r.get("prev_close") is not None else None,
-            "change_pct": float(r["change_pct"]) if r.get("change_pct") is not None else None,
-            "close_price": float(r["close_price"]) if r.get("close_price") is not None else None,
-            "total_traded_qty": int(r["total_traded_qty"]) if r.get("total_traded_qty") is not None else None,
-            "volume": int(r["volume"]) if r.get("volume") is not None else None,
-            "activity_metric": int(r["activity_metric"]) if r.get("activity_metric") is not None else None,
-            "high_52": float(r["high_52"]) if r.get("high_52") is not None else None,
-            "low_52": float(r["low_52"]) if r.get("low_52") is not None else None,
-            "near_high_pct": float(r["near_high_pct"]) if r.get("near_high_pct") is not None else None,
-            "above_low_pct": float(r["above_low_pct"]) if r.get("above_low_pct") is not None else None,
-            "interval_start": r["interval_start"].isoformat() if r.get("interval_start") else None,
-            "sample_1d_last": sample_map.get(int(r["token_id"]), []),
-        }
-        for r in rows
-    ]
-
-
-# ===========================
-#  Common securities fetch
-# ===========================
-def _security_meta_map(db: Session, token_ids: List[int]) -> Dict[int, Dict[str, Any]]:
-    if not token_ids:
-        return {}
-    rows = (
-        db.execute(
-            select(
-                NseCmSecurity.token_id,
-                NseCmSecurity.symbol,
-                NseCmSecurity.series,
-                NseCmSecurity.company_name,
-            ).where(NseCmSecurity.token_id.in_(token_ids), NseCmSecurity.series == "EQ")
-        )
-        .mappings()
-        .all()
-    )
-    return {int(r["token_id"]): r for r in rows if r.get("token_id") is not None}
-
-
-# ===========================
-#  Filter implementations (FAST)
-# ===========================
-def _fetch_gainers(db: Session, index_key: str, limit: int):
-    index_name, token_ids = _get_index_name_and_token_ids(db, index_key)
-
-    latest_trade_date = _get_latest_trade_date_for_tokens(db, token_ids)
-    prev_trade_date = _get_prev_trade_date_for_tokens(db, token_ids, latest_trade_date)
-
-    latest_map = _latest_intraday_map(db, token_ids, latest_trade_date)
-    if not latest_map:
-        raise HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
-
-    prev_map = _prev_close_map(db, token_ids, prev_trade_date) if prev_trade_date else {}
-
-    sec_map = _security_meta_map(db, list(latest_map.keys()))
-
+def _build_items(
+    f: str,
+    latest_map: Dict[int, Any],
+    prev_map: Dict[int, Any],
+    sec_map: Dict[int, Any],
+    ext_map: Dict[int, Any],
+) -> List[Dict[str, Any]]:
+    """
+    Filtered + sorted rows for filter `f` (caller applies limit).
+    ext_map: token_id -> 52w high (52W_HIGH) / 52w low (52W_LOW), else {}.
+    """
     items: List[Dict[str, Any]] = []
     for tid, t in latest_map.items():
         s = sec_map.get(tid)
@@ -336,6 +250,15 @@ def _fetch_gainers(db: Session, index_key: str, limit: int):
         last_raw = t.get("last_price")
         last_price = float(last_raw) if last_raw is not None else None
 
+        ext_52 = None
+        if f in ("52W_HIGH", "52W_LOW"):
+            ext_raw = ext_map.get(tid)
+            if ext_raw is None or last_price in (None, 0):
+                continue
+            ext_52 = float(ext_raw)
+            if ext_52 == 0:
+                continue
+
         prev_raw = prev_map.get(tid)
         prev_close = float(prev_raw) if prev_raw is not None else None
 
@@ -343,72 +266,15 @@ def _fetch_gainers(db: Session, index_key: str, limit: int):
         if last_price is not None and prev_close not in (None, 0):
             change_pct = (last_price - prev_close) * 100.0 / prev_close
 
-        items.append(
-            {
-                "token_id": tid,
-                "symbol": s["symbol"],
-                "series": s["series"],
-                "company_name": s["company_name"],
-                "last_price": last_price,
-                "prev_close": prev_close,
-                "change_pct": change_pct,
-                "close_price": None,
-                "total_traded_qty": t.get("total_traded_qty"),
-                "volume": t.get("volume"),
-                "activity_metric": None,
-                "high_52": None,
-                "low_52": None,
-                "near_high_pct": None,
-                "above_low_pct": None,
-                "interval_start": t.get("interval_start"),
-            }
-        )
-
-    # filter + sort
-    items = [x for x in items if x.get("change_pct") is not None and x["change_pct"] > 0]
-    items.sort(key=lambda x: x["change_pct"], reverse=True)
-
-    items = items[:limit]
-    sample_map = _attach_samples(db, items, latest_trade_date)
-
-    return {
-        "filter": "GAINERS",
-        "index": index_name,
-        "latest_trade_date": latest_trade_date.isoformat() if latest_trade_date else None,
-        "prev_trade_date": prev_trade_date.isoformat() if prev_trade_date else None,
-        "count": len(items),
-        "data": _serialize_rows(items, sample_map),
-    }
-
-
-def _fetch_losers(db: Session, index_key: str, limit: int):
-    index_name, token_ids = _get_index_name_and_token_ids(db, index_key)
-
-    latest_trade_date = _get_latest_trade_date_for_tokens(db, token_ids)
-    prev_trade_date = _get_prev_trade_date_for_tokens(db, token_ids, latest_trade_date)
-
-    latest_map = _latest_intraday_map(db, token_ids, latest_trade_date)
-    if not latest_map:
-        raise HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
-
-    prev_map = _prev_close_map(db, token_ids, prev_trade_date) if prev_trade_date else {}
-    sec_map = _security_meta_map(db, list(latest_map.keys()))
-
-    items: List[Dict[str, Any]] = []
-    for tid, t in latest_map.items():
-        s = sec_map.get(tid)
-        if not s:
-            continue
-
-        last_raw = t.get("last_price")
-        last_price = float(last_raw) if last_raw is not None else None
+        close_price = None
+        if f in ("MOST_ACTIVE", "52W_HIGH", "52W_LOW"):
+            close_price = float(t["close_price"]) if t.get("close_price") is not None else None
 
-        prev_raw = prev_map.get(tid)
-        prev_close = float(prev_raw) if prev_raw is not None else None
-
-        change_pct = None
-        if last_price is not None and prev_close not in (None, 0):
-            change_pct = (last_price - prev_close) * 100.0 / prev_close
+        qty_cols = f in ("GAINERS", "LOSERS", "MOST_ACTIVE")
+        activity_metric = None
+        if f == "MOST_ACTIVE":
+            activity_raw = t.get("total_traded_qty")  # ONLY total_traded_qty
+            activity_metric = int(activity_raw) if activity_raw is not None else None
 
         items.append(
             {
@@ -419,328 +285,267 @@ def _fetch_losers(db: Session, index_key: str, limit: int):
                 "last_price": last_price,
                 "prev_close": prev_close,
                 "change_pct": change_pct,
-                "close_price": None,
-                "total_traded_qty": t.get("total_traded_qty"),
-                "volume": t.get("volume"),
-                "activity_metric": None,
-                "high_52": None,
-                "low_52": None,
-                "near_high_pct": None,
-                "above_low_pct": None,
+                "close_price": close_price,
+                "total_traded_qty": t.get("total_traded_qty") if qty_cols else None,
+                "volume": t.get("volume") if qty_cols else None,
+                "activity_metric": activity_metric,
+                "high_52": ext_52 if f == "52W_HIGH" else None,
+                "low_52": ext_52 if f == "52W_LOW" else None,
+                "near_high_pct": (ext_52 - last_price) * 100.0 / ext_52 if f == "52W_HIGH" else None,
+                "above_low_pct": (last_price - ext_52) * 100.0 / ext_52 if f == "52W_LOW" else None,
                 "interval_start": t.get("interval_start"),
             }
         )
 
-    items = [x for x in items if x.get("change_pct") is not None and x["change_pct"] < 0]
-    items.sort(key=lambda x: x["change_pct"])  # ascending => most negative first
+    if f == "GAINERS":
+        items = [x for x in items if x.get("change_pct") is not None and x["change_pct"] > 0]
+        items.sort(key=lambda x: x["change_pct"], reverse=True)
+    elif f == "LOSERS":
+        items = [x for x in items if x.get("change_pct") is not None and x["change_pct"] < 0]
+        items.sort(key=lambda x: x["change_pct"])  # ascending => most negative first
+    elif f == "MOST_ACTIVE":
+        items = [x for x in items if x.get("activity_metric") is not None and x["activity_metric"] > 0]
+        items.sort(key=lambda x: x["activity_metric"], reverse=True)
+    elif f == "52W_HIGH":
+        # nearer to high => smaller near_high_pct
+        items.sort(key=lambda x: (x["near_high_pct"] if x.get("near_high_pct") is not None else 1e18))
+    elif f == "52W_LOW":
+        # closer above low => smaller above_low_pct
+        items.sort(key=lambda x: (x["above_low_pct"] if x.get("above_low_pct") is not None else 1e18))
+
+    return items
 
-    items = items[:limit]
-    sample_map = _attach_samples(db, items, latest_trade_date)
 
-    return {
-        "filter": "LOSERS",
+def _serialize_rows(rows: List[Dict[str, Any]], sample_map: Optional[Dict[int, List[Dict[str, Any]]]] = None):
+    sample_map = sample_map or {}
+    return [
+        {
+            "token_id": r["token_id"],
+            "symbol": r["symbol"],
+            "series": r["series"],
+            "company_name": r["company_name"],
+            "last_price": float(r["last_price"]) if r.get("last_price") is not None else None,
+            "prev_close": float(r["prev_close"]) if r.get("prev_close") is not None else None,
+            "change_pct": float(r["change_pct"]) if r.get("change_pct") is not None else None,
+            "close_price": float(r["close_price"]) if r.get("close_price") is not None else None,
+            "total_traded_qty": int(r["total_traded_qty"]) if r.get("total_traded_qty") is not None else None,
+            "volume": int(r["volume"]) if r.get("volume") is not None else None,
+            "activity_metric": int(r["activity_metric"]) if r.get("activity_metric") is not None else None,
+            "high_52": float(r["high_52"]) if r.get("high_52") is not None else None,
+            "low_52": float(r["low_52"]) if r.get("low_52") is not None else None,
+            "near_high_pct": float(r["near_high_pct"]) if r.get("near_high_pct") is not None else None,
+            "above_low_pct": float(r["above_low_pct"]) if r.get("above_low_pct") is not None else None,
+            "interval_start": r["interval_start"].isoformat() if r.get("interval_start") else None,
+            "sample_1d_last": sample_map.get(int(r["token_id"]), []),
+        }
+        for r in rows
+    ]
+
+
+def _payload(f, index_name, latest_trade_date, prev_trade_date, items, sample_map) -> Dict[str, Any]:
+    out = {
+        "filter": f,
         "index": index_name,
         "latest_trade_date": latest_trade_date.isoformat() if latest_trade_date else None,
         "prev_trade_date": prev_trade_date.isoformat() if prev_trade_date else None,
-        "count": len(items),
-        "data": _serialize_rows(items, sample_map),
     }
+    if f in ("52W_HIGH", "52W_LOW"):
+        cutoff_start, cutoff_end = _cutoffs(latest_trade_date)
+        out["cutoff_start"] = cutoff_start.isoformat()
+        out["cutoff_end"] = cutoff_end.isoformat()
+    out["count"] = len(items)
+    out["data"] = _serialize_rows(items, sample_map)
+    return out
 
 
-def _fetch_most_active(db: Session, index_key: str, limit: int):
-    index_name, token_ids = _get_index_name_and_token_ids(db, index_key)
+def _normalize_filter(filter_type: str) -> str:
+    f = (filter_type or "").upper().strip()
+    if f not in FILTERS:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid filter_type. Use: GAINERS / LOSERS / MOST_ACTIVE / 52W_HIGH / 52W_LOW",
+        )
+    return f
 
-    latest_trade_date = _get_latest_trade_date_for_tokens(db, token_ids)
-    prev_trade_date = _get_prev_trade_date_for_tokens(db, token_ids, latest_trade_date)
 
-    latest_map = _latest_intraday_map(db, token_ids, latest_trade_date)
-    if not latest_map:
-        raise HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
+def _no_tokens():
+    return HTTPException(status_code=404, detail="No tokens found for given index")
 
-    prev_map = _prev_close_map(db, token_ids, prev_trade_date) if prev_trade_date else {}
-    sec_map = _security_meta_map(db, list(latest_map.keys()))
 
-    items: List[Dict[str, Any]] = []
-    for tid, t in latest_map.items():
-        s = sec_map.get(tid)
-        if not s:
-            continue
+def _no_intraday():
+    return HTTPException(status_code=404, detail="No intraday data found for given index tokens")
 
-        last_raw = t.get("last_price")
-        last_price = float(last_raw) if last_raw is not None else None
 
-        prev_raw = prev_map.get(tid)
-        prev_close = float(prev_raw) if prev_raw is not None else None
+def _no_latest_rows():
+    return HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
 
-        change_pct = None
-        if last_price is not None and prev_close not in (None, 0):
-            change_pct = (last_price - prev_close) * 100.0 / prev_close
 
-        activity_metric = t.get("total_traded_qty")  # ONLY total_traded_qty
-
-        items.append(
-            {
-                "token_id": tid,
-                "symbol": s["symbol"],
-                "series": s["series"],
-                "company_name": s["company_name"],
-                "last_price": last_price,
-                "prev_close": prev_close,
-                "change_pct": change_pct,
-                "close_price": (float(t["close_price"]) if t.get("close_price") is not None else None),
-                "total_traded_qty": t.get("total_traded_qty"),
-                "volume": t.get("volume"),
-                "activity_metric": int(activity_metric) if activity_metric is not None else None,
-                "high_52": None,
-                "low_52": None,
-                "near_high_pct": None,
-                "above_low_pct": None,
-                "interval_start": t.get("interval_start"),
-            }
-        )
-
-    items = [x for x in items if x.get("activity_metric") is not None and x["activity_metric"] > 0]
-    items.sort(key=lambda x: x["activity_metric"], reverse=True)
-
-    items = items[:limit]
-    sample_map = _attach_samples(db, items, latest_trade_date)
-
-    return {
-        "filter": "MOST_ACTIVE",
-        "index": index_name,
-        "latest_trade_date": latest_trade_date.isoformat() if latest_trade_date else None,
-        "prev_trade_date": prev_trade_date.isoformat() if prev_trade_date else None,
-        "count": len(items),
-        "data": _serialize_rows(items, sample_map),
-    }
+def _index_not_found(index_key: str):
+    return HTTPException(status_code=404, detail=f"Index not found in NseIndexMaster for {index_key}")
 
 
 # ===========================
-#  52W High/Low (bhavcopy)
+#  Sync executor (ingestion / scripts / threadpool)
 # ===========================
-def _fetch_52w_high(db: Session, index_key: str, limit: int):
-    index_name, token_ids = _get_index_name_and_token_ids(db, index_key)
+def _get_index_name_and_token_ids(db: Session, index_key: str) -> Tuple[str, List[int]]:
+    key = _normalize_index_key(index_key)
 
-    latest_trade_date = _get_latest_trade_date_for_tokens(db, token_ids)
-    prev_trade_date = _get_prev_trade_date_for_tokens(db, token_ids, latest_trade_date)
+    if key == "ALL":
+        token_ids = db.execute(_token_ids_stmt(None)).scalars().all()
+        return "ALL_EQ", [int(x) for x in token_ids if x is not None]
 
-    cutoff_end = latest_trade_date
-    cutoff_start = cutoff_end - timedelta(days=365)
+    index_row = None
+    for stmt in _index_row_stmts(key):
+        index_row = db.execute(stmt).scalars().one_or_none()
+        if index_row is not None:
+            break
+    if index_row is None:
+        raise _index_not_found(index_key)
 
-    # latest last for tokens
-    latest_map = _latest_intraday_map(db, token_ids, latest_trade_date)
-    if not latest_map:
-        raise HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
+    token_ids = db.execute(_token_ids_stmt(index_row.id)).scalars().all()
+    return index_row.index_symbol, [int(x) for x in token_ids if x is not None]
 
-    prev_map = _prev_close_map(db, token_ids, prev_trade_date) if prev_trade_date else {}
-    sec_map = _security_meta_map(db, list(latest_map.keys()))
 
-    # 52w high from bhavcopy (grouped)
-    # Note: join symbol+series; bhavcopy series can be null => treat as EQ via coalesce
-    bhav_series = func.coalesce(NseCmBhavcopy.series, literal("EQ"))
+def _attach_samples(db: Session, rows: List[Dict[str, Any]], latest_trade_date):
+    token_ids = [int(r["token_id"]) for r in rows if r.get("token_id") is not None]
+    if not token_ids:
+        return {}
 
-    high_rows = (
-        db.execute(
-            select(
-                NseCmSecurity.token_id.label("token_id"),
-                func.max(NseCmBhavcopy.high_price).label("high_52"),
-            )
-            .select_from(NseCmBhavcopy)
-            .join(
-                NseCmSecurity,
-                (NseCmSecurity.symbol == NseCmBhavcopy.symbol) & (NseCmSecurity.series == bhav_series),
-            )
-            .where(
-                NseCmBhavcopy.trade_date >= cutoff_start,
-                NseCmBhavcopy.trade_date <= cutoff_end,
-                NseCmSecurity.token_id.in_(token_ids),
-                NseCmSecurity.series == "EQ",
-                NseCmBhavcopy.high_price.isnot(None),
-            )
-            .group_by(NseCmSecurity.token_id)
-        )
-        .mappings()
-        .all()
-    )
+    # ✅ ingestion-maintained buffer first (constant cost), DB sampling only for misses
+    sample_map = safe_sample_points(KIND_CM, latest_trade_date, token_ids)
 
-    high_map = {int(r["token_id"]): r["high_52"] for r in high_rows if r.get("token_id") is not None}
+    missing = [tid for tid in token_ids if tid not in sample_map]
+    if missing:
+        rows = db.execute(_SAMPLE_SQL, {"td": latest_trade_date, "token_ids": missing}).mappings().all()
+        sample_map.update(_samples_by_token(rows))
 
-    items: List[Dict[str, Any]] = []
-    for tid, t in latest_map.items():
-        s = sec_map.get(tid)
-        if not s:
-            continue
+    return sample_map
 
-        high_raw = high_map.get(tid)
-        if high_raw is None:
-            continue
 
-        last_raw = t.get("last_price")
-        last_price = float(last_raw) if last_raw is not None else None
-        if last_price in (None, 0):
-            continue
+def _compute_todays_stock(db: Session, index_key: str, f: str, limit: int) -> Dict[str, Any]:
+    index_name, token_ids = _get_index_name_and_token_ids(db, index_key)
+    if not token_ids:
+        raise _no_tokens()
 
-        high_52 = float(high_raw) if high_raw is not None else None
-        if high_52 in (None, 0):
-            continue
+    latest_trade_date = db.execute(_latest_td_stmt(token_ids)).scalar()
+    if latest_trade_date is None:
+        raise _no_intraday()
+    prev_trade_date = db.execute(_prev_td_stmt(token_ids, latest_trade_date)).scalar()
 
-        prev_raw = prev_map.get(tid)
-        prev_close = float(prev_raw) if prev_raw is not None else None
+    latest_map = _by_token(
+        db.execute(_LATEST_SQL, {"td": latest_trade_date, "token_ids": token_ids}).mappings().all()
+    )
+    if not latest_map:
+        raise _no_latest_rows()
 
-        change_pct = None
-        if last_price is not None and prev_close not in (None, 0):
-            change_pct = (last_price - prev_close) * 100.0 / prev_close
+    prev_map = {}
+    if prev_trade_date:
+        prev_map = _value_by_token(
+            db.execute(_PREV_CLOSE_SQL, {"td": prev_trade_date, "token_ids": token_ids}).mappings().all(),
+            "prev_close",
+        )
 
-        near_high_pct = (high_52 - last_price) * 100.0 / high_52
+    sec_map = _by_token(db.execute(_security_meta_stmt(list(latest_map.keys()))).mappings().all())
 
-        items.append(
-            {
-                "token_id": tid,
-                "symbol": s["symbol"],
-                "series": s["series"],
-                "company_name": s["company_name"],
-                "last_price": last_price,
-                "prev_close": prev_close,
-                "change_pct": change_pct,
-                "close_price": (float(t["close_price"]) if t.get("close_price") is not None else None),
-                "total_traded_qty": None,
-                "volume": None,
-                "activity_metric": None,
-                "high_52": high_52,
-                "low_52": None,
-                "near_high_pct": near_high_pct,
-                "above_low_pct": None,
-                "interval_start": t.get("interval_start"),
-            }
+    ext_map = {}
+    if f in ("52W_HIGH", "52W_LOW"):
+        cutoff_start, cutoff_end = _cutoffs(latest_trade_date)
+        ext_map = _value_by_token(
+            db.execute(_extreme_52w_stmt(token_ids, cutoff_start, cutoff_end, f == "52W_HIGH")).mappings().all(),
+            "value",
         )
 
-    # nearer to high => smaller near_high_pct
-    items.sort(key=lambda x: (x["near_high_pct"] if x.get("near_high_pct") is not None else 1e18))
-
-    items = items[:limit]
+    items = _build_items(f, latest_map, prev_map, sec_map, ext_map)[:limit]
     sample_map = _attach_samples(db, items, latest_trade_date)
 
-    return {
-        "filter": "52W_HIGH",
-        "index": index_name,
-        "latest_trade_date": latest_trade_date.isoformat() if latest_trade_date else None,
-        "prev_trade_date": prev_trade_date.isoformat() if prev_trade_date else None,
-        "cutoff_start": cutoff_start.isoformat(),
-        "cutoff_end": cutoff_end.isoformat(),
-        "count": len(items),
-        "data": _serialize_rows(items, sample_map),
-    }
+    return _payload(f, index_name, latest_trade_date, prev_trade_date, items, sample_map)
 
 
-def _fetch_52w_low(db: Session, index_key: str, limit: int):
-    index_name, token_ids = _get_index_name_and_token_ids(db, index_key)
+# ===========================
+#  Async executor (asyncpg, independent queries in parallel)
+# ===========================
+def _scalars(r):
+    return r.scalars().all()
 
-    latest_trade_date = _get_latest_trade_date_for_tokens(db, token_ids)
-    prev_trade_date = _get_prev_trade_date_for_tokens(db, token_ids, latest_trade_date)
 
-    cutoff_end = latest_trade_date
-    cutoff_start = cutoff_end - timedelta(days=365)
+def _scalar(r):
+    return r.scalar()
 
-    latest_map = _latest_intraday_map(db, token_ids, latest_trade_date)
-    if not latest_map:
-        raise HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
 
-    prev_map = _prev_close_map(db, token_ids, prev_trade_date) if prev_trade_date else {}
-    sec_map = _security_meta_map(db, list(latest_map.keys()))
+async def _get_index_name_and_token_ids_async(index_key: str) -> Tuple[str, List[int]]:
+    key = _normalize_index_key(index_key)
 
-    bhav_series = func.coalesce(NseCmBhavcopy.series, literal("EQ"))
+    if key == "ALL":
+        token_ids = await async_query(_token_ids_stmt(None), consume=_scalars)
+        return "ALL_EQ", [int(x) for x in token_ids if x is not None]
 
-    low_rows = (
-        db.execute(
-            select(
-                NseCmSecurity.token_id.label("token_id"),
-                func.min(NseCmBhavcopy.low_price).label("low_52"),
-            )
-            .select_from(NseCmBhavcopy)
-            .join(
-                NseCmSecurity,
-                (NseCmSecurity.symbol == NseCmBhavcopy.symbol) & (NseCmSecurity.series == bhav_series),
-            )
-            .where(
-                NseCmBhavcopy.trade_date >= cutoff_start,
-                NseCmBhavcopy.trade_date <= cutoff_end,
-                NseCmSecurity.token_id.in_(token_ids),
-                NseCmSecurity.series == "EQ",
-                NseCmBhavcopy.low_price.isnot(None),
-            )
-            .group_by(NseCmSecurity.token_id)
-        )
-        .mappings()
-        .all()
-    )
+    index_row = None
+    for stmt in _index_row_stmts(key):
+        index_row = await async_query(stmt, consume=lambda r: r.scalars().one_or_none())
+        if index_row is not None:
+            break
+    if index_row is None:
+        raise _index_not_found(index_key)
 
-    low_map = {int(r["token_id"]): r["low_52"] for r in low_rows if r.get("token_id") is not None}
+    token_ids = await async_query(_token_ids_stmt(index_row.id), consume=_scalars)
+    return index_row.index_symbol, [int(x) for x in token_ids if x is not None]
 
-    items: List[Dict[str, Any]] = []
-    for tid, t in latest_map.items():
-        s = sec_map.get(tid)
-        if not s:
-            continue
 
-        low_raw = low_map.get(tid)
-        if low_raw is None:
-            continue
+async def _attach_samples_async(rows: List[Dict[str, Any]], latest_trade_date):
+    token_ids = [int(r["token_id"]) for r in rows if r.get("token_id") is not None]
+    if not token_ids:
+        return {}
 
-        last_raw = t.get("last_price")
-        last_price = float(last_raw) if last_raw is not None else None
-        if last_price in (None, 0):
-            continue
+    # sync redis client -> threadpool
+    sample_map = await run_in_threadpool(safe_sample_points, KIND_CM, latest_trade_date, token_ids)
 
-        low_52 = float(low_raw) if low_raw is not None else None
-        if low_52 in (None, 0):
-            continue
+    missing = [tid for tid in token_ids if tid not in sample_map]
+    if missing:
+        rows = await async_query(_SAMPLE_SQL, {"td": latest_trade_date, "token_ids": missing})
+        sample_map.update(_samples_by_token(rows))
 
-        prev_raw = prev_map.get(tid)
-        prev_close = float(prev_raw) if prev_raw is not None else None
+    return sample_map
 
-        change_pct = None
-        if last_price is not None and prev_close not in (None, 0):
-            change_pct = (last_price - prev_close) * 100.0 / prev_close
 
-        above_low_pct = (last_price - low_52) * 100.0 / low_52
+async def _compute_todays_stock_async(index_key: str, f: str, limit: int) -> Dict[str, Any]:
+    index_name, token_ids = await _get_index_name_and_token_ids_async(index_key)
+    if not token_ids:
+        raise _no_tokens()
 
-        items.append(
-            {
-                "token_id": tid,
-                "symbol": s["symbol"],
-                "series": s["series"],
-                "company_name": s["company_name"],
-                "last_price": last_price,
-                "prev_close": prev_close,
-                "change_pct": change_pct,
-                "close_price": (float(t["close_price"]) if t.get("close_price") is not None else None),
-                "total_traded_qty": None,
-                "volume": None,
-                "activity_metric": None,
-                "high_52": None,
-                "low_52": low_52,
-                "near_high_pct": None,
-                "above_low_pct": above_low_pct,
-                "interval_start": t.get("interval_start"),
-            }
-        )
+    latest_trade_date = await async_query(_latest_td_stmt(token_ids), consume=_scalar)
+    if latest_trade_date is None:
+        raise _no_intraday()
 
-    # closer above low => smaller above_low_pct
-    items.sort(key=lambda x: (x["above_low_pct"] if x.get("above_low_pct") is not None else 1e18))
+    # everything below only needs latest_trade_date -> run together
+    calls = [
+        async_query(_prev_td_stmt(token_ids, latest_trade_date), consume=_scalar),
+        async_query(_LATEST_SQL, {"td": latest_trade_date, "token_ids": token_ids}),
+        async_query(_security_meta_stmt(token_ids)),
+    ]
+    if f in ("52W_HIGH", "52W_LOW"):
+        cutoff_start, cutoff_end = _cutoffs(latest_trade_date)
+        calls.append(async_query(_extreme_52w_stmt(token_ids, cutoff_start, cutoff_end, f == "52W_HIGH")))
 
-    items = items[:limit]
-    sample_map = _attach_samples(db, items, latest_trade_date)
+    results = await asyncio.gather(*calls)
+    prev_trade_date, latest_rows, sec_rows = results[:3]
+    ext_map = _value_by_token(results[3], "value") if len(results) > 3 else {}
 
-    return {
-        "filter": "52W_LOW",
-        "index": index_name,
-        "latest_trade_date": latest_trade_date.isoformat() if latest_trade_date else None,
-        "prev_trade_date": prev_trade_date.isoformat() if prev_trade_date else None,
-        "cutoff_start": cutoff_start.isoformat(),
-        "cutoff_end": cutoff_end.isoformat(),
-        "count": len(items),
-        "data": _serialize_rows(items, sample_map),
-    }
+    latest_map = _by_token(latest_rows)
+    if not latest_map:
+        raise _no_latest_rows()
+    sec_map = _by_token(sec_rows)
+
+    prev_map = {}
+    if prev_trade_date:
+        prev_map = _value_by_token(
+            await async_query(_PREV_CLOSE_SQL, {"td": prev_trade_date, "token_ids": token_ids}),
+            "prev_close",
+        )
+
+    items = _build_items(f, latest_map, prev_map, sec_map, ext_map)[:limit]
+    sample_map = await _attach_samples_async(items, latest_trade_date)
+
+    return _payload(f, index_name, latest_trade_date, prev_trade_date, items, sample_map)
 
 
 # ===========================
@@ -748,25 +553,15 @@ def _fetch_52w_low(db: Session, index_key: str, limit: int):
 # ===========================
 @router.get("/")
 async def todays_stock(
+    request: Request,
     index: str = Query("NIFTY100", description="Index filter: NIFTY50 / NIFTY100 / NIFTY500 / ALL"),
     filter_type: str = Query("GAINERS", description="Filter: GAINERS / LOSERS / MOST_ACTIVE / 52W_HIGH / 52W_LOW"),
     limit: int = Query(10, ge=1, le=500, description="Max number of rows to return"),
-    db: Session = Depends(get_db),
 ):
-    f = (filter_type or "").upper().strip()
-
-    if f == "GAINERS":
-        return _fetch_gainers(db, index, limit)
-    if f == "LOSERS":
-        return _fetch_losers(db, index, limit)
-    if f == "MOST_ACTIVE":
-        return _fetch_most_active(db, index, limit)
-    if f == "52W_HIGH":
-        return _fetch_52w_high(db, index, limit)
-    if f == "52W_LOW":
-        return _fetch_52w_low(db, index, limit)
-
-    raise HTTPException(
-        status_code=400,
-        detail="Invalid filter_type. Use: GAINERS / LOSERS / MOST_ACTIVE / 52W_HIGH / 52W_LOW",
+    f = _normalize_filter(filter_type)
+    return await cached_json_async(
+        "todays-stock",
+        {"index": _normalize_index_key(index), "filter": f, "limit": limit},
+        lambda: _compute_todays_stock_async(index, f, limit),
+        accept_encoding=request.headers.get("accept-encoding", ""),
     )
@@ -1,131 +1,118 @@
 # routes/NSE/Top_Marqee.py
+import asyncio
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
 from sqlalchemy import func, select, text
 from sqlalchemy.orm import Session
 
-from db.connection import get_db
+from db.connection import async_query
 from db.models import (
     NseIndexConstituent,
     NseIndexMaster,
     NseCmIntraday1Min,
     NseCmSecurity,
 )
+from utils.Market.response_cache import cached_json_async
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/top-marqee", tags=["top marqee"])
 
 
-def _get_nifty100_index_row(db: Session) -> NseIndexMaster:
-    row = (
-        db.query(NseIndexMaster)
-        .filter(
-            (NseIndexMaster.index_symbol == "NIFTY 100")
-            | (NseIndexMaster.short_code == "NIFTY100")
+# -----------------------------
+# Statements (shared by sync + async executors)
+# -----------------------------
+_INDEX_ROW_STMTS = [
+    select(NseIndexMaster).where(
+        (NseIndexMaster.index_symbol == "NIFTY 100")
+        | (NseIndexMaster.short_code == "NIFTY100")
+    ),
+    select(NseIndexMaster).where(func.lower(NseIndexMaster.index_symbol) == "nifty 100"),
+    select(NseIndexMaster).where(func.lower(NseIndexMaster.short_code) == "nifty100"),
+]
+
+
+def _token_ids_stmt(index_id: int):
+    # token list (small list ~100)
+    return (
+        select(NseCmSecurity.token_id)
+        .select_from(NseIndexConstituent)
+        .join(NseCmSecurity, NseCmSecurity.symbol == NseIndexConstituent.symbol)
+        .where(
+            NseIndexConstituent.index_id == index_id,
+            NseCmSecurity.series == "EQ",
         )
-        .one_or_none()
+        .distinct()
     )
-    if row is None:
-        row = (
-            db.query(NseIndexMaster)
-            .filter(func.lower(NseIndexMaster.index_symbol) == "nifty 100")
-            .one_or_none()
-        )
-    if row is None:
-        row = (
-            db.query(NseIndexMaster)
-            .filter(func.lower(NseIndexMaster.short_code) == "nifty100")
-            .one_or_none()
-        )
-    if row is None:
-        raise HTTPException(status_code=404, detail="NIFTY 100 index not found in NseIndexMaster")
-    return row
 
 
-@router.get("/")
-async def nifty100TopMarqee(db: Session = Depends(get_db)):
-    index_row = _get_nifty100_index_row(db)
+# latest trade_date (global max is faster; if you want token-filtered keep old)
+_LATEST_TD_STMT = select(func.max(NseCmIntraday1Min.trade_date))
 
-    # 1) token list (small list ~100)
-    token_rows = (
-        db.execute(
-            select(NseCmSecurity.token_id)
-            .select_from(NseIndexConstituent)
-            .join(NseCmSecurity, NseCmSecurity.symbol == NseIndexConstituent.symbol)
-            .where(
-                NseIndexConstituent.index_id == index_row.id,
-                NseCmSecurity.series == "EQ",
-            )
-            .distinct()
-        )
-        .scalars()
-        .all()
-    )
 
-    if not token_rows:
-        raise HTTPException(status_code=404, detail="No tokens found for NIFTY 100")
+def _prev_td_stmt(latest_trade_date):
+    return select(func.max(NseCmIntraday1Min.trade_date)).where(NseCmIntraday1Min.trade_date < latest_trade_date)
 
-    token_ids = list(token_rows)
 
-    # 2) latest trade_date (global max is faster; if you want token-filtered keep old)
-    latest_trade_date = db.execute(select(func.max(NseCmIntraday1Min.trade_date))).scalar()
-    if latest_trade_date is None:
-        raise HTTPException(status_code=404, detail="No intraday data found")
-
-    # prev trade date (global)
-    prev_trade_date = db.execute(
-        select(func.max(NseCmIntraday1Min.trade_date)).where(NseCmIntraday1Min.trade_date < latest_trade_date)
-    ).scalar()
-
-    # 3) TODAY latest candle per token using DISTINCT ON (Postgres fast)
-    today_sql = text("""
-        SELECT DISTINCT ON (token_id)
-          token_id,
-          interval_start,
-          last_price AS today_last,
-          close_price AS today_close
-        FROM nse_cm_intraday_1min
-        WHERE trade_date = :td
-          AND token_id = ANY(:token_ids)
-        ORDER BY token_id, interval_start DESC
-    """)
-    today_rows = db.execute(today_sql, {"td": latest_trade_date, "token_ids": token_ids}).mappings().all()
+# TODAY latest candle per token using DISTINCT ON (Postgres fast)
+_TODAY_SQL = text("""
+    SELECT DISTINCT ON (token_id)
+      token_id,
+      interval_start,
+      last_price AS today_last,
+      close_price AS today_close
+    FROM nse_cm_intraday_1min
+    WHERE trade_date = :td
+      AND token_id = ANY(:token_ids)
+    ORDER BY token_id, interval_start DESC
+""")
+
+# PREV latest close per token (optional)
+_PREV_SQL = text("""
+    SELECT DISTINCT ON (token_id)
+      token_id,
+      close_price AS prev_close
+    FROM nse_cm_intraday_1min
+    WHERE trade_date = :td
+      AND token_id = ANY(:token_ids)
+    ORDER BY token_id, interval_start DESC
+""")
+
+
+def _security_meta_stmt(token_ids: List[int]):
+    # security metadata (small)
+    return select(
+        NseCmSecurity.token_id,
+        NseCmSecurity.symbol,
+        NseCmSecurity.series,
+        NseCmSecurity.company_name,
+    ).where(NseCmSecurity.token_id.in_(token_ids), NseCmSecurity.series == "EQ")
+
+
+def _index_not_found():
+    return HTTPException(status_code=404, detail="NIFTY 100 index not found in NseIndexMaster")
 
-    if not today_rows:
-        raise HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
 
+def _no_tokens():
+    return HTTPException(status_code=404, detail="No tokens found for NIFTY 100")
+
+
+def _no_intraday():
+    return HTTPException(status_code=404, detail="No intraday data found")
+
+
+def _no_today_rows():
+    return HTTPException(status_code=404, detail="No intraday rows for latest trade_date + tokens")
+
+
+# -----------------------------
+# Assembly (pure)
+# -----------------------------
+def _build_payload(latest_trade_date, prev_trade_date, today_rows, prev_rows, sec_rows) -> Dict[str, Any]:
     # map token -> today
     today_map = {r["token_id"]: r for r in today_rows}
-
-    # 4) PREV latest close per token (optional)
-    prev_map = {}
-    if prev_trade_date is not None:
-        prev_sql = text("""
-            SELECT DISTINCT ON (token_id)
-              token_id,
-              close_price AS prev_close
-            FROM nse_cm_intraday_1min
-            WHERE trade_date = :td
-              AND token_id = ANY(:token_ids)
-            ORDER BY token_id, interval_start DESC
-        """)
-        prev_rows = db.execute(prev_sql, {"td": prev_trade_date, "token_ids": token_ids}).mappings().all()
-        prev_map = {r["token_id"]: r["prev_close"] for r in prev_rows}
-
-    # 5) security metadata (small)
-    sec_rows = (
-        db.execute(
-            select(
-                NseCmSecurity.token_id,
-                NseCmSecurity.symbol,
-                NseCmSecurity.series,
-                NseCmSecurity.company_name,
-            )
-            .where(NseCmSecurity.token_id.in_(token_ids), NseCmSecurity.series == "EQ")
-        )
-        .mappings()
-        .all()
-    )
+    prev_map = {r["token_id"]: r["prev_close"] for r in prev_rows}
     sec_map = {r["token_id"]: r for r in sec_rows}
 
     result = []
@@ -171,3 +158,91 @@ async def nifty100TopMarqee(db: Session = Depends(get_db)):
         "count": len(result),
         "data": result,
     }
+
+
+# -----------------------------
+# Sync executor (ingestion / scripts / threadpool)
+# -----------------------------
+def _get_nifty100_index_row(db: Session) -> NseIndexMaster:
+    for stmt in _INDEX_ROW_STMTS:
+        row = db.execute(stmt).scalars().one_or_none()
+        if row is not None:
+            return row
+    raise _index_not_found()
+
+
+def _compute_top_marqee(db: Session) -> Dict[str, Any]:
+    index_row = _get_nifty100_index_row(db)
+
+    token_ids = list(db.execute(_token_ids_stmt(index_row.id)).scalars().all())
+    if not token_ids:
+        raise _no_tokens()
+
+    latest_trade_date = db.execute(_LATEST_TD_STMT).scalar()
+    if latest_trade_date is None:
+        raise _no_intraday()
+
+    prev_trade_date = db.execute(_prev_td_stmt(latest_trade_date)).scalar()
+
+    today_rows = db.execute(_TODAY_SQL, {"td": latest_trade_date, "token_ids": token_ids}).mappings().all()
+    if not today_rows:
+        raise _no_today_rows()
+
+    prev_rows = []
+    if prev_trade_date is not None:
+        prev_rows = db.execute(_PREV_SQL, {"td": prev_trade_date, "token_ids": token_ids}).mappings().all()
+
+    sec_rows = db.execute(_security_meta_stmt(token_ids)).mappings().all()
+
+    return _build_payload(latest_trade_date, prev_trade_date, today_rows, prev_rows, sec_rows)
+
+
+# -----------------------------
+# Async executor (asyncpg, independent queries in parallel)
+# -----------------------------
+async def _token_ids_async() -> List[int]:
+    index_row: Optional[NseIndexMaster] = None
+    for stmt in _INDEX_ROW_STMTS:
+        index_row = await async_query(stmt, consume=lambda r: r.scalars().one_or_none())
+        if index_row is not None:
+            break
+    if index_row is None:
+        raise _index_not_found()
+
+    return list(await async_query(_token_ids_stmt(index_row.id), consume=lambda r: r.scalars().all()))
+
+
+async def _compute_top_marqee_async() -> Dict[str, Any]:
+    # universe and latest trade_date do not depend on each other
+    token_ids, latest_trade_date = await asyncio.gather(
+        _token_ids_async(),
+        async_query(_LATEST_TD_STMT, consume=lambda r: r.scalar()),
+    )
+    if not token_ids:
+        raise _no_tokens()
+    if latest_trade_date is None:
+        raise _no_intraday()
+
+    prev_trade_date, today_rows, sec_rows = await asyncio.gather(
+        async_query(_prev_td_stmt(latest_trade_date), consume=lambda r: r.scalar()),
+        async_query(_TODAY_SQL, {"td": latest_trade_date, "token_ids": token_ids}),
+        async_query(_security_meta_stmt(token_ids)),
+    )
+    if not today_rows:
+        raise _no_today_rows()
+
+    prev_rows = []
+    if prev_trade_date is not None:
+        prev_rows = await async_query(_PREV_SQL, {"td": prev_trade_date, "token_ids": token_ids})
+
+    return _build_payload(latest_trade_date, prev_trade_date, today_rows, prev_rows, sec_rows)
+
+
+@router.get("/")
+async def nifty100TopMarqee(request: Request):
+    return await cached_json_async(
+        "top-marqee",
+        {},
+        _compute_top_marqee_async,
+        accept_encoding=request.headers.get("accept-encoding", ""),
+    )
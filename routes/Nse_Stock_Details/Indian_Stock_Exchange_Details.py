@@ -6,6 +6,7 @@ from datetime import date, datetime
 
 import httpx
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from db.connection import get_db
@@ -104,6 +105,14 @@ def save_stock_snapshot_bg(
         db.close()
 
 
+def _read_cached(db: Session, key: str, fdate) -> Optional[StockDetail]:
+    return (
+        db.query(StockDetail)
+        .filter(StockDetail.symbol == key, StockDetail.fetch_date == fdate)
+        .first()
+    )
+
+
 @router.get("/", summary="Get stock details (DB cache daily, else fetch + save)")
 async def get_stock_details(
     background_tasks: BackgroundTasks,
@@ -120,13 +129,9 @@ async def get_stock_details(
     symbol_key = normalize_key(symbol) if symbol else None
     name_key = normalize_key(name) if name else None
 
-    # ✅ 1) DB check by symbol (priority)
+    # ✅ 1) DB check by symbol (priority) — sync session -> threadpool
     if symbol_key:
-        cached = (
-            db.query(StockDetail)
-            .filter(StockDetail.symbol == symbol_key, StockDetail.fetch_date == fdate)
-            .first()
-        )
+        cached = await run_in_threadpool(_read_cached, db, symbol_key, fdate)
         if cached:
             return {
                 "source": "db",
@@ -138,11 +143,7 @@ async def get_stock_details(
 
     # ✅ 2) DB check by name (fallback)
     if name_key:
-        cached = (
-            db.query(StockDetail)
-            .filter(StockDetail.symbol == name_key, StockDetail.fetch_date == fdate)
-            .first()
-        )
+        cached = await run_in_threadpool(_read_cached, db, name_key, fdate)
         if cached:
             return {
                 "source": "db",
@@ -0,0 +1,58 @@
+# scripts/backfill_candle_rollups.py
+"""
+One-time / repair backfill for nse_cm_candle_rollup.
+
+  python -m scripts.backfill_candle_rollups 2024-01-01            # from date to today
+  python -m scripts.backfill_candle_rollups 2024-01-01 2024-06-30
+
+Weekly / monthly bars come from bhavcopy, intraday (5m..1h) from
+nse_cm_intraday_1min, one trade_date per commit. Rebuilt days get their
+nse_cm_rollup_watermark row; until then /candles aggregates 1m for them.
+"""
+import sys
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from db.connection import SessionLocal
+from db.models import NseCmIntraday1Min
+from utils.Market.candle_rollups import rebuild_intraday_rollups, refresh_period_rollups
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    start = date.fromisoformat(sys.argv[1])
+    end = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else datetime.now(ZoneInfo("Asia/Kolkata")).date()
+
+    db: Session = SessionLocal()
+    try:
+        refresh_period_rollups(db, end, since=start)
+        db.commit()
+        print(f"[ROLLUP] ✅ 1w / 1M rebuilt {start} -> {end}")
+
+        days = [
+            r[0]
+            for r in db.query(func.distinct(NseCmIntraday1Min.trade_date))
+            .filter(NseCmIntraday1Min.trade_date >= start, NseCmIntraday1Min.trade_date <= end)
+            .order_by(NseCmIntraday1Min.trade_date)
+            .all()
+        ]
+        for td in days:
+            rebuild_intraday_rollups(db, td)
+            db.commit()
+            print(f"[ROLLUP] ✅ intraday rollups rebuilt for {td}")
+    except Exception as e:
+        db.rollback()
+        print(f"[ROLLUP] ❌ backfill failed: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# scripts/signal_parity.py
+"""
+Parity + timing check for the cross-sectional signal engine
+(routes/AngelOne/batch_signals.py) against the per-item reference
+(compute_indicators / IndicatorState / score_signal), on a synthetic universe.
+
+  python -m scripts.signal_parity --symbols 500 --bars 600
+  python -m scripts.signal_parity --symbols 2000 --bars 400 --tol 1e-9
+
+Exits 1 on any mismatch. Timings are printed for the batch paths so a
+watchlist size can be checked against the fast-tick budget.
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+import pandas as pd
+
+from routes.AngelOne.batch_signals import batch_indicators, score_signals_batch
+from routes.AngelOne.indicators import compute_indicators
+from routes.AngelOne.signals import score_signal
+
+
+def _frame(rng: random.Random, bars: int) -> pd.DataFrame:
+    n = rng.randint(max(2, bars // 3), bars)
+    px = rng.uniform(50, 5000)
+    closes = []
+    for _ in range(n):
+        px = max(1.0, px * (1 + rng.gauss(0, 0.01)))
+        closes.append(round(px, 2))
+    return pd.DataFrame({"time": [f"t{i:06d}" for i in range(n)], "close": closes})
+
+
+def _quote(rng: random.Random, close: float) -> dict:
+    q = {
+        "ltp": round(close * (1 + rng.gauss(0, 0.01)), 2),
+        "tradeVolume": rng.choice([0, rng.randint(1, 10**7)]),
+        "totBuyQuan": rng.randint(0, 10**6),
+        "totSellQuan": rng.randint(0, 10**6),
+    }
+    for k in list(q):
+        if rng.random() < 0.05:
+            q[k] = None
+    if rng.random() < 0.05:
+        q["totSellQuan"] = q["totBuyQuan"]
+    return q
+
+
+def _same(a, b, tol: float) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    if math.isnan(a) or math.isnan(b):
+        return math.isnan(a) and math.isnan(b)
+    return abs(a - b) <= tol * max(1.0, abs(a))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=500)
+    ap.add_argument("--bars", type=int, default=600)
+    ap.add_argument("--tol", type=float, default=1e-9)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    frames = [_frame(rng, args.bars) for _ in range(args.symbols)]
+    quotes = [_quote(rng, float(df["close"].iloc[-1])) for df in frames]
+
+    t0 = time.perf_counter()
+    batch = batch_indicators(frames)
+    t_ind = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ref = [compute_indicators(df) for df in frames]
+    t_ref = time.perf_counter() - t0
+
+    bad = 0
+    for i, ((st, ind), r) in enumerate(zip(batch, ref)):
+        for k, v in r.items():
+            if not _same(v, ind.get(k), args.tol):
+                bad += 1
+                print(f"❌ indicators[{i}] {k}: batch={ind.get(k)} pandas={v}")
+        # checkpoint must reproduce the same tip
+        tip = st.compute(float(frames[i]["close"].iloc[-1]))
+        for k, v in r.items():
+            if not _same(v, tip.get(k), args.tol):
+                bad += 1
+                print(f"❌ checkpoint[{i}] {k}: state={tip.get(k)} pandas={v}")
+
+    inds = [ind for _, ind in batch]
+    for i in range(0, len(inds), 17):
+        inds[i] = {**inds[i], "rsi14": None}
+
+    t0 = time.perf_counter()
+    sigs = score_signals_batch(quotes, inds)
+    t_score = time.perf_counter() - t0
+
+    for i, (q, ind, sig) in enumerate(zip(quotes, inds, sigs)):
+        want = score_signal(q, ind)
+        if want != sig:
+            bad += 1
+            print(f"❌ decision[{i}]: batch={sig} reference={want}")
+
+    print(f"symbols={args.symbols} bars<={args.bars}")
+    print(f"batch_indicators   {t_ind * 1000:8.1f} ms   (pandas per-item {t_ref * 1000:.1f} ms)")
+    print(f"score_signals_batch {t_score * 1000:7.1f} ms")
+    print("✅ parity OK" if not bad else f"❌ {bad} mismatches")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# scripts/ws_load_test.py
+"""
+Load test for the live quotes WebSocket gateway (/api/v1/live/ws).
+
+  python -m scripts.ws_load_test --clients 5000 --symbols 20 --duration 60
+  python -m scripts.ws_load_test --clients 5000 --publish-rate 2000     # synthetic feed
+  python -m scripts.ws_load_test --clients 5000 --burst-every 5         # one CM30 seq per 5s
+
+--publish-rate publishes synthetic quotes (with a send timestamp) straight to
+pub:cm:symbol:<SYM> so the test also works outside market hours and reports
+end-to-end latency. --burst-every publishes the whole universe in one
+pipeline every N seconds instead, like ingestion does per committed seq.
+Point --url at ONE worker to measure per-worker capacity, then compare with
+GET /api/v1/live/ws/metrics on that worker.
+
+--probe-clients N leaves JSON decoding (and the latency sample) to N clients;
+the rest only count, so the generator does not starve a worker on the same
+host.
+
+Raise the open-file limit first (ulimit -n 65535) for thousands of sockets,
+and start the worker the way production does (--ws-per-message-deflate false).
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import statistics
+import time
+
+import redis.asyncio as aredis
+import websockets
+
+DEFAULT_SYMBOLS = [
+    "RELIANCE", "TCS", "HDFCBANK", "ICICIBANK", "INFY", "SBIN", "BHARTIARTL", "ITC",
+    "LT", "KOTAKBANK", "AXISBANK", "HINDUNILVR", "BAJFINANCE", "MARUTI", "SUNPHARMA",
+    "TITAN", "ASIANPAINT", "ULTRACEMCO", "WIPRO", "NTPC", "POWERGRID", "ONGC", "TATASTEEL",
+    "M&M", "HCLTECH", "ADANIENT", "JSWSTEEL", "COALINDIA", "NESTLEIND", "TECHM",
+]
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.closed = 0
+        self.frames = 0
+        self.quotes = 0
+        self.latencies_ms = []
+        self.errors = collections.Counter()
+
+
+async def _client(args, stats: Stats, probe: bool = True):
+    syms = random.sample(args.universe, min(args.symbols, len(args.universe)))
+    connected = False
+    try:
+        async with websockets.connect(args.url, max_queue=None, open_timeout=30) as ws:
+            connected = True
+            stats.connected += 1
+            await ws.send(json.dumps({"action": "subscribe", "symbols": syms}))
+            # runs until main() cancels it (a recv timeout per client costs a task per second)
+            async for raw in ws:
+                stats.frames += 1
+                if not probe:
+                    if raw.startswith('{"type":"quotes"'):
+                        stats.quotes += raw.count('"symbol"')
+                    continue
+                msg = json.loads(raw)
+                if msg.get("type") != "quotes":
+                    continue
+                now = time.time()
+                for q in msg["data"]:
+                    stats.quotes += 1
+                    sent = q.get("_sent_at")
+                    if sent and len(stats.latencies_ms) < 200_000:
+                        stats.latencies_ms.append((now - sent) * 1000.0)
+    except Exception as e:
+        stats.errors[f"{type(e).__name__}: {str(e)[:80]}"] += 1
+        if connected:
+            stats.closed += 1
+        else:
+            stats.failed += 1
+
+
+async def _publisher(args, stop: asyncio.Event):
+    r = aredis.Redis.from_url(args.redis_url)
+    interval = 1.0 / args.publish_rate
+    seq = 0
+    try:
+        while not stop.is_set():
+            seq += 1
+            sym = random.choice(args.universe)
+            payload = {"symbol": sym, "ltp": round(random.uniform(100, 3000), 2), "seq": seq, "_sent_at": time.time()}
+            await r.publish(f"pub:cm:symbol:{sym}", json.dumps(payload))
+            await asyncio.sleep(interval)
+    finally:
+        await r.close()
+
+
+async def _burst_publisher(args, stop: asyncio.Event):
+    r = aredis.Redis.from_url(args.redis_url)
+    seq = 0
+    try:
+        while not stop.is_set():
+            seq += 1
+            pipe = r.pipeline(transaction=False)
+            for sym in args.universe:
+                payload = {"symbol": sym, "ltp": round(random.uniform(100, 3000), 2), "seq": seq, "_sent_at": time.time()}
+                pipe.publish(f"pub:cm:symbol:{sym}", json.dumps(payload))
+            await pipe.execute()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=args.burst_every)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await r.close()
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="ws://127.0.0.1:8000/api/v1/live/ws")
+    ap.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"))
+    ap.add_argument("--clients", type=int, default=2000)
+    ap.add_argument("--symbols", type=int, default=20, help="symbols per client")
+    ap.add_argument("--duration", type=int, default=60)
+    ap.add_argument("--ramp", type=int, default=200, help="connections opened per second")
+    ap.add_argument("--publish-rate", type=float, default=0.0, help="synthetic quotes/sec (0 = use live feed)")
+    ap.add_argument("--burst-every", type=float, default=0.0, help="publish every symbol at once every N sec (0 = off)")
+    ap.add_argument("--probe-clients", type=int, default=0, help="clients that decode frames for latency (0 = all)")
+    args = ap.parse_args()
+    args.universe = DEFAULT_SYMBOLS
+
+    stats, stop = Stats(), asyncio.Event()
+    tasks = []
+    for i in range(args.clients):
+        probe = not args.probe_clients or i < args.probe_clients
+        tasks.append(asyncio.create_task(_client(args, stats, probe)))
+        if (i + 1) % args.ramp == 0:
+            await asyncio.sleep(1.0)
+    # publish only once the handshakes are done, or the first samples time the backlog
+    settle = time.time() + 60
+    while stats.connected + stats.failed < args.clients and time.time() < settle:
+        await asyncio.sleep(0.5)
+    print(f"[WS-LOAD] opened {args.clients} clients, connected={stats.connected} failed={stats.failed}")
+
+    if args.publish_rate > 0:
+        tasks.append(asyncio.create_task(_publisher(args, stop)))
+    if args.burst_every > 0:
+        tasks.append(asyncio.create_task(_burst_publisher(args, stop)))
+
+    started, last_quotes = time.time(), 0
+    while time.time() - started < args.duration:
+        await asyncio.sleep(5)
+        rate = (stats.quotes - last_quotes) / 5.0
+        last_quotes = stats.quotes
+        print(f"[WS-LOAD] connected={stats.connected - stats.closed} quotes/s={rate:,.0f} frames={stats.frames:,}")
+
+    stop.set()
+    for t in tasks[: args.clients]:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    lat = sorted(stats.latencies_ms)
+    print("[WS-LOAD] ---- result ----")
+    print(f"clients={args.clients} connected={stats.connected} failed={stats.failed} dropped={stats.closed}")
+    print(f"frames={stats.frames:,} quotes={stats.quotes:,}")
+    for err, n in stats.errors.most_common(5):
+        print(f"error x{n}: {err}")
+    if lat:
+        p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))]
+        print(f"latency ms: p50={p(0.50):.1f} p95={p(0.95):.1f} p99={p(0.99):.1f} mean={statistics.mean(lat):.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
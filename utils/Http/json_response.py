@@ -0,0 +1,47 @@
+# utils/Http/json_response.py
+
+"""
+App-wide JSON encoding (orjson).
+
+AppJSONResponse is the FastAPI default_response_class; orjson_dumps() is the
+same encoder for code that serializes bytes itself (response cache,
+pre-rendered widgets), so cached and live bodies are byte-identical.
+"""
+
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional for the API process
+    np = None
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def orjson_default(o: Any):
+    # datetime / date / time / UUID / dataclass / numpy arrays are native to orjson
+    if isinstance(o, Decimal):
+        return float(o)
+    if np is not None and isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if hasattr(o, "model_dump"):
+        return o.model_dump()
+    raise TypeError(f"not JSON serializable: {type(o).__name__}")
+
+
+def orjson_dumps(payload: Any) -> bytes:
+    return orjson.dumps(payload, default=orjson_default, option=ORJSON_OPTIONS)
+
+
+class AppJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson_dumps(content)
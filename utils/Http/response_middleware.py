@@ -0,0 +1,225 @@
+# utils/Http/response_middleware.py
+
+"""
+Response encoding pipeline (pure ASGI, one pass over the finished body):
+
+  1. Cache-Control   per-route policy (CACHE_POLICIES, first matching prefix),
+                     only if the route did not set one itself
+  2. ETag            strong; the route's own ETag if present (data_version
+                     based, see utils/Market/response_cache.py) else a hash
+                     of the body. If-None-Match match -> 304, no body
+  3. Compression     gzip / br for compressible bodies >= minimum_size,
+                     skipped when the body is already encoded (pre-rendered)
+
+ETags are per representation: the encoded variant gets "<tag>-gzip" /
+"<tag>-br", and If-None-Match compares the base tag so a client revalidating
+any variant still gets its 304.
+
+Streaming responses (more_body=True: SSE, file streams) are passed through
+untouched apart from the Cache-Control policy.
+"""
+
+import hashlib
+from typing import Iterable, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.Market.content_encoding import AVAILABLE, BR, GZIP, IDENTITY, compress, negotiate
+
+# (path prefix, Cache-Control) - most specific first.
+# Versioned market routes (data_version ETag) must never be served stale:
+# no-cache makes every use revalidate, which the ETag / 304 path keeps cheap.
+CACHE_POLICIES: List[Tuple[str, str]] = [
+    ("/api/v1/market-and-sectors/historical", "public, max-age=60"),
+    ("/api/v1/market-and-sectors", "public, no-cache"),
+    ("/api/v1/top-marqee", "public, no-cache"),
+    ("/api/v1/today-stock", "public, no-cache"),
+    ("/api/v1/most-traded", "public, no-cache"),
+    ("/api/v1/preopen-movers", "public, max-age=30"),
+    ("/api/v1/nse/historical", "public, max-age=60"),
+    ("/api/v1/stock-details", "public, max-age=60"),
+    ("/api/v1/live", "no-store"),
+    ("/api/v1/health", "no-store"),
+]
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+NEVER_COMPRESS_TYPES = ("text/event-stream",)
+
+ENCODED_SUFFIXES = (f"-{BR}", f"-{GZIP}")
+
+# headers a 304 may carry (RFC 9110 15.4.5) + ours
+NOT_MODIFIED_HEADERS = (
+    "cache-control",
+    "content-location",
+    "date",
+    "etag",
+    "expires",
+    "vary",
+    "x-cache",
+    "x-data-version",
+)
+
+
+def strong_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def variant_etag(etag: str, encoding: str) -> str:
+    if encoding == IDENTITY or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _etag_base(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    for suffix in ENCODED_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[: -len(suffix)]
+    return tag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = _etag_base(etag)
+    return any(_etag_base(t) == base for t in if_none_match.split(","))
+
+
+def cache_policy(path: str, policies: Iterable[Tuple[str, str]] = CACHE_POLICIES) -> Optional[str]:
+    for prefix, policy in policies:
+        if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+            return policy
+    return None
+
+
+def _compressible(content_type: str) -> bool:
+    ct = (content_type or "").lower()
+    if ct.startswith(NEVER_COMPRESS_TYPES):
+        return False
+    return ct.startswith(COMPRESSIBLE_TYPES)
+
+
+def _add_vary(headers: MutableHeaders, value: str) -> None:
+    vary = headers.get("vary")
+    if not vary:
+        headers["Vary"] = value
+    elif value.lower() not in vary.lower():
+        headers["Vary"] = f"{vary}, {value}"
+
+
+class ResponseEncodingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        policies: Iterable[Tuple[str, str]] = CACHE_POLICIES,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.policies = list(policies)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        req = Headers(scope=scope)
+        responder = _Responder(
+            send,
+            method=scope["method"],
+            accept_encoding=req.get("accept-encoding", ""),
+            if_none_match=req.get("if-none-match", ""),
+            policy=cache_policy(scope["path"], self.policies),
+            minimum_size=self.minimum_size,
+        )
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    def __init__(self, send: Send, method: str, accept_encoding: str, if_none_match: str,
+                 policy: Optional[str], minimum_size: int) -> None:
+        self._send = send
+        self.method = method
+        self.accept_encoding = accept_encoding
+        self.if_none_match = if_none_match
+        self.policy = policy
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.streaming = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = MutableHeaders(scope=message)
+            if self.policy and "cache-control" not in headers:
+                headers["Cache-Control"] = self.policy
+            return
+
+        if message["type"] != "http.response.body" or self.streaming:
+            await self._send(message)
+            return
+
+        if message.get("more_body", False):
+            # streaming: headers go out as the route set them
+            self.streaming = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+
+        await self._finish(message.get("body", b""))
+
+    async def _finish(self, body: bytes) -> None:
+        start = self.start
+        headers = MutableHeaders(scope=start)
+
+        enc = None
+        if (
+            200 <= start["status"] < 300
+            and "content-encoding" not in headers
+            and len(body) >= self.minimum_size
+            and _compressible(headers.get("content-type", ""))
+        ):
+            enc = negotiate(self.accept_encoding, AVAILABLE)
+            if enc == IDENTITY:
+                enc = None
+            _add_vary(headers, "Accept-Encoding")
+
+        etag = None
+        if self.method == "GET" and start["status"] == 200:
+            etag = headers.get("etag") or (strong_etag(body) if body else None)
+            if etag and enc:
+                etag = variant_etag(etag, enc)
+            if etag and etag_matches(self.if_none_match, etag):
+                await self._not_modified(headers, etag)
+                return
+
+        if enc:
+            body = compress(body, enc)
+            headers["Content-Encoding"] = enc
+            headers["Content-Length"] = str(len(body))
+        if etag:
+            headers["ETag"] = etag
+
+        await self._send(start)
+        await self._send({"type": "http.response.body", "body": body, "more_body": False})
+
+    async def _not_modified(self, headers: MutableHeaders, etag: str) -> None:
+        kept = [
+            (k, v) for k, v in headers.raw
+            if k.decode("latin-1").lower() in NOT_MODIFIED_HEADERS and k.lower() != b"etag"
+        ]
+        kept.append((b"etag", etag.encode("latin-1")))
+        await self._send({"type": "http.response.start", "status": 304, "headers": kept})
+        await self._send({"type": "http.response.body", "body": b"", "more_body": False})
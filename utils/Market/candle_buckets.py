@@ -0,0 +1,139 @@
+# utils/Market/candle_buckets.py
+
+"""
+Time-bucketed OHLC helpers (server-side downsampling).
+
+Buckets are anchored at the NSE session open (09:15 IST) of each trade_date,
+so a bucket never spans two sessions and 5m / 15m / 30m / 60m buckets line
+up with the usual exchange candles (09:15, 09:45, ...).
+
+  open  = first non-null open in bucket
+  high  = max(high)            <- extremes preserved
+  low   = min(low)
+  close = last non-null close
+  last  = last non-null last_price
+  volume = sum(volume)
+"""
+
+import math
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+IST = ZoneInfo("Asia/Kolkata")
+
+SESSION_OPEN_IST = "09:15"
+SESSION_MINUTES = 375  # 09:15 -> 15:30
+
+
+def first_of(col: str, order_col: str = "interval_start") -> str:
+    return f"(array_agg({col} ORDER BY {order_col} ASC) FILTER (WHERE {col} IS NOT NULL))[1] AS {col}"
+
+
+def last_of(col: str, order_col: str = "interval_start") -> str:
+    return f"(array_agg({col} ORDER BY {order_col} DESC) FILTER (WHERE {col} IS NOT NULL))[1] AS {col}"
+
+
+def ohlc_aggs(order_col: str = "interval_start") -> Tuple[str, ...]:
+    return (
+        first_of("open_price", order_col),
+        "max(high_price) AS high_price",
+        "min(low_price) AS low_price",
+        last_of("close_price", order_col),
+        last_of("last_price", order_col),
+        "sum(volume) AS volume",
+    )
+
+
+OHLC_AGGS = ohlc_aggs()
+
+
+def session_open_sql(trade_date_col: str = "trade_date") -> str:
+    """SQL expr: session open (timestamptz) for a trade_date column."""
+    return f"(({trade_date_col} + time '{SESSION_OPEN_IST}') AT TIME ZONE 'Asia/Kolkata')"
+
+
+def bucket_start_sql(minutes_param: str = ":bucket_min", ts_col: str = "interval_start") -> str:
+    """SQL expr: start of the session-anchored bucket containing ts_col."""
+    so = session_open_sql()
+    return (
+        f"({so} + floor(extract(epoch FROM ({ts_col} - {so})) / ({minutes_param} * 60))"
+        f" * ({minutes_param} * interval '1 minute'))"
+    )
+
+
+def bucketed_ohlc_sql(table: str, key_col: str, extra_aggs: Iterable[str] = ()) -> TextClause:
+    """
+    Bucketed OHLC for ONE series of `table` (nse_cm_intraday_1min / nse_cm_indices_1min).
+
+    Binds: :key, :from_date, :to_date, :from_ts, :to_ts, :bucket_min, :limit
+    Columns: bucket_start, trade_date, open_price, high_price, low_price,
+             close_price, last_price, volume, bars, <extra_aggs...>
+    """
+    aggs = ",\n  ".join((*OHLC_AGGS, *extra_aggs))
+    return text(f"""
+SELECT
+  {bucket_start_sql()} AS bucket_start,
+  trade_date,
+  {aggs},
+  count(*) AS bars
+FROM {table}
+WHERE {key_col} = :key
+  AND trade_date >= :from_date
+  AND trade_date <= :to_date
+  AND interval_start >= :from_ts
+  AND interval_start <= :to_ts
+GROUP BY trade_date, bucket_start
+ORDER BY bucket_start ASC
+LIMIT :limit
+""")
+
+
+def bucket_minutes(
+    from_ts: datetime,
+    to_ts: datetime,
+    max_points: Optional[int],
+    resolution: Optional[int] = None,
+) -> int:
+    """
+    Bucket width (minutes) so that [from_ts, to_ts] yields <= max_points candles.
+    Explicit `resolution` wins. 1 => no downsampling needed.
+    """
+    if resolution:
+        return max(1, min(int(resolution), SESSION_MINUTES))
+    if not max_points:
+        return 1
+
+    days = (to_ts.date() - from_ts.date()).days + 1
+    wall_minutes = (to_ts - from_ts).total_seconds() / 60.0
+    est_bars = max(1.0, min(wall_minutes, days * SESSION_MINUTES))
+
+    return max(1, min(math.ceil(est_bars / int(max_points)), SESSION_MINUTES))
+
+
+def session_open(trade_date: date) -> datetime:
+    h, m = (int(x) for x in SESSION_OPEN_IST.split(":"))
+    return datetime.combine(trade_date, time(h, m), tzinfo=IST)
+
+
+def floor_to_bucket(ts: datetime, trade_date: date, minutes: int) -> datetime:
+    """Python twin of bucket_start_sql()."""
+    so = session_open(trade_date)
+    n = math.floor((ts - so).total_seconds() / (minutes * 60))
+    return so + timedelta(minutes=n * minutes)
+
+
+def bucket_params(key: int, from_ts: datetime, to_ts: datetime, bucket_min: int, limit: int) -> Dict[str, Any]:
+    """Binds for bucketed_ohlc_sql(); trade_date bounds are IST dates (index friendly)."""
+    return {
+        "key": int(key),
+        "from_date": from_ts.astimezone(IST).date(),
+        "to_date": to_ts.astimezone(IST).date(),
+        "from_ts": from_ts,
+        "to_ts": to_ts,
+        "bucket_min": int(bucket_min),
+        "limit": int(limit),
+    }
@@ -0,0 +1,101 @@
+# utils/Market/candle_encoding.py
+
+"""
+Candle response encodings for chart clients.
+
+Input everywhere is a list of candle tuples:
+    (t, o, h, l, c, v, source)      t = datetime (intraday) | date (1d / 1w / 1M)
+
+format=json      -> [{"t","o","h","l","c","v","source"}, ...]   (legacy shape)
+format=columnar  -> {"t":[epoch..], "o":[..], "h":[..], "l":[..], "c":[..], "v":[..]}
+format=binary    -> application/octet-stream, little-endian:
+
+    header  : b"CNDL" | u8 version | u8 reserved x3 | u32 count
+    t       : int64[count]    epoch seconds (UTC)
+    o,h,l,c : float32[count]  NaN = missing
+    v       : int64[count]    -1  = missing
+
+Daily / weekly / monthly candles are stamped at 00:00 UTC of their date
+(the usual convention for date-only bars in chart libraries).
+"""
+
+import struct
+import sys
+from array import array
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+Candle = Tuple[Any, Optional[float], Optional[float], Optional[float], Optional[float], Optional[int], str]
+
+FORMAT_JSON = "json"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_BINARY = "binary"
+FORMATS = (FORMAT_JSON, FORMAT_COLUMNAR, FORMAT_BINARY)
+
+BINARY_MAGIC = b"CNDL"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sB3xI")
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+_NAN = float("nan")
+_LITTLE = sys.byteorder == "little"
+
+
+def epoch(t: Any) -> int:
+    if isinstance(t, datetime):
+        return int(t.timestamp())
+    if isinstance(t, date):
+        return int(datetime(t.year, t.month, t.day, tzinfo=timezone.utc).timestamp())
+    raise TypeError(f"unsupported candle time: {t!r}")
+
+
+def to_json_rows(candles: Sequence[Candle]) -> List[Dict[str, Any]]:
+    return [
+        {"t": t.isoformat(), "o": o, "h": h, "l": l, "c": c, "v": v, "source": src}
+        for (t, o, h, l, c, v, src) in candles
+    ]
+
+
+def to_columnar(candles: Sequence[Candle]) -> Dict[str, list]:
+    if not candles:
+        return {"t": [], "o": [], "h": [], "l": [], "c": [], "v": []}
+    t, o, h, l, c, v, _src = zip(*candles)
+    return {
+        "t": [epoch(x) for x in t],
+        "o": list(o),
+        "h": list(h),
+        "l": list(l),
+        "c": list(c),
+        "v": list(v),
+    }
+
+
+def _f32(values) -> bytes:
+    arr = array("f", (_NAN if x is None else x for x in values))
+    if not _LITTLE:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _i64(values, missing: int = -1) -> bytes:
+    arr = array("q", (missing if x is None else x for x in values))
+    if not _LITTLE:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def to_binary(candles: Sequence[Candle]) -> bytes:
+    n = len(candles)
+    head = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, n)
+    if not n:
+        return head
+    t, o, h, l, c, v, _src = zip(*candles)
+    return b"".join((
+        head,
+        _i64(epoch(x) for x in t),
+        _f32(o),
+        _f32(h),
+        _f32(l),
+        _f32(c),
+        _i64(v),
+    ))
@@ -0,0 +1,276 @@
+# utils/Market/candle_rollups.py
+
+"""
+Stored candle rollups (nse_cm_candle_rollup).
+
+Intraday levels are built hierarchically, each from the next finer level,
+so a refresh after one CM30 seq only re-reads a handful of rows per token:
+
+    1m (nse_cm_intraday_1min) -> 5m -> 15m -> 30m -> 1h
+
+Weekly / monthly bars are folded from bhavcopy after each EOD load.
+
+Every intraday refresh / rebuild also stamps nse_cm_rollup_watermark with
+the day's newest ingested CM30_MKT seq, in the same transaction. Readers
+trust a day's rollups only while that watermark matches the ingestion log.
+
+All intraday buckets are anchored at 09:15 IST (see candle_buckets), weekly /
+monthly buckets at 09:15 IST of the first calendar day of the ISO week / month.
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from utils.Market.candle_buckets import (
+    IST,
+    bucket_start_sql,
+    floor_to_bucket,
+    ohlc_aggs,
+    session_open,
+)
+
+# resolution -> (minutes, source resolution or None for 1m base table)
+INTRADAY_LEVELS: Dict[str, Tuple[int, Optional[str]]] = {
+    "5m": (5, None),
+    "15m": (15, "5m"),
+    "30m": (30, "15m"),
+    "1h": (60, "30m"),
+}
+
+# resolution -> date_trunc unit
+PERIOD_LEVELS: Dict[str, str] = {
+    "1w": "week",
+    "1M": "month",
+}
+
+_UPSERT_TAIL = """
+ON CONFLICT ON CONSTRAINT uq_candle_rollup_token_res_bucket DO UPDATE SET
+  trade_date  = EXCLUDED.trade_date,
+  open_price  = EXCLUDED.open_price,
+  high_price  = EXCLUDED.high_price,
+  low_price   = EXCLUDED.low_price,
+  close_price = EXCLUDED.close_price,
+  last_price  = EXCLUDED.last_price,
+  volume      = EXCLUDED.volume,
+  bars        = EXCLUDED.bars,
+  updated_at  = now()
+"""
+
+_AGG_SELECT = """
+SELECT
+  token_id,
+  :res AS resolution,
+  b_start AS bucket_start,
+  min(trade_date) AS trade_date,
+  {aggs},
+  sum(bars) AS bars
+FROM src
+GROUP BY token_id, b_start
+"""
+
+_INSERT_HEAD = """
+INSERT INTO nse_cm_candle_rollup
+  (token_id, resolution, bucket_start, trade_date,
+   open_price, high_price, low_price, close_price, last_price, volume, bars)
+"""
+
+
+def _intraday_refresh_sql(minutes: int, source: Optional[str]):
+    if source is None:
+        src = f"""
+WITH src AS (
+  SELECT token_id, trade_date, interval_start AS ts,
+         {bucket_start_sql(str(minutes))} AS b_start,
+         open_price, high_price, low_price, close_price, last_price, volume, 1 AS bars
+  FROM nse_cm_intraday_1min
+  WHERE trade_date = :td
+    AND interval_start >= :since
+)"""
+    else:
+        src = f"""
+WITH src AS (
+  SELECT token_id, trade_date, bucket_start AS ts,
+         {bucket_start_sql(str(minutes), ts_col="bucket_start")} AS b_start,
+         open_price, high_price, low_price, close_price, last_price, volume, bars
+  FROM nse_cm_candle_rollup
+  WHERE resolution = '{source}'
+    AND trade_date = :td
+    AND bucket_start >= :since
+)"""
+    aggs = ",\n  ".join(ohlc_aggs("ts"))
+    return text(src + _INSERT_HEAD + _AGG_SELECT.format(aggs=aggs) + _UPSERT_TAIL)
+
+
+_INTRADAY_SQL = {
+    res: _intraday_refresh_sql(minutes, source)
+    for res, (minutes, source) in INTRADAY_LEVELS.items()
+}
+
+
+def _period_refresh_sql():
+    aggs = ",\n  ".join(ohlc_aggs("ts"))
+    src = """
+WITH src AS (
+  SELECT token_id, trade_date, trade_date AS ts,
+         ((date_trunc(:unit, trade_date::timestamp)::date + time '09:15') AT TIME ZONE 'Asia/Kolkata') AS b_start,
+         open_price, high_price, low_price, close_price, last_price,
+         total_traded_qty AS volume, 1 AS bars
+  FROM nse_cm_bhavcopy
+  WHERE token_id IS NOT NULL
+    AND trade_date >= :since
+    AND trade_date <= :until
+)"""
+    return text(src + _INSERT_HEAD + _AGG_SELECT.format(aggs=aggs) + _UPSERT_TAIL)
+
+
+_PERIOD_SQL = _period_refresh_sql()
+
+
+def period_start(d: date, resolution: str) -> date:
+    """Python twin of date_trunc('week' | 'month', d)."""
+    if PERIOD_LEVELS[resolution] == "week":
+        return d - timedelta(days=d.weekday())
+    return d.replace(day=1)
+
+
+# ======================================================================
+#  Refresh (ingestion)
+# ======================================================================
+
+_WATERMARK_SQL = text("""
+INSERT INTO nse_cm_rollup_watermark (trade_date, seq)
+SELECT :td, max(seq)
+FROM nse_ingestion_log
+WHERE trade_date = :td
+  AND segment = 'CM30_MKT'
+HAVING max(seq) IS NOT NULL
+ON CONFLICT (trade_date) DO UPDATE SET
+  seq        = EXCLUDED.seq,
+  updated_at = now()
+""")
+
+
+def mark_intraday_rollups(db: Session, trade_date: date) -> None:
+    """
+    Record that trade_date's rollups hold every seq ingested so far. Only
+    call it when that is true (after a rebuild, or a refresh that followed
+    an unbroken chain of refreshes). Caller commits.
+    """
+    db.execute(_WATERMARK_SQL, {"td": trade_date})
+
+
+def refresh_intraday_rollups(db: Session, trade_date: date, since: datetime) -> None:
+    """
+    Recompute every intraday bucket of trade_date that starts at/after the
+    bucket containing `since` (earliest bar just ingested). Caller commits.
+    """
+    for res, (minutes, _source) in INTRADAY_LEVELS.items():
+        db.execute(
+            _INTRADAY_SQL[res],
+            {"res": res, "td": trade_date, "since": floor_to_bucket(since, trade_date, minutes)},
+        )
+    mark_intraday_rollups(db, trade_date)
+
+
+def rebuild_intraday_rollups(db: Session, trade_date: date) -> None:
+    """Full-day rebuild (first run of the process / backfill). Caller commits."""
+    day_start = datetime.combine(trade_date, time.min, tzinfo=IST)
+    for res in INTRADAY_LEVELS:
+        db.execute(_INTRADAY_SQL[res], {"res": res, "td": trade_date, "since": day_start})
+    mark_intraday_rollups(db, trade_date)
+
+
+def refresh_period_rollups(db: Session, trade_date: date, since: Optional[date] = None) -> None:
+    """
+    Recompute the week / month containing trade_date (or every period from
+    `since` for a backfill). Caller commits.
+    """
+    for res, unit in PERIOD_LEVELS.items():
+        start = period_start(since or trade_date, res)
+        db.execute(
+            _PERIOD_SQL,
+            {"res": res, "unit": unit, "since": start, "until": trade_date},
+        )
+
+
+# ======================================================================
+#  Read path (routes)
+# ======================================================================
+
+def _read_sql(bucket_expr: str):
+    aggs = ",\n  ".join(ohlc_aggs("ts"))
+    return text(f"""
+WITH src AS (
+  SELECT trade_date, bucket_start AS ts, {bucket_expr} AS b_start,
+         open_price, high_price, low_price, close_price, last_price, volume, bars
+  FROM nse_cm_candle_rollup
+  WHERE token_id = :key
+    AND resolution = :res
+    AND bucket_start >= :from_ts
+    AND bucket_start <= :to_ts
+)
+SELECT
+  b_start AS bucket_start,
+  min(trade_date) AS trade_date,
+  {aggs},
+  sum(bars) AS bars
+FROM src
+GROUP BY b_start
+ORDER BY b_start ASC
+LIMIT :limit
+""")
+
+
+# intraday: re-bucket stored rows to :bucket_min (multiple of :res minutes)
+ROLLUP_INTRADAY_READ_SQL = _read_sql(bucket_start_sql(ts_col="bucket_start"))
+
+# weekly / monthly: rows as stored
+ROLLUP_PERIOD_READ_SQL = _read_sql("bucket_start")
+
+
+# days in range whose rollups lag the ingestion log (no watermark or an older seq)
+_STALE_DAYS_SQL = text("""
+SELECT count(*)
+FROM (
+  SELECT trade_date, max(seq) AS seq
+  FROM nse_ingestion_log
+  WHERE segment = 'CM30_MKT'
+    AND trade_date >= :from_date
+    AND trade_date <= :to_date
+  GROUP BY trade_date
+) l
+LEFT JOIN nse_cm_rollup_watermark w ON w.trade_date = l.trade_date
+WHERE w.seq IS NULL OR w.seq < l.seq
+""")
+
+
+def intraday_rollup_complete(db: Session, rows: Sequence[Any], from_ts: datetime, to_ts: datetime) -> bool:
+    """
+    True when ROLLUP_INTRADAY_READ_SQL `rows` can be served as is: every
+    trade_date in the window has its rollup watermark at the newest ingested
+    seq. Days not backfilled yet or a failed refresh leave the watermark
+    behind; callers then aggregate 1m. Reads only the small ingestion log.
+    """
+    if not rows:
+        return False
+    stale = db.execute(
+        _STALE_DAYS_SQL,
+        {"from_date": from_ts.astimezone(IST).date(), "to_date": to_ts.astimezone(IST).date()},
+    ).scalar()
+    return not stale
+
+
+def pick_intraday_level(minutes: int) -> Optional[str]:
+    """Coarsest stored resolution whose width divides `minutes` (None => 1m base)."""
+    best = None
+    for res, (width, _source) in INTRADAY_LEVELS.items():
+        if minutes % width == 0 and (best is None or width > INTRADAY_LEVELS[best][0]):
+            best = res
+    return best
+
+
+def period_bucket_ts(d: date, resolution: str) -> datetime:
+    return session_open(period_start(d, resolution))
@@ -0,0 +1,86 @@
+# utils/Market/content_encoding.py
+
+"""
+gzip / br helpers for pre-encoded response bodies.
+
+Bodies are compressed ONCE (at ingestion / cache-fill time) and served
+as-is; request handlers only pick the variant the client accepts.
+brotli is optional: without it only gzip + identity are produced.
+"""
+
+import gzip
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BR = "br"
+
+# server preference when the client accepts several with equal q
+PREFERENCE = (BR, GZIP, IDENTITY)
+
+GZIP_LEVEL = 6
+BR_QUALITY = 5
+
+
+# encodings this process can actually produce
+AVAILABLE = (BR, GZIP, IDENTITY) if brotli is not None else (GZIP, IDENTITY)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == GZIP:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == BR and brotli is not None:
+        return brotli.compress(body, quality=BR_QUALITY)
+    if encoding == IDENTITY:
+        return body
+    raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def encode_variants(body: bytes) -> Dict[str, bytes]:
+    return {enc: compress(body, enc) for enc in AVAILABLE}
+
+
+def _accepted(accept_encoding: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[token] = q
+    return out
+
+
+def acceptable(accept_encoding: str, available: Iterable[str] = PREFERENCE) -> List[str]:
+    """Encodings out of `available` the client accepts, best first."""
+    accepted = _accepted(accept_encoding)
+    star = accepted.get("*")
+    ranked = []
+    for rank, enc in enumerate(PREFERENCE):
+        if enc not in available:
+            continue
+        q = accepted.get(enc, star if star is not None else (1.0 if enc == IDENTITY else 0.0))
+        if q > 0:
+            ranked.append((-q, rank, enc))
+    return [enc for _, _, enc in sorted(ranked)]
+
+
+def negotiate(accept_encoding: str, available: Iterable[str] = PREFERENCE) -> Optional[str]:
+    """
+    Best encoding out of `available` for an Accept-Encoding header
+    (None only if identity is explicitly refused and nothing else fits).
+    """
+    ranked = acceptable(accept_encoding, available)
+    return ranked[0] if ranked else None
@@ -0,0 +1,584 @@
+# utils/Market/intraday_store.py
+
+"""
+Per-worker in-memory store of TODAY's 1-minute bars (CM tokens + indices).
+
+Each worker keeps one preallocated NumPy block per kind:
+
+    rows  = one per token / index (allocated on first sight, grown in blocks)
+    cols  = one per minute of the day grid (09:00 -> 16:00 IST, SLOTS)
+    o/h/l/c/last : float64 (NaN = missing)    v : int64 (-1 = missing)
+
+When the trade_date rolls over, the same arrays are wiped and reused.
+
+Feed:
+  - ingestion publishes ONE compact binary message per committed CM30 seq
+    (publish_seq) on pub:intraday:<kind>; every worker applies it in place
+  - on startup / pubsub reconnect / new trade_date / seq gap the day is
+    backfilled from Postgres once (one query per kind); a gap seen while
+    that load runs marks it stale, so it loads again before the kind is
+    trusted
+
+Wire format (little-endian):
+    header  : b"IDAY" | u8 version | 3x pad | u32 yyyymmdd | i32 seq
+    records : RECORD[n]  (id i4, t i8 epoch seconds, o h l c last f8, v i8; n may be 0)
+
+Readers only trust a kind once its backfill has completed for the asked
+trade_date (ready()); everything else returns None and callers keep their
+DB / Redis path.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from db.connection import SessionLocal
+from db.redis_pool import get_async_pubsub_redis, get_sync_redis
+from utils.Market.candle_buckets import IST
+from utils.Market.sparkline_store import (
+    KIND_CM,
+    KIND_IND,
+    SAMPLE_POINTS,
+    safe_sample_points as _redis_sample_points,
+    sample_indexes,
+)
+
+logger = logging.getLogger(__name__)
+
+INTRADAY_STORE_ENABLED = os.getenv("INTRADAY_STORE_ENABLED", "true").lower() in ("1", "true", "yes", "y")
+
+CHANNEL_PREFIX = "pub:intraday:"
+KINDS = (KIND_CM, KIND_IND)
+SEGMENTS = {KIND_CM: "CM30_MKT", KIND_IND: "CM30_IND"}
+
+GRID_OPEN_IST = time(9, 0)   # pre-open included
+SLOTS = 7 * 60               # 09:00 -> 16:00
+ROW_BLOCK = 256
+
+HEADER = struct.Struct("<4sB3xIi")
+MAGIC = b"IDAY"
+VERSION = 1
+
+RECORD = np.dtype([
+    ("id", "<i4"),
+    ("t", "<i8"),
+    ("o", "<f8"),
+    ("h", "<f8"),
+    ("l", "<f8"),
+    ("c", "<f8"),
+    ("last", "<f8"),
+    ("v", "<i8"),
+])
+
+_PRICE_FIELDS = ("o", "h", "l", "c", "last")
+
+# ORM attribute -> record field (NseCmIntraday1Min and NseCmIndex1Min share these)
+_ATTRS = {
+    "o": "open_price",
+    "h": "high_price",
+    "l": "low_price",
+    "c": "close_price",
+    "last": "last_price",
+    "v": "volume",
+}
+
+
+def _grid_open_epoch(trade_date: date) -> int:
+    return int(datetime.combine(trade_date, GRID_OPEN_IST, tzinfo=IST).timestamp())
+
+
+def _nf(x) -> Optional[float]:
+    return None if x is None or x != x else float(x)
+
+
+# ======================================================================
+#  Wire format (ingestion -> workers)
+# ======================================================================
+
+def records_from_rows(rows: Iterable[Any], id_attr: str) -> np.ndarray:
+    """ORM bars of one seq -> RECORD array (rows without id / timestamp are dropped)."""
+    items = []
+    for r in rows:
+        ident = getattr(r, id_attr, None)
+        ts = getattr(r, "interval_start", None)
+        if ident is None or ts is None:
+            continue
+        vals = []
+        for f in _PRICE_FIELDS:
+            x = getattr(r, _ATTRS[f], None)
+            vals.append(np.nan if x is None else float(x))
+        v = getattr(r, _ATTRS["v"], None)
+        items.append((int(ident), int(ts.timestamp()), *vals, -1 if v is None else int(v)))
+    return np.array(items, dtype=RECORD)
+
+
+def pack_seq(trade_date: date, seq: int, records: np.ndarray) -> bytes:
+    yyyymmdd = trade_date.year * 10000 + trade_date.month * 100 + trade_date.day
+    return HEADER.pack(MAGIC, VERSION, yyyymmdd, int(seq)) + records.astype(RECORD, copy=False).tobytes()
+
+
+def unpack_seq(buf: bytes) -> Tuple[date, int, np.ndarray]:
+    magic, version, yyyymmdd, seq = HEADER.unpack_from(buf)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"bad intraday message header {magic!r} v{version}")
+    td = date(yyyymmdd // 10000, yyyymmdd // 100 % 100, yyyymmdd % 100)
+    return td, seq, np.frombuffer(buf, dtype=RECORD, offset=HEADER.size)
+
+
+def publish_seq(kind: str, trade_date: date, seq: int, rows: Iterable[Any], id_attr: str) -> int:
+    """
+    Ingestion side: broadcast this seq's bars to every worker. Returns receivers.
+    A seq without bars still goes out (header only) so workers advance their
+    seq instead of taking the next one for a gap and reloading the day.
+    """
+    records = records_from_rows(rows, id_attr)
+    return int(get_sync_redis(decode=False).publish(CHANNEL_PREFIX + kind, pack_seq(trade_date, seq, records)))
+
+
+# ======================================================================
+#  Buffer (one per kind)
+# ======================================================================
+
+class IntradayBuffer:
+    def __init__(self, kind: str, capacity: int = ROW_BLOCK):
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.trade_date: Optional[date] = None
+        self.seq: Optional[int] = None
+        self.complete = False
+        self.rows: Dict[int, int] = {}
+        self.out_of_grid = 0
+        self._open_epoch = 0
+        self._alloc(max(ROW_BLOCK, capacity))
+
+    def _alloc(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.prices = {f: np.full((capacity, SLOTS), np.nan) for f in _PRICE_FIELDS}
+        self.v = np.full((capacity, SLOTS), -1, dtype=np.int64)
+        self.filled = np.zeros((capacity, SLOTS), dtype=bool)
+
+    def _grow(self, need: int) -> None:
+        old_cap, prices, v, filled = self.capacity, self.prices, self.v, self.filled
+        self._alloc(((need // ROW_BLOCK) + 1) * ROW_BLOCK)
+        for f in _PRICE_FIELDS:
+            self.prices[f][:old_cap] = prices[f]
+        self.v[:old_cap] = v
+        self.filled[:old_cap] = filled
+
+    def reset(self, trade_date: date) -> None:
+        """New session: wipe and reuse the same arrays (caller holds lock)."""
+        n = len(self.rows)
+        for f in _PRICE_FIELDS:
+            self.prices[f][:n] = np.nan
+        self.v[:n] = -1
+        self.filled[:n] = False
+        self.rows.clear()
+        self.trade_date = trade_date
+        self.seq = None
+        self.complete = False
+        self.out_of_grid = 0
+        self._open_epoch = _grid_open_epoch(trade_date)
+
+    def _row_indexes(self, ids: np.ndarray) -> np.ndarray:
+        rows = self.rows
+        for ident in np.unique(ids).tolist():
+            if ident not in rows:
+                rows[ident] = len(rows)
+        if len(rows) > self.capacity:
+            self._grow(len(rows))
+        return np.fromiter((rows[i] for i in ids.tolist()), dtype=np.int64, count=len(ids))
+
+    def write(self, records: np.ndarray) -> int:
+        """Apply RECORD rows for self.trade_date (caller holds lock). Same (id, minute) overwrites."""
+        if not len(records):
+            return 0
+        slots = (records["t"] - self._open_epoch) // 60
+        ok = (slots >= 0) & (slots < SLOTS)
+        if not ok.all():
+            # outside 09:00-16:00: readers must not treat the grid as complete for these
+            self.out_of_grid += int((~ok).sum())
+            records, slots = records[ok], slots[ok]
+            if not len(records):
+                return 0
+        r = self._row_indexes(records["id"])
+        for f in _PRICE_FIELDS:
+            self.prices[f][r, slots] = records[f]
+        self.v[r, slots] = records["v"]
+        self.filled[r, slots] = True
+        return len(records)
+
+    # ---------------- reads (caller holds lock) ----------------
+    def row_slice(self, ident: int, lo: int = 0, hi: int = SLOTS):
+        row = self.rows.get(int(ident))
+        if row is None:
+            return None, None
+        idx = np.flatnonzero(self.filled[row, lo:hi]) + lo
+        return row, idx
+
+    def slot_time(self, slot: int) -> datetime:
+        return datetime.fromtimestamp(self._open_epoch + 60 * int(slot), tz=timezone.utc)
+
+    def slot_of(self, ts: datetime, ceil: bool = False) -> int:
+        """Minute slot containing ts (ceil=True: first slot starting at or after ts)."""
+        delta = ts.timestamp() - self._open_epoch
+        return -int(-delta // 60) if ceil else int(delta // 60)
+
+
+class IntradayStore:
+    def __init__(self):
+        self.buffers: Dict[str, IntradayBuffer] = {
+            KIND_CM: IntradayBuffer(KIND_CM, capacity=int(os.getenv("INTRADAY_STORE_CM_ROWS", "2560"))),
+            KIND_IND: IntradayBuffer(KIND_IND, capacity=ROW_BLOCK),
+        }
+        self._task: Optional[asyncio.Task] = None
+        self._backfills: Dict[str, asyncio.Task] = {}
+        # kind -> a resync was asked for while its backfill was already loading
+        self._resync: Dict[str, bool] = {}
+
+        # metrics
+        self.messages_in = 0
+        self.records_in = 0
+        self.bad_messages = 0
+        self.gaps = 0
+        self.backfills = 0
+        self.backfill_reruns = 0
+        self.reconnects = 0
+
+    # ---------------- lifecycle ----------------
+    def start(self) -> None:
+        if not INTRADAY_STORE_ENABLED:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._backfills.values()) if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._backfills.clear()
+
+    async def _listen(self) -> None:
+        backoff = 0.5
+        while True:
+            pubsub = get_async_pubsub_redis(decode=False).pubsub()
+            try:
+                await pubsub.subscribe(*(CHANNEL_PREFIX + k for k in KINDS))
+                logger.info(f"[INTRADAY] subscribed {CHANNEL_PREFIX}{{{','.join(KINDS)}}}")
+                backoff = 0.5
+                # anything published while we were not subscribed is only in the DB
+                for kind in KINDS:
+                    self._schedule_backfill(kind, None)
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    channel = msg["channel"].decode() if isinstance(msg["channel"], bytes) else msg["channel"]
+                    self._apply(channel[len(CHANNEL_PREFIX):], msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.warning(f"[INTRADAY] pubsub error, reconnecting in {backoff:.1f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def _apply(self, kind: str, data: bytes) -> None:
+        buf = self.buffers.get(kind)
+        if buf is None:
+            return
+        try:
+            td, seq, records = unpack_seq(data)
+        except Exception as e:
+            self.bad_messages += 1
+            logger.warning(f"[INTRADAY] bad message on {kind}: {e}")
+            return
+
+        self.messages_in += 1
+        self.records_in += len(records)
+        with buf.lock:
+            if buf.trade_date is None or td > buf.trade_date:
+                buf.reset(td)
+                self._schedule_backfill(kind, td)
+            elif td < buf.trade_date:
+                return  # late replay of an older session
+            elif buf.seq is not None and seq > buf.seq + 1:
+                # a seq never reached this worker (or failed upstream): resync
+                self.gaps += 1
+                buf.complete = False
+                self._schedule_backfill(kind, td)
+            buf.write(records)
+            if buf.seq is None or seq > buf.seq:
+                buf.seq = seq
+
+    # ---------------- backfill ----------------
+    def _schedule_backfill(self, kind: str, trade_date: Optional[date]) -> None:
+        running = self._backfills.get(kind)
+        if running is not None and not running.done():
+            # it may have read the day before the missed seq was committed
+            self._resync[kind] = True
+            return
+        self._backfills[kind] = asyncio.create_task(self._backfill(kind, trade_date))
+
+    async def _backfill(self, kind: str, trade_date: Optional[date]) -> None:
+        buf = self.buffers[kind]
+        while True:
+            self._resync[kind] = False
+            try:
+                td, seq, records = await asyncio.to_thread(_load_day, kind, trade_date)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[INTRADAY] backfill failed ({kind} {trade_date}): {e}")
+                td = None
+
+            if td is not None:
+                with buf.lock:
+                    if buf.trade_date is None or td > buf.trade_date:
+                        buf.reset(td)
+                    if td == buf.trade_date:  # else a newer session started while loading
+                        buf.write(records)
+                        if seq is not None and (buf.seq is None or seq > buf.seq):
+                            buf.seq = seq
+                        # only a load no gap raced with covers every seq
+                        buf.complete = not self._resync[kind]
+                        if buf.complete:
+                            self.backfills += 1
+                            logger.info(f"[INTRADAY] ✅ backfilled {kind} {td}: {len(records)} bars, {len(buf.rows)} ids")
+                            return
+
+            if not self._resync[kind]:
+                return
+            # a gap / new session arrived during this load: read the day again
+            self.backfill_reruns += 1
+            trade_date = buf.trade_date
+
+    # ---------------- reads (sync; routes run them in the threadpool) ----------------
+    def ready(self, kind: str, trade_date: Optional[date]) -> bool:
+        buf = self.buffers.get(kind)
+        return (
+            buf is not None
+            and trade_date is not None
+            and buf.complete
+            and buf.trade_date == trade_date
+            and buf.out_of_grid == 0
+        )
+
+    def rows_1m(
+        self,
+        kind: str,
+        ident: int,
+        trade_date: date,
+        from_ts: Optional[datetime] = None,
+        to_ts: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> Optional[List[Tuple]]:
+        """
+        [(interval_start, o, h, l, c, v)] ascending, same shape as the DB
+        projection in Historical_data (_INTRADAY_COLS). None => not in memory.
+        """
+        if not self.ready(kind, trade_date):
+            return None
+        buf = self.buffers[kind]
+        with buf.lock:
+            if not self.ready(kind, trade_date):
+                return None
+            # slots with from_ts <= interval_start <= to_ts
+            lo = 0 if from_ts is None else max(0, buf.slot_of(from_ts, ceil=True))
+            hi = SLOTS if to_ts is None else min(SLOTS, buf.slot_of(to_ts) + 1)
+            row, idx = buf.row_slice(ident, lo, max(lo, hi))
+            if row is None:
+                return []
+            if limit is not None:
+                idx = idx[:limit]
+            o, h, l, c = (buf.prices[f][row, idx] for f in ("o", "h", "l", "c"))
+            v = buf.v[row, idx]
+            times = [buf.slot_time(s) for s in idx.tolist()]
+
+        return [
+            (t, _nf(oo), _nf(hh), _nf(ll), _nf(cc), None if vv < 0 else int(vv))
+            for t, oo, hh, ll, cc, vv in zip(times, o.tolist(), h.tolist(), l.tolist(), c.tolist(), v.tolist())
+        ]
+
+    def day_ohlcv(self, kind: str, ident: int, trade_date: date):
+        """
+        (o, h, l, c, v) of the whole day for ident, vectorized over the row.
+        None => not in memory ; False => in memory but no bars today.
+        Same rules as Historical_data._aggregate_intraday_to_daily.
+        """
+        if not self.ready(kind, trade_date):
+            return None
+        buf = self.buffers[kind]
+        with buf.lock:
+            row, idx = buf.row_slice(ident)
+            if row is None or not len(idx):
+                return False
+            o = buf.prices["o"][row, idx[0]]
+            c = buf.prices["c"][row, idx[-1]]
+            highs = buf.prices["h"][row, idx]
+            lows = buf.prices["l"][row, idx]
+            vols = buf.v[row, idx]
+
+        h = float(np.nanmax(highs)) if not np.isnan(highs).all() else None
+        l = float(np.nanmin(lows)) if not np.isnan(lows).all() else None
+        has_v = vols >= 0
+        v = int(vols[has_v].sum()) if has_v.any() else None
+        return _nf(o), h, l, _nf(c), v
+
+    def sample_points(
+        self,
+        kind: str,
+        trade_date: Optional[date],
+        ids: Iterable[int],
+        target: int = SAMPLE_POINTS,
+    ) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Sparkline picks over the day's `last` (close when last is missing),
+        same picks as sparkline_store. Only ids with bars are returned.
+        """
+        if not self.ready(kind, trade_date):
+            return {}
+        buf = self.buffers[kind]
+        out: Dict[int, List[Dict[str, Any]]] = {}
+        with buf.lock:
+            last_all, close_all = buf.prices["last"], buf.prices["c"]
+            for ident in ids:
+                row = buf.rows.get(int(ident))
+                if row is None:
+                    continue
+                price = np.where(np.isnan(last_all[row]), close_all[row], last_all[row])
+                slots = np.flatnonzero(buf.filled[row] & ~np.isnan(price))
+                if not len(slots):
+                    continue
+                picks = slots[sample_indexes(len(slots), target)]
+                out[int(ident)] = [
+                    {"interval_start": buf.slot_time(s).isoformat(), "last": float(price[s])}
+                    for s in picks.tolist()
+                ]
+        return out
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": INTRADAY_STORE_ENABLED,
+            "listening": self._task is not None and not self._task.done(),
+            "messages_in": self.messages_in,
+            "records_in": self.records_in,
+            "bad_messages": self.bad_messages,
+            "gaps": self.gaps,
+            "backfills": self.backfills,
+            "backfill_reruns": self.backfill_reruns,
+            "reconnects": self.reconnects,
+            "kinds": {
+                k: {
+                    "trade_date": str(b.trade_date) if b.trade_date else None,
+                    "seq": b.seq,
+                    "complete": b.complete,
+                    "ids": len(b.rows),
+                    "capacity": b.capacity,
+                    "out_of_grid": b.out_of_grid,
+                    "bytes": int(sum(a.nbytes for a in b.prices.values()) + b.v.nbytes + b.filled.nbytes),
+                }
+                for k, b in self.buffers.items()
+            },
+        }
+
+
+# ======================================================================
+#  DB backfill
+# ======================================================================
+
+_LOAD_SQL = {
+    KIND_CM: """
+        SELECT token_id AS ident, interval_start,
+               open_price::float8, high_price::float8, low_price::float8, close_price::float8,
+               last_price::float8, volume
+        FROM nse_cm_intraday_1min
+        WHERE trade_date = :td
+    """,
+    KIND_IND: """
+        SELECT index_id AS ident, interval_start,
+               open_price::float8, high_price::float8, low_price::float8, close_price::float8,
+               last_price::float8, volume
+        FROM nse_cm_indices_1min
+        WHERE trade_date = :td
+          AND index_id IS NOT NULL
+    """,
+}
+
+_LATEST_TD_SQL = {
+    KIND_CM: "SELECT max(trade_date) FROM nse_cm_intraday_1min WHERE trade_date >= :since",
+    KIND_IND: "SELECT max(trade_date) FROM nse_cm_indices_1min WHERE trade_date >= :since",
+}
+
+_SEQ_SQL = text("""
+    SELECT max(seq) FROM nse_ingestion_log
+    WHERE trade_date = :td AND segment = :segment
+""")
+
+
+def _load_day(kind: str, trade_date: Optional[date]) -> Tuple[Optional[date], Optional[int], np.ndarray]:
+    """(trade_date, last committed seq, RECORD array). trade_date=None => latest session (last 7 days)."""
+    db = SessionLocal()
+    try:
+        # seq first: rows committed after this read are re-sent on pubsub anyway
+        if trade_date is None:
+            since = datetime.now(IST).date() - timedelta(days=7)
+            trade_date = db.execute(text(_LATEST_TD_SQL[kind]), {"since": since}).scalar()
+            if trade_date is None:
+                return None, None, np.empty(0, dtype=RECORD)
+        seq = db.execute(_SEQ_SQL, {"td": trade_date, "segment": SEGMENTS[kind]}).scalar()
+        rows = db.execute(text(_LOAD_SQL[kind]), {"td": trade_date}).all()
+    finally:
+        db.close()
+
+    records = np.array(
+        [
+            (
+                int(ident),
+                int(ts.timestamp()),
+                *(np.nan if x is None else x for x in (o, h, l, c, last)),
+                -1 if v is None else int(v),
+            )
+            for ident, ts, o, h, l, c, last, v in rows
+        ],
+        dtype=RECORD,
+    )
+    return trade_date, seq, records
+
+
+# one store per worker process
+store = IntradayStore()
+
+
+def safe_sample_points(
+    kind: str,
+    trade_date: date,
+    ids: Iterable[int],
+    target: int = SAMPLE_POINTS,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Drop-in for sparkline_store.safe_sample_points: worker memory first,
+    then the Redis buffer for ids memory did not cover. Never raises.
+    """
+    ids = [int(i) for i in ids]
+    try:
+        out = store.sample_points(kind, trade_date, ids, target)
+    except Exception as e:
+        logger.warning(f"[INTRADAY] sample read failed ({kind} {trade_date}): {e}")
+        out = {}
+    rest = [i for i in ids if i not in out]
+    if rest:
+        out.update(_redis_sample_points(kind, trade_date, rest, target))
+    return out
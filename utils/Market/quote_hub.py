@@ -0,0 +1,297 @@
+# utils/Market/quote_hub.py
+
+"""
+In-process fan-out of live CM30 quotes to WebSocket clients.
+
+Ingestion (publish_latest_quotes_by_symbol) publishes one JSON per symbol to
+pub:cm:symbol:<SYM>. Each worker holds ONE psubscribe connection on
+pub:cm:symbol:* and hands every message to the sockets interested in SYM.
+
+Slow clients never block the hub: every client keeps only the LATEST
+payload per symbol (dict keyed by symbol) and a dedicated sender task
+flushes whatever is pending as one frame. Intermediate values a client
+was too slow to receive are dropped and counted (coalesced).
+
+A new subscription is live before its snapshot is read, so no tick falls
+between the two; a symbol that gets a tick while the snapshot is loading
+is left out of that snapshot (the tick is at least as new).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from db.redis_pool import get_async_pubsub_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "pub:cm:symbol:"
+CHANNEL_PATTERN = CHANNEL_PREFIX + "*"
+CACHE_PREFIX = "live:cm:symbol:"
+
+MAX_SYMBOLS_PER_CLIENT = int(os.getenv("WS_MAX_SYMBOLS_PER_CLIENT", "500"))
+SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+_send_timeout = getattr(asyncio, "timeout", None)  # Python 3.11+
+
+# live:cm:symbol:<SYM> hash fields are strings ("" = None); restore types
+_INT_FIELDS = ("token_id", "bid_qty", "ask_qty", "volume", "seq")
+_STR_FIELDS = ("symbol", "ts", "trade_date")
+
+
+def decode_live_hash(raw: Dict[str, str]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for k, v in raw.items():
+        if v == "":
+            out[k] = None
+        elif k in _STR_FIELDS:
+            out[k] = v
+        elif k in _INT_FIELDS:
+            out[k] = int(float(v))
+        else:
+            try:
+                out[k] = float(v)
+            except ValueError:
+                out[k] = v
+    return out
+
+
+async def read_live_quotes(symbols: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    live:cm:symbol:<SYM> hashes for symbols in ONE pipelined round-trip,
+    decoded to typed values. fields -> HMGET of just those fields.
+    Symbols without a (non-empty) hash are absent from the result.
+    """
+    if not symbols:
+        return {}
+    pipe = get_async_redis().pipeline(transaction=False)
+    for s in symbols:
+        if fields:
+            pipe.hmget(CACHE_PREFIX + s, fields)
+        else:
+            pipe.hgetall(CACHE_PREFIX + s)
+    rows = await pipe.execute()
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for s, r in zip(symbols, rows):
+        if fields:
+            if all(v is None for v in r):
+                continue
+            r = {f: v for f, v in zip(fields, r) if v is not None}
+        if r:
+            out[s] = decode_live_hash(r)
+    return out
+
+
+def normalize_symbols(symbols: Union[str, Iterable[Any]]) -> List[str]:
+    """Upper-cased, de-duplicated symbols; a plain string is comma separated."""
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+    out, seen = [], set()
+    for s in symbols or ():
+        sym = str(s).strip().upper()
+        if sym and sym not in seen:
+            seen.add(sym)
+            out.append(sym)
+    return out
+
+
+class QuoteClient:
+    """One connected socket: subscribed symbols + latest-only pending quotes."""
+
+    def __init__(self, send_text: Callable[[str], Awaitable[None]]):
+        self.send_text = send_text
+        self.symbols: Set[str] = set()
+        self.pending: Dict[str, str] = {}
+        # subscribed, snapshot not sent yet and no tick since (snapshot may fill these)
+        self.awaiting_snapshot: Set[str] = set()
+        self.control: List[str] = []
+        self.wakeup = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.closed = False
+
+    def offer(self, symbol: str, raw_json: str) -> bool:
+        """Called by the hub; never awaits. Returns False if an older value was replaced."""
+        pending = self.pending
+        if symbol in pending:
+            self.coalesced += 1
+            pending[symbol] = raw_json
+            return False
+        if not pending:
+            self.wakeup.set()  # only the first quote since the last flush has to wake the sender
+        pending[symbol] = raw_json
+        if self.awaiting_snapshot:
+            self.awaiting_snapshot.discard(symbol)
+        return True
+
+    def push(self, frame: str) -> None:
+        """Control frames (acks / snapshots) go through the sender too: one writer per socket."""
+        self.control.append(frame)
+        self.wakeup.set()
+
+    async def _send(self, frame: str) -> None:
+        if _send_timeout is None:
+            await asyncio.wait_for(self.send_text(frame), timeout=SEND_TIMEOUT_SECONDS)
+            return
+        # 3.11+: a timer on this task instead of wait_for's extra task per frame
+        async with _send_timeout(SEND_TIMEOUT_SECONDS):
+            await self.send_text(frame)
+
+    async def run_sender(self) -> None:
+        while not self.closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.control:
+                frames, self.control = self.control, []
+                for f in frames:
+                    await self._send(f)
+            if not self.pending:
+                continue
+            # payloads are already JSON -> splice, no re-encode. The dict is
+            # cleared, not replaced: a fresh one per flush per client is
+            # long-lived garbage that drives full GC passes during a burst
+            frame = '{"type":"quotes","data":[' + ",".join(self.pending.values()) + "]}"
+            n = len(self.pending)
+            self.pending.clear()
+            await self._send(frame)
+            self.sent += n
+
+
+class QuoteHub:
+    def __init__(self):
+        self.subs: Dict[str, Set[QuoteClient]] = {}
+        self.clients: Set[QuoteClient] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        # metrics
+        self.messages_in = 0
+        self.deliveries = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.reconnects = 0
+        self.last_message_at: Optional[float] = None
+        self.started_at = time.time()
+
+    # ---------------- lifecycle ----------------
+    def ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def _listen(self) -> None:
+        backoff = 0.5
+        while True:
+            pubsub = get_async_pubsub_redis().pubsub()
+            try:
+                await pubsub.psubscribe(CHANNEL_PATTERN)
+                logger.info(f"[WS-HUB] psubscribed {CHANNEL_PATTERN}")
+                backoff = 0.5
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "pmessage":
+                        continue
+                    self._dispatch(msg["channel"], msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.warning(f"[WS-HUB] pubsub error, reconnecting in {backoff:.1f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        self.messages_in += 1
+        self.last_message_at = time.time()
+        symbol = channel[len(CHANNEL_PREFIX):]
+        clients = self.subs.get(symbol)
+        if not clients:
+            return
+        fresh = 0
+        for c in clients:
+            fresh += c.offer(symbol, data)
+        self.deliveries += fresh
+        self.coalesced += len(clients) - fresh
+
+    # ---------------- clients ----------------
+    def register(self, client: QuoteClient) -> None:
+        self.clients.add(client)
+        self.ensure_started()
+
+    def unregister(self, client: QuoteClient) -> None:
+        client.closed = True
+        client.wakeup.set()
+        self.unsubscribe(client, list(client.symbols))
+        self.clients.discard(client)
+
+    def subscribe(self, client: QuoteClient, symbols: List[str]) -> List[str]:
+        room = MAX_SYMBOLS_PER_CLIENT - len(client.symbols)
+        added = [s for s in symbols if s not in client.symbols][: max(room, 0)]
+        for s in added:
+            client.symbols.add(s)
+            client.awaiting_snapshot.add(s)
+            self.subs.setdefault(s, set()).add(client)
+        return added
+
+    def unsubscribe(self, client: QuoteClient, symbols: List[str]) -> List[str]:
+        removed = []
+        for s in symbols:
+            if s not in client.symbols:
+                continue
+            client.symbols.discard(s)
+            client.awaiting_snapshot.discard(s)
+            client.pending.pop(s, None)
+            subs = self.subs.get(s)
+            if subs is not None:
+                subs.discard(client)
+                if not subs:
+                    del self.subs[s]
+            removed.append(s)
+        return removed
+
+    async def snapshot(self, client: QuoteClient, symbols: List[str]) -> Dict[str, Any]:
+        """
+        Current live:cm:symbol:<SYM> hashes for symbols just subscribed by
+        client, minus the ones a tick already reached while reading.
+        """
+        try:
+            data = await read_live_quotes(symbols)
+            return {s: q for s, q in data.items() if s in client.awaiting_snapshot}
+        finally:
+            client.awaiting_snapshot.difference_update(symbols)
+
+    def metrics(self) -> Dict[str, Any]:
+        pending = [len(c.pending) for c in self.clients]
+        return {
+            "listening": self._task is not None and not self._task.done(),
+            "clients": len(self.clients),
+            "symbols_subscribed": len(self.subs),
+            "subscriptions": sum(len(c.symbols) for c in self.clients),
+            "messages_in": self.messages_in,
+            "deliveries": self.deliveries,
+            "coalesced": self.coalesced,
+            "pending_total": sum(pending),
+            "pending_max": max(pending) if pending else 0,
+            "clients_backlogged": sum(1 for p in pending if p),
+            "slow_disconnects": self.slow_disconnects,
+            "reconnects": self.reconnects,
+            "last_message_age_sec": round(time.time() - self.last_message_at, 3) if self.last_message_at else None,
+            "uptime_sec": round(time.time() - self.started_at, 1),
+        }
+
+
+# one hub per worker process
+hub = QuoteHub()
@@ -0,0 +1,277 @@
+# utils/Market/response_cache.py
+
+"""
+Ingestion-versioned response cache (Redis, shared by all workers).
+
+Market endpoints only change when a new CM30 seq / bhavcopy is committed, so
+ingestion bumps ONE counter after every commit:
+
+    market:data_version             INCR by ingestion
+
+and responses are cached under the version they were computed at:
+
+    rc:<route>:<data_version>:<sha1(normalized params)>   -> JSON bytes
+
+A new seq => new version => old keys are simply never read again (TTL
+cleans them up). Nothing is ever served across a version change.
+
+Cache stampede on a version bump is avoided with a short SET NX build lock:
+one worker computes, the others wait briefly for its result.
+
+Home-page widgets are additionally PRE-RENDERED by ingestion (see
+utils/Market/widget_prerender.py) into one hash per (route, params):
+
+    pre:<route>:<sha1(params)>      v | identity | gzip | br
+
+Routes read that hash together with data_version in a single pipelined
+round trip and stream the matching Content-Encoding variant untouched.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import orjson
+import redis
+import redis.asyncio as aredis
+from fastapi.responses import Response
+
+from db.redis_pool import get_async_redis, get_sync_redis
+from utils.Http.json_response import orjson_dumps
+from utils.Http.response_middleware import variant_etag
+from utils.Market.content_encoding import IDENTITY, acceptable, encode_variants
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION_KEY = "market:data_version"
+CACHE_PREFIX = "rc"
+CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+PRERENDER_PREFIX = "pre"
+
+LOCK_TTL_MS = 10_000
+LOCK_WAIT_SECONDS = 3.0
+LOCK_POLL_SECONDS = 0.05
+
+def _sync_redis() -> redis.Redis:
+    return get_sync_redis(decode=False)
+
+
+def _async_redis() -> aredis.Redis:
+    return get_async_redis(decode=False)
+
+
+def dumps(payload: Any) -> bytes:
+    return orjson_dumps(payload)
+
+
+def _params_hash(params: Dict[str, Any]) -> str:
+    return hashlib.sha1(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def cache_key(route: str, version: int, params: Dict[str, Any]) -> str:
+    return f"{CACHE_PREFIX}:{route}:{version}:{_params_hash(params)}"
+
+
+def prerender_key(route: str, params: Dict[str, Any]) -> str:
+    return f"{PRERENDER_PREFIX}:{route}:{_params_hash(params)}"
+
+
+def _version_etag(route: str, version: int, params: Dict[str, Any]) -> str:
+    # same data_version + params => same bytes, no need to hash the body
+    return f'"{route}-{version}-{_params_hash(params)[:12]}"'
+
+
+def _json_response(
+    body: bytes,
+    status: str,
+    version: Optional[int],
+    etag: Optional[str] = None,
+    encoding: str = IDENTITY,
+) -> Response:
+    headers = {"X-Cache": status, "Vary": "Accept-Encoding"}
+    if version is not None:
+        headers["X-Data-Version"] = str(version)
+    if etag:
+        headers["ETag"] = variant_etag(etag, encoding)
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _prerender_encodings(accept_encoding: str) -> List[str]:
+    # identity last-resort so an encoding missing from the hash (no brotli on
+    # the ingestion box) still resolves in the same round trip
+    encs = acceptable(accept_encoding)
+    return encs if IDENTITY in encs else encs + [IDENTITY]
+
+
+def _prerendered(version: int, etag: str, encs: List[str], values) -> Optional[Response]:
+    v, *bodies = values
+    if v is None or int(v) != version:
+        return None
+    for enc, body in zip(encs, bodies):
+        if body is not None:
+            return _json_response(body, "PRE", version, etag, enc)
+    return None
+
+
+# ======================================================================
+#  Write side (ingestion)
+# ======================================================================
+
+def bump_data_version(rds: Optional[redis.Redis] = None) -> int:
+    """Call after every ingestion commit that changes market data."""
+    return int((rds or _sync_redis()).incr(DATA_VERSION_KEY))
+
+
+def safe_bump_data_version(tag: str) -> None:
+    try:
+        bump_data_version()
+    except Exception as e:
+        print(f"[{tag}] ⚠️ data_version bump failed: {e}")
+
+
+def current_data_version(rds: Optional[redis.Redis] = None) -> int:
+    return int((rds or _sync_redis()).get(DATA_VERSION_KEY) or 0)
+
+
+def store_prerendered(
+    route: str,
+    params: Dict[str, Any],
+    version: int,
+    payload: Any,
+    rds: Optional[redis.Redis] = None,
+) -> int:
+    """Encode payload once (identity/gzip/br) and store it for `version`. Returns identity size."""
+    rds = rds or _sync_redis()
+    variants = encode_variants(dumps(payload))
+    key = prerender_key(route, params)
+    pipe = rds.pipeline()
+    pipe.hset(key, mapping={"v": str(version), **variants})
+    pipe.expire(key, CACHE_TTL_SECONDS)
+    pipe.execute()
+    return len(variants[IDENTITY])
+
+
+# ======================================================================
+#  Read side (routes)
+# ======================================================================
+
+def cached_json(
+    route: str,
+    params: Dict[str, Any],
+    compute: Callable[[], Any],
+    accept_encoding: str = "",
+) -> Response:
+    """
+    Sync routes: return the pre-rendered / cached bytes for the current
+    data_version, else compute(), store and return. Redis problems => plain
+    compute (uncached). Exceptions from compute() (HTTPException etc.)
+    propagate and are not cached.
+    """
+    try:
+        rds = _sync_redis()
+        encs = _prerender_encodings(accept_encoding)
+        pipe = rds.pipeline(transaction=False)
+        pipe.get(DATA_VERSION_KEY)
+        pipe.hmget(prerender_key(route, params), "v", *encs)
+        raw_version, pre = pipe.execute()
+        version = int(raw_version or 0)
+
+        etag = _version_etag(route, version, params)
+        hit = _prerendered(version, etag, encs, pre)
+        if hit is not None:
+            return hit
+
+        key = cache_key(route, version, params)
+
+        body = rds.get(key)
+        if body is not None:
+            return _json_response(body, "HIT", version, etag)
+
+        lock_key = f"{key}:lock"
+        have_lock = bool(rds.set(lock_key, b"1", nx=True, px=LOCK_TTL_MS))
+        if not have_lock:
+            deadline = time.monotonic() + LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                body = rds.get(key)
+                if body is not None:
+                    return _json_response(body, "HIT", version, etag)
+    except Exception as e:
+        logger.warning(f"[RC] cache read failed for {route}: {e}")
+        return _json_response(dumps(compute()), "BYPASS", None)
+
+    try:
+        body = dumps(compute())
+    finally:
+        if have_lock:
+            try:
+                rds.delete(lock_key)
+            except Exception:
+                pass
+
+    try:
+        rds.set(key, body, ex=CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"[RC] cache write failed for {route}: {e}")
+    return _json_response(body, "MISS", version, etag)
+
+
+async def cached_json_async(
+    route: str,
+    params: Dict[str, Any],
+    compute: Callable[[], Awaitable[Any]],
+    accept_encoding: str = "",
+) -> Response:
+    """Async twin of cached_json()."""
+    try:
+        rds = _async_redis()
+        encs = _prerender_encodings(accept_encoding)
+        pipe = rds.pipeline(transaction=False)
+        pipe.get(DATA_VERSION_KEY)
+        pipe.hmget(prerender_key(route, params), "v", *encs)
+        raw_version, pre = await pipe.execute()
+        version = int(raw_version or 0)
+
+        etag = _version_etag(route, version, params)
+        hit = _prerendered(version, etag, encs, pre)
+        if hit is not None:
+            return hit
+
+        key = cache_key(route, version, params)
+
+        body = await rds.get(key)
+        if body is not None:
+            return _json_response(body, "HIT", version, etag)
+
+        lock_key = f"{key}:lock"
+        have_lock = bool(await rds.set(lock_key, b"1", nx=True, px=LOCK_TTL_MS))
+        if not have_lock:
+            deadline = time.monotonic() + LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                body = await rds.get(key)
+                if body is not None:
+                    return _json_response(body, "HIT", version, etag)
+    except Exception as e:
+        logger.warning(f"[RC] cache read failed for {route}: {e}")
+        return _json_response(dumps(await compute()), "BYPASS", None)
+
+    try:
+        body = dumps(await compute())
+    finally:
+        if have_lock:
+            try:
+                await rds.delete(lock_key)
+            except Exception:
+                pass
+
+    try:
+        await rds.set(key, body, ex=CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"[RC] cache write failed for {route}: {e}")
+    return _json_response(body, "MISS", version, etag)
@@ -0,0 +1,256 @@
+# utils/Market/sparkline_store.py
+
+"""
+Intraday sparkline buffers kept in Redis.
+
+Ingestion appends ONE packed point per token / index for every CM30 seq
+(plain Redis APPEND on a string key), so the buffer grows by a few bytes
+per minute. The read path never pulls the whole day:
+
+  1) pipelined STRLEN for all ids      -> number of points per id
+  2) pipelined GETRANGE for the picks  -> only the 10 sampled points
+
+so sparkline cost stays flat with time-of-day and universe size.
+
+Layout (little-endian, 12 bytes per point):
+    <i4 epoch seconds (UTC)> <f8 last price>
+
+Keys:
+    spark:cm:<YYYYMMDD>:<token_id>
+    spark:ind:<YYYYMMDD>:<index_id>
+    spark:<kind>:<YYYYMMDD>:seq   -> last seq appended (buffer is complete up to it)
+"""
+
+import os
+import struct
+import logging
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db.redis_pool import get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+SPARK_TTL_SECONDS = int(os.getenv("SPARK_TTL_SECONDS", "172800"))  # 2 days
+
+KIND_CM = "cm"
+KIND_IND = "ind"
+
+POINT = struct.Struct("<id")
+POINT_SIZE = POINT.size
+
+SAMPLE_POINTS = 10
+
+
+def _get_redis() -> redis.Redis:
+    # raw bytes in/out (packed arrays), NOT decode_responses
+    return get_sync_redis(decode=False)
+
+
+def _day(trade_date: date) -> str:
+    return trade_date.strftime("%Y%m%d")
+
+
+def _key(kind: str, trade_date: date, ident: int) -> str:
+    return f"spark:{kind}:{_day(trade_date)}:{int(ident)}"
+
+
+def _seq_key(kind: str, trade_date: date) -> str:
+    return f"spark:{kind}:{_day(trade_date)}:seq"
+
+
+def _pack(ts: datetime, price: float) -> bytes:
+    return POINT.pack(int(ts.timestamp()), float(price))
+
+
+def _unpack(buf: bytes) -> Dict[str, Any]:
+    epoch, price = POINT.unpack(buf)
+    return {
+        "interval_start": datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat(),
+        "last": price,
+    }
+
+
+def sample_indexes(n: int, target: int = SAMPLE_POINTS) -> List[int]:
+    """
+    Same picks as the DB samplers: first, last and evenly spaced in between.
+    """
+    if n <= target:
+        return list(range(n))
+    return [int(i * (n - 1) / (target - 1)) for i in range(target)]
+
+
+# ======================================================================
+#  Write path (ingestion)
+# ======================================================================
+
+def buffered_seq(kind: str, trade_date: date, rds: Optional[redis.Redis] = None) -> Optional[int]:
+    """
+    Last seq appended for (kind, trade_date), or None if the buffer is not
+    authoritative for that day (never built / redis flushed).
+    """
+    rds = rds or _get_redis()
+    raw = rds.get(_seq_key(kind, trade_date))
+    if raw is None:
+        return None
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+def append_points(
+    kind: str,
+    trade_date: date,
+    seq: int,
+    points: Dict[int, Tuple[datetime, float]],
+    rds: Optional[redis.Redis] = None,
+) -> None:
+    """
+    points: {id: (interval_start, last)} -> one APPEND per id, single round-trip.
+    """
+    rds = rds or _get_redis()
+    pipe = rds.pipeline(transaction=False)
+
+    for ident, (ts, price) in points.items():
+        if ts is None or price is None:
+            continue
+        key = _key(kind, trade_date, ident)
+        pipe.append(key, _pack(ts, price))
+        pipe.expire(key, SPARK_TTL_SECONDS)
+
+    pipe.set(_seq_key(kind, trade_date), int(seq), ex=SPARK_TTL_SECONDS)
+    pipe.execute()
+
+
+def invalidate(kind: str, trade_date: date, rds: Optional[redis.Redis] = None) -> None:
+    """
+    Drop the completeness marker (a seq could not be appended) so the next
+    ingestion run rebuilds the day from DB and routes fall back meanwhile.
+    """
+    rds = rds or _get_redis()
+    rds.delete(_seq_key(kind, trade_date))
+
+
+_REBUILD_SQL = {
+    KIND_CM: """
+        SELECT token_id AS ident, interval_start, COALESCE(last_price, close_price) AS last
+        FROM nse_cm_intraday_1min
+        WHERE trade_date = :td
+        ORDER BY token_id, interval_start
+    """,
+    KIND_IND: """
+        SELECT index_id AS ident, interval_start, last_price AS last
+        FROM nse_cm_indices_1min
+        WHERE trade_date = :td
+          AND index_id IS NOT NULL
+        ORDER BY index_id, interval_start
+    """,
+}
+
+
+def rebuild_from_db(
+    db: Session,
+    kind: str,
+    trade_date: date,
+    seq: int,
+    rds: Optional[redis.Redis] = None,
+) -> int:
+    """
+    One-time backfill when the buffer is missing for a day that already has
+    committed seqs (app restarted mid-session, redis flushed, ...).
+    Returns number of ids written.
+    """
+    rds = rds or _get_redis()
+    rows = db.execute(text(_REBUILD_SQL[kind]), {"td": trade_date})
+
+    packed: Dict[int, bytearray] = {}
+    for ident, ts, last in rows:
+        if ident is None or ts is None or last is None:
+            continue
+        packed.setdefault(int(ident), bytearray()).extend(_pack(ts, float(last)))
+
+    pipe = rds.pipeline(transaction=False)
+    for ident, buf in packed.items():
+        pipe.set(_key(kind, trade_date, ident), bytes(buf), ex=SPARK_TTL_SECONDS)
+    pipe.set(_seq_key(kind, trade_date), int(seq), ex=SPARK_TTL_SECONDS)
+    pipe.execute()
+
+    return len(packed)
+
+
+# ======================================================================
+#  Read path (routes)
+# ======================================================================
+
+def sample_points(
+    kind: str,
+    trade_date: date,
+    ids: Iterable[int],
+    target: int = SAMPLE_POINTS,
+    rds: Optional[redis.Redis] = None,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Returns {id: [{interval_start, last} x target]} for ids that have a buffer.
+    Ids missing from the result must be served by the DB fallback.
+    Empty dict if the buffer is not authoritative for trade_date.
+    """
+    ids = [int(i) for i in ids]
+    if not ids or trade_date is None:
+        return {}
+
+    rds = rds or _get_redis()
+
+    if buffered_seq(kind, trade_date, rds) is None:
+        return {}
+
+    pipe = rds.pipeline(transaction=False)
+    for ident in ids:
+        pipe.strlen(_key(kind, trade_date, ident))
+    sizes = pipe.execute()
+
+    picks: List[Tuple[int, List[int]]] = []
+    pipe = rds.pipeline(transaction=False)
+    for ident, size in zip(ids, sizes):
+        n = int(size or 0) // POINT_SIZE
+        if n == 0:
+            continue
+        idxs = sample_indexes(n, target)
+        picks.append((ident, idxs))
+        key = _key(kind, trade_date, ident)
+        for i in idxs:
+            start = i * POINT_SIZE
+            pipe.getrange(key, start, start + POINT_SIZE - 1)
+
+    if not picks:
+        return {}
+
+    raw = pipe.execute()
+
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    pos = 0
+    for ident, idxs in picks:
+        chunk = raw[pos:pos + len(idxs)]
+        pos += len(idxs)
+        out[ident] = [_unpack(b) for b in chunk if b and len(b) == POINT_SIZE]
+    return out
+
+
+def safe_sample_points(
+    kind: str,
+    trade_date: date,
+    ids: Iterable[int],
+    target: int = SAMPLE_POINTS,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    sample_points() that never raises: redis issues => {} (callers fall back to DB).
+    """
+    try:
+        return sample_points(kind, trade_date, ids, target)
+    except Exception as e:
+        logger.warning(f"[SPARK] buffer read failed ({kind} {trade_date}): {e}")
+        return {}
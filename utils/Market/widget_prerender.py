@@ -0,0 +1,90 @@
+# utils/Market/widget_prerender.py
+
+"""
+Push-based pre-rendering of the home-page widgets.
+
+Every visitor of the home page asks for the same handful of payloads
+(NIFTY100 marquee, most traded, NIFTY100 gainers / losers, index tiles).
+After ingestion commits (and bumps market:data_version) the worker renders
+each of them ONCE with the sync executors of the routes, encodes the bytes
+(identity / gzip / br) and stores them via store_prerendered().
+
+Routes look them up inside cached_json*(): params here MUST match what the
+routes pass, otherwise the lookup simply misses and the normal cache path
+serves the request.
+"""
+
+from typing import Any, Callable, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from db.connection import SessionLocal
+from db.redis_pool import get_sync_redis
+from utils.Market.response_cache import (
+    current_data_version,
+    store_prerendered,
+)
+
+RENDERED_VERSION_KEY = "pre:rendered_version"
+
+Widget = Tuple[str, dict, Callable[[Session], Any]]
+
+
+def _widgets() -> List[Widget]:
+    # route modules imported lazily: ingestion scripts should not pay for
+    # (or cycle through) the FastAPI routers unless they actually prerender
+    from routes.NSE.Market_And_Sectors import (
+        DEFAULT_INDICES,
+        _market_and_sectors_payload,
+        _resolve_index_ids,
+    )
+    from routes.NSE.Most_Traded import _compute_most_traded
+    from routes.NSE.Todays_Stock import _compute_todays_stock
+    from routes.NSE.Top_Marqee import _compute_top_marqee
+
+    index_ids = _resolve_index_ids(DEFAULT_INDICES.split(","))
+
+    widgets: List[Widget] = [
+        ("top-marqee", {}, _compute_top_marqee),
+        ("most-traded", {"index": "ALL", "limit": 10}, lambda db: _compute_most_traded(db, "ALL", 10)),
+        ("market-and-sectors", {"indices": index_ids}, lambda db: _market_and_sectors_payload(db, index_ids)),
+    ]
+    for f in ("GAINERS", "LOSERS"):
+        widgets.append((
+            "todays-stock",
+            {"index": "NIFTY100", "filter": f, "limit": 10},
+            lambda db, f=f: _compute_todays_stock(db, "NIFTY100", f, 10),
+        ))
+    return widgets
+
+
+def prerender_widgets(tag: str = "PRE") -> None:
+    """
+    Render all widgets for the current data_version (no-op if that version
+    was already rendered). Never raises: a failed widget just falls back to
+    the on-demand cache path in the route.
+    """
+    try:
+        rds = get_sync_redis(decode=False)
+        version = current_data_version(rds)
+        if int(rds.get(RENDERED_VERSION_KEY) or -1) == version:
+            return
+    except Exception as e:
+        print(f"[{tag}] ⚠️ prerender skipped (redis): {e}")
+        return
+
+    db: Session = SessionLocal()
+    try:
+        for route, params, compute in _widgets():
+            try:
+                size = store_prerendered(route, params, version, compute(db), rds=rds)
+                print(f"[{tag}] ✅ prerendered {route} {params} v={version} ({size} bytes)")
+            except Exception as e:
+                db.rollback()
+                print(f"[{tag}] ⚠️ prerender failed for {route} {params}: {e}")
+
+        rds.set(RENDERED_VERSION_KEY, version)
+    except Exception as e:
+        print(f"[{tag}] ⚠️ prerender failed: {e}")
+    finally:
+        db.close()
@@ -10,6 +10,9 @@ from sqlalchemy.dialects.postgresql import insert  # ✅ UPSERT ke liye
 
 from db.connection import SessionLocal
 from db.models import NseCmBhavcopy, NseCmSecurity
+from utils.Market.candle_rollups import refresh_period_rollups
+from utils.Market.response_cache import safe_bump_data_version
+from utils.Market.widget_prerender import prerender_widgets
 from sftp.NSE.sftp_client import SFTPClient
 
 
@@ -367,6 +370,18 @@ def process_cm_bhavcopy_for_date(trade_date: date) -> None:
             f"rows={len(rows_to_insert)} (deduped, conflict-safe)"
         )
 
+        # ✅ weekly / monthly rollups for the period containing this date
+        try:
+            refresh_period_rollups(db, trade_date)
+            db.commit()
+            print(f"[CM-BHAV] ✅ 1w / 1M rollups refreshed for {trade_date}")
+        except Exception as e:
+            db.rollback()
+            print(f"[CM-BHAV] ⚠️ 1w / 1M rollup refresh failed for {trade_date}: {e}")
+
+        safe_bump_data_version("CM-BHAV")
+        prerender_widgets("CM-BHAV-PRE")
+
     except Exception as e:
         db.rollback()
         print(f"[CM-BHAV] ❌ ERROR for date {trade_date}: {e}")
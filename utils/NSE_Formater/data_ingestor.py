@@ -15,6 +15,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select
 
 from db.connection import SessionLocal
+from db.redis_pool import get_sync_redis
 from db.models import NseIngestionLog
 from db.models import (
     NseCmIntraday1Min,
@@ -25,6 +26,22 @@ from db.models import (
 from sftp.NSE.sftp_client import SFTPClient
 from utils.NSE_Formater.parser import parse_mkt, parse_ind
 from utils.NSE_Formater.security_format import SecuritiesConverter
+from utils.Market.sparkline_store import (
+    KIND_CM,
+    KIND_IND,
+    append_points,
+    buffered_seq,
+    invalidate as invalidate_spark_buffer,
+    rebuild_from_db,
+)
+from utils.Market.candle_rollups import (
+    mark_intraday_rollups,
+    rebuild_intraday_rollups,
+    refresh_intraday_rollups,
+)
+from utils.Market.intraday_store import publish_seq as publish_intraday_seq
+from utils.Market.response_cache import safe_bump_data_version
+from utils.Market.widget_prerender import prerender_widgets
 from sqlalchemy.sql import expression
 
 IST = ZoneInfo("Asia/Kolkata")
@@ -36,13 +53,12 @@ PRICE_SCALE = 100.0
 #  REDIS (LIVE CACHE + PUBSUB)
 # ======================================================================
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
 LIVE_TTL_SECONDS = int(os.getenv("LIVE_TTL_SECONDS", "21600"))  # 6 hours default
 LIVE_PUBLISH = os.getenv("LIVE_PUBLISH", "true").lower() in ("1", "true", "yes", "y")
 
 def get_redis() -> redis.Redis:
-    # decode_responses=True -> str in/out (easy for hash + JSON)
-    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    # shared pool (db/redis_pool.py); decode_responses=True -> str in/out (easy for hash + JSON)
+    return get_sync_redis(decode=True)
 
 def _hset_mapping_str(pipe, key: str, payload: Dict[str, Any]):
     # Redis hash mapping requires string/bytes/int/float; we convert None -> ""
@@ -130,9 +146,86 @@ def publish_latest_quotes_by_symbol(
 
 
 # ======================================================================
-#  Generic helpers
+#  SPARKLINE BUFFERS (per token / per index, see utils/Market/sparkline_store.py)
 # ======================================================================
 
+def _ensure_spark_buffer(db: Session, kind: str, trade_date: date, done_seqs: set) -> bool:
+    """
+    Buffer must cover every committed seq of the day before we start appending.
+    - no seq committed yet               -> fresh day, appends build it
+    - marker == last committed seq       -> ok
+    - no marker, or an older / other seq -> rebuild from DB (a crash or redis
+      error between commit and APPEND lost a seq; APPEND is not idempotent,
+      so appending on top of that buffer would keep the hole)
+    Returns False if the buffer could not be made complete (skip appends, routes use DB).
+    """
+    if not done_seqs:
+        return True
+    try:
+        last = max(done_seqs)
+        marker = buffered_seq(kind, trade_date)
+        if marker == last:
+            return True
+        n = rebuild_from_db(db, kind, trade_date, seq=last)
+        print(f"[SPARK] Rebuilt {kind} buffer for {trade_date} from DB (marker={marker}, last seq={last}): ids={n}")
+        return True
+    except Exception as e:
+        print(f"[SPARK] ⚠️ buffer rebuild failed for {kind} {trade_date}: {e}")
+        return False
+
+
+def _spark_points(rows, id_attr: str, price_attrs: tuple) -> Dict[int, tuple]:
+    """
+    Last row per id in this seq -> {id: (interval_start, price)}
+    """
+    points: Dict[int, tuple] = {}
+    for r in rows:
+        ident = getattr(r, id_attr, None)
+        if ident is None:
+            continue
+        price = None
+        for attr in price_attrs:
+            price = getattr(r, attr, None)
+            if price is not None:
+                break
+        if price is None:
+            continue
+        points[int(ident)] = (r.interval_start, float(price))
+    return points
+
+
+# ======================================================================
+#  CANDLE ROLLUPS (5m / 15m / 30m / 1h, see utils/Market/candle_rollups.py)
+# ======================================================================
+
+# trade_dates whose rollups were fully rebuilt by this process
+_ROLLUPS_BUILT: set = set()
+
+
+def _refresh_candle_rollups(db: Session, trade_date: date, bars: List[NseCmIntraday1Min]) -> None:
+    """
+    After a seq commit: refresh only the buckets touched by its bars.
+    First call per trade_date in this process does a full-day rebuild instead
+    (covers seqs ingested before a restart / deploy). Both stamp the day's
+    rollup watermark; a failure leaves it behind until the next rebuild.
+    """
+    try:
+        if trade_date not in _ROLLUPS_BUILT:
+            if not bars:
+                return
+            rebuild_intraday_rollups(db, trade_date)
+            _ROLLUPS_BUILT.add(trade_date)
+        elif bars:
+            refresh_intraday_rollups(db, trade_date, since=min(b.interval_start for b in bars))
+        else:
+            mark_intraday_rollups(db, trade_date)  # nothing to fold, still current
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        _ROLLUPS_BUILT.discard(trade_date)
+        print(f"[ROLLUP] ⚠️ candle rollup refresh failed for {trade_date}: {e}")
+
+
 def _safe_price(v: int | float | None) -> float | None:
     """
     CM equity / index values usually in paise. Divide by 100.
@@ -449,6 +542,8 @@ def process_cm30_mkt_folder(remote_dir: str) -> None:
         # ✅ Existing token_ids cache
         existing_token_ids = {t[0] for t in db.query(NseCmSecurity.token_id).all()}
 
+        spark_ready = _ensure_spark_buffer(db, KIND_CM, trade_date, done_seqs)
+
         skipped = 0
         processed = 0
 
@@ -565,6 +660,35 @@ def process_cm30_mkt_folder(remote_dir: str) -> None:
                 # do not break ingestion on redis issues
                 print(f"[CM30-MKT] ⚠️ LIVE publish failed for seq={seq}: {e}")
 
+            # ✅ Sparkline buffer: one point per token for this seq
+            if spark_ready:
+                try:
+                    append_points(
+                        KIND_CM, trade_date, seq,
+                        _spark_points(bars, "token_id", ("last_price", "close_price")),
+                    )
+                except Exception as e:
+                    spark_ready = False
+                    print(f"[CM30-MKT] ⚠️ sparkline append failed for seq={seq}: {e}")
+                    try:
+                        invalidate_spark_buffer(KIND_CM, trade_date)
+                    except Exception:
+                        pass
+
+            # ✅ Worker in-memory intraday stores: this seq's bars, one binary message
+            try:
+                publish_intraday_seq(KIND_CM, trade_date, seq, bars, "token_id")
+            except Exception as e:
+                print(f"[CM30-MKT] ⚠️ intraday broadcast failed for seq={seq}: {e}")
+
+            # ✅ 5m / 15m / 30m / 1h rollups for the buckets this seq touched
+            _refresh_candle_rollups(db, trade_date, bars)
+
+            # ✅ new data_version => cached market responses recompute on next read
+            safe_bump_data_version("CM30-MKT")
+            # ✅ home-page widgets rendered once for that version (every seq, not per call)
+            prerender_widgets("CM30-MKT-PRE")
+
         print(f"[CM30-MKT] Done folder {remote_dir} | processed={processed}, skipped={skipped}")
 
     except Exception as e:
@@ -619,6 +743,8 @@ def process_cm30_ind_folder(remote_dir: str) -> None:
         skipped = 0
         processed = 0
 
+        spark_ready = _ensure_spark_buffer(db, KIND_IND, trade_date, done_seqs)
+
         for remote_path in ind_paths:
             file_name = os.path.basename(remote_path)  # "79.ind.gz"
             seq_str = file_name.split(".")[0]
@@ -703,6 +829,32 @@ def process_cm30_ind_folder(remote_dir: str) -> None:
             processed += 1
             print(f"[CM30-IND] ✅ Committed data for {file_name}")
 
+            # ✅ Sparkline buffer: one point per index for this seq
+            if spark_ready:
+                try:
+                    append_points(
+                        KIND_IND, trade_date, seq,
+                        _spark_points(rows, "index_id", ("last_price",)),
+                    )
+                except Exception as e:
+                    spark_ready = False
+                    print(f"[CM30-IND] ⚠️ sparkline append failed for seq={seq}: {e}")
+                    try:
+                        invalidate_spark_buffer(KIND_IND, trade_date)
+                    except Exception:
+                        pass
+
+            # ✅ Worker in-memory intraday stores: this seq's bars, one binary message
+            try:
+                publish_intraday_seq(KIND_IND, trade_date, seq, rows, "index_id")
+            except Exception as e:
+                print(f"[CM30-IND] ⚠️ intraday broadcast failed for seq={seq}: {e}")
+
+            # ✅ new data_version => cached market responses recompute on next read
+            safe_bump_data_version("CM30-IND")
+            # ✅ home-page widgets rendered once for that version (every seq, not per call)
+            prerender_widgets("CM30-IND-PRE")
+
         print(f"[CM30-IND] Done folder {remote_dir} | processed={processed}, skipped={skipped}")
 
     except Exception as e: